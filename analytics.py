@@ -0,0 +1,317 @@
+import logging
+import time
+
+import numpy as np
+
+from match_engine import BALL, BALLS_PER_OVER, NO_BALL, NO_EXTRA, WIDE, MatchEngine
+
+logger = logging.getLogger(__name__)
+
+# One row per delivery, legal or not
+COLUMNS = (
+    ("runs", np.int16),         # off the bat
+    ("extras", np.int16),
+    ("extra_type", np.int8),
+    ("wicket", np.bool_),
+    ("legal", np.bool_),
+    ("over", np.int16),         # 0-based over it was bowled in
+    ("ball", np.int16),         # legal balls in the innings after it
+    ("batter", np.int16),       # the striker's index in Innings.batters
+    ("non_striker", np.int16),
+    ("bowler", np.int16),       # bowler id, in order of first delivery in the innings
+    ("partnership", np.int16),  # wickets down when it was bowled
+    ("score", np.int32)         # innings total after it: the worm
+)
+
+# Run rates (per over) projections are also shown at, besides the current and recent ones
+PROJECTION_RATES = (6.0, 8.0, 10.0)
+# Weights of the last few complete overs, oldest first, for the "on current form" rate
+FORM_WEIGHTS = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+
+
+def _grown(array, size):
+    """array, or a copy at least twice as long when it can't hold size entries"""
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class InningsColumns:
+    """One innings ball by ball as NumPy columns, with its chart series kept up to date.
+
+    append() adds a delivery and pop() takes the last one off again (undo).
+    The columns are preallocated and doubled when full. Alongside them the
+    runs and wickets in each over (the Manhattan), the score at the end of
+    each over (the worm), each partnership's runs, balls and batters, and
+    the dot ball and boundary counts are updated in place by every
+    delivery, so nothing is ever recomputed from the columns. version
+    counts changes, for caching what is drawn from them.
+    """
+
+    def __init__(self, max_overs=20):
+        capacity = max_overs * BALLS_PER_OVER + 2 * max_overs
+        self.columns = {name: np.zeros(capacity, dtype) for name, dtype in COLUMNS}
+        self.length = 0
+        self.over_runs = np.zeros(max_overs, np.int32)
+        self.over_wickets = np.zeros(max_overs, np.int16)
+        self.over_score = np.zeros(max_overs, np.int32)
+        self.overs = 0  # overs with at least one delivery
+        self.partnership_runs = np.zeros(11, np.int32)
+        self.partnership_balls = np.zeros(11, np.int16)
+        self.partnership_pair = np.zeros((11, 2), np.int16)
+        self.bowler_ids = {}
+        self.legal_balls = self.dots = self.fours = self.sixes = 0
+        self.version = 0
+
+    def __len__(self):
+        return self.length
+
+    def column(self, name):
+        """A view of a column's filled part"""
+        return self.columns[name][:self.length]
+
+    def append(self, runs, extras, extra_type, wicket, over, batter, non_striker, bowler, partnership):
+        i = self.length
+        if i == len(self.columns["score"]):
+            self.columns = {name: _grown(column, i + 1) for name, column in self.columns.items()}
+        legal = extra_type not in (WIDE, NO_BALL)
+        total = runs + extras
+        score = (self.columns["score"][i - 1] if i else 0) + total
+        bowler_id = self.bowler_ids.setdefault(bowler, len(self.bowler_ids))
+        self.legal_balls += legal
+        row = (runs, extras, extra_type, wicket, legal, over, self.legal_balls, batter, non_striker, bowler_id,
+               partnership, score)
+        for (name, _), value in zip(COLUMNS, row):
+            self.columns[name][i] = value
+        self.length += 1
+
+        if over >= len(self.over_runs):
+            self.over_runs = _grown(self.over_runs, over + 1)
+            self.over_wickets = _grown(self.over_wickets, over + 1)
+            self.over_score = _grown(self.over_score, over + 1)
+        if over >= self.overs:
+            # A new over starts from the previous one's total
+            self.over_score[self.overs:over + 1] = self.over_score[self.overs - 1] if self.overs else 0
+            self.overs = over + 1
+        self.over_runs[over] += total
+        self.over_wickets[over] += wicket
+        self.over_score[over] = score
+
+        if partnership >= len(self.partnership_runs):
+            self.partnership_runs = _grown(self.partnership_runs, partnership + 1)
+            self.partnership_balls = _grown(self.partnership_balls, partnership + 1)
+            self.partnership_pair = _grown(self.partnership_pair, partnership + 1)
+        self.partnership_runs[partnership] += total
+        self.partnership_balls[partnership] += legal
+        self.partnership_pair[partnership] = (batter, non_striker)
+
+        self.dots += legal and total == 0
+        if extra_type == NO_EXTRA:
+            self.fours += runs == 4
+            self.sixes += runs == 6
+        self.version += 1
+
+    def pop(self):
+        """Take the last delivery off again"""
+        if not self.length:
+            return
+        self.length -= 1
+        i = self.length
+        row = {name: column[i].item() for name, column in self.columns.items()}
+        total = row["runs"] + row["extras"]
+        legal, over, partnership = row["legal"], row["over"], row["partnership"]
+        self.legal_balls -= legal
+
+        self.over_runs[over] -= total
+        self.over_wickets[over] -= row["wicket"]
+        if i and self.columns["over"][i - 1] == over:
+            self.over_score[over] = self.columns["score"][i - 1]
+        else:
+            self.overs = over
+            self.over_score[over] = 0
+
+        self.partnership_runs[partnership] -= total
+        self.partnership_balls[partnership] -= legal
+        if i and self.columns["partnership"][i - 1] == partnership:
+            self.partnership_pair[partnership] = (self.columns["batter"][i - 1], self.columns["non_striker"][i - 1])
+        else:
+            self.partnership_pair[partnership] = 0
+
+        self.dots -= legal and total == 0
+        if row["extra_type"] == NO_EXTRA:
+            self.fours -= row["runs"] == 4
+            self.sixes -= row["runs"] == 6
+        self.version += 1
+
+    # Series, all views or fixed-size vector ops
+
+    def worm(self):
+        """(overs bowled, score) at the end of each over; the last point is the current partial over"""
+        overs = np.arange(1, self.overs + 1, dtype=float)
+        if self.overs and self.legal_balls % BALLS_PER_OVER:
+            overs[-1] = self.legal_balls / BALLS_PER_OVER
+        return overs, self.over_score[:self.overs]
+
+    def manhattan(self):
+        """(runs, wickets) in each over"""
+        return self.over_runs[:self.overs], self.over_wickets[:self.overs]
+
+    def partnerships(self):
+        """(runs, balls, (batter, batter)) for every partnership so far, the current one last"""
+        count = int(self.column("partnership")[-1]) + 1 if self.length else 0
+        return self.partnership_runs[:count], self.partnership_balls[:count], self.partnership_pair[:count]
+
+    def dot_ball_pct(self):
+        return 100.0 * self.dots / self.legal_balls if self.legal_balls else 0.0
+
+    def form_rate(self):
+        """Runs per over over the last few complete overs, recent ones weighted more; None before the first"""
+        complete = self.legal_balls // BALLS_PER_OVER
+        recent = self.over_runs[max(0, complete - len(FORM_WEIGHTS)):complete]
+        if not len(recent):
+            return None
+        weights = FORM_WEIGHTS[-len(recent):]
+        return float(np.dot(recent, weights) / weights.sum())
+
+    def stats(self):
+        return {"deliveries": self.length, "legal_balls": self.legal_balls, "overs": self.overs, "dots": self.dots,
+                "fours": self.fours, "sixes": self.sixes, "version": self.version}
+
+
+class MatchAnalytics:
+    """Per-ball analytics for both innings, fed by a MatchEngine as it scores.
+
+    attach() builds the columns from the engine's event log, replaying it
+    into a scratch engine because the columns need who faced and who
+    bowled each ball, which only applying it tells, and then observes the
+    engine so every ball, undo and redo updates them in O(1). key(chart)
+    changes exactly when the data a chart is drawn from does.
+    """
+
+    CHARTS = ("Worm", "Manhattan", "Partnerships")
+
+    def __init__(self):
+        self.engine = None
+        self.innings = [InningsColumns(), InningsColumns()]
+
+    def attach(self, engine):
+        self.detach()
+        start = time.perf_counter()
+        self.innings = [InningsColumns(engine.max_overs), InningsColumns(engine.max_overs)]
+        scratch = MatchEngine(max_overs=engine.max_overs)
+        scratch.observers.append(self.observe)
+        for event in engine.log:
+            scratch.record(event)
+        engine.observers.append(self.observe)
+        self.engine = engine
+        logger.info(f"Analytics built from {len(engine.log)} events in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def detach(self):
+        if self.engine is not None and self.observe in self.engine.observers:
+            self.engine.observers.remove(self.observe)
+        self.engine = None
+
+    def observe(self, engine, event, memento, applied):
+        if event.kind != BALL:
+            return
+        columns = self.innings[engine.current]
+        if not applied:
+            columns.pop()
+            return
+        scalars, striker, _, bowler, _ = memento
+        wickets, balls, non_striker = scalars[1], scalars[2], scalars[5]
+        extra = event.extra
+        columns.append(event.runs if extra == NO_EXTRA else 0, 0 if extra == NO_EXTRA else event.runs, extra,
+                       event.wicket, balls // BALLS_PER_OVER, striker, non_striker, bowler, wickets)
+
+    @property
+    def batting(self):
+        return self.innings[self.engine.current]
+
+    def key(self, chart):
+        """What a chart's pixels depend on"""
+        if chart == "Worm":
+            return (self.innings[0].version, self.innings[1].version)
+        return (self.engine.current, self.batting.version)
+
+    def projections(self):
+        """Projected innings totals at the current rate, on recent form and at PROJECTION_RATES"""
+        engine = self.engine
+        columns = self.batting
+        form = columns.form_rate()
+        names = ["current", *(["form"] if form is not None else []), *(f"{rate:g} rpo" for rate in PROJECTION_RATES)]
+        rates = np.array([engine.batting.run_rate(), *([form] if form is not None else []), *PROJECTION_RATES])
+        projected = np.rint(engine.batting.runs + rates * engine.balls_left() / BALLS_PER_OVER).astype(int)
+        return dict(zip(names, projected.tolist()))
+
+    def values(self):
+        """Display strings for the scoreboard, like scoreboard.scoreboard_values"""
+        columns = self.batting
+        if not columns.legal_balls:
+            return {"dots": "", "projected": ""}
+        projected = self.projections()
+        text = f"Proj: {projected['current']}"
+        if "form" in projected:
+            text += f" (form {projected['form']})"
+        return {"dots": f"Dots: {columns.dot_ball_pct():.0f}%", "projected": text}
+
+    def state(self):
+        """JSON-friendly analytics for the score push"""
+        columns = self.batting
+        return {"dot_ball_pct": round(columns.dot_ball_pct(), 1), "projected": self.projections(),
+                "manhattan": columns.manhattan()[0].tolist()}
+
+
+if __name__ == "__main__":
+    # What keeping the columns and series current adds to each scoring action over a 50-over innings
+    # pair, against recomputing the same series from the ball-by-ball columns after every ball
+    import random
+
+    rng = random.Random(1)
+    engine = MatchEngine(max_overs=50)
+    for innings in range(2):
+        while not engine.innings_complete():
+            roll = rng.random()
+            if roll < 0.03:
+                engine.add_wicket()
+            elif roll < 0.07:
+                engine.add_extra("wides")
+            else:
+                engine.add_runs(rng.choice([0, 0, 0, 1, 1, 1, 2, 4, 6]))
+            if engine.batting.balls and engine.batting.balls % BALLS_PER_OVER == 0:
+                engine.new_bowler(f"Bowler {engine.batting.balls // BALLS_PER_OVER % 5 + 1}")
+        if innings == 0:
+            engine.switch_innings()
+    events = list(engine.log)
+
+    def play(analytics=None, rescan=False):
+        engine = MatchEngine(max_overs=50)
+        if analytics:
+            analytics.attach(engine)
+        start = time.perf_counter()
+        for event in events:
+            engine.record(event)
+            if rescan:
+                columns = analytics.batting
+                over, total = columns.column("over"), columns.column("runs") + columns.column("extras")
+                np.bincount(over, weights=total), np.bincount(over, weights=columns.column("wicket"))
+                np.bincount(columns.column("partnership"), weights=total)
+                np.cumsum(total)
+        return time.perf_counter() - start, engine
+
+    plain, _ = play()
+    analytics = MatchAnalytics()
+    incremental, engine = play(analytics)
+    rescanned, _ = play(MatchAnalytics(), rescan=True)
+    deliveries = len(analytics.innings[0]) + len(analytics.innings[1])
+    print(f"{deliveries} deliveries: analytics add {(incremental - plain) * 1e6 / len(events):.1f} us per action, "
+          f"rescanning the series after each {(rescanned - plain) * 1e6 / len(events):.1f} us")
+    for _ in range(30):
+        engine.undo()
+    rebuilt = MatchAnalytics()
+    rebuilt.attach(engine)
+    assert all(np.array_equal(a.over_score[:a.overs], b.over_score[:b.overs]) and a.dots == b.dots
+               for a, b in zip(analytics.innings, rebuilt.innings)), "undo left the series out of step"
+    print(f"after 30 undos: {analytics.values()}, projections {analytics.projections()}")
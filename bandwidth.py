@@ -0,0 +1,263 @@
+import logging
+import os
+import socket
+import struct
+import time
+from collections import namedtuple
+
+from governor import arg_value, with_arg
+
+logger = logging.getLogger(__name__)
+
+Rung = namedtuple('Rung', 'name height video_kbps')
+
+# Highest first; the top rung is the fixed 1080p 3000k we used to send
+RUNGS = [
+    Rung('1080p', 1080, 3000),
+    Rung('720p', 720, 2000),
+    Rung('720p', 720, 1200),
+    Rung('480p', 480, 800),
+    Rung('360p', 360, 500),
+    Rung('240p', 240, 300)
+]
+AUDIO_KBPS = 128
+
+# sock_diag (linux/inet_diag.h, linux/tcp.h)
+_NETLINK_SOCK_DIAG = 4
+_SOCK_DIAG_BY_FAMILY = 20
+_NLM_F_DUMP_REQUEST = 0x301
+_NLMSG_ERROR, _NLMSG_DONE = 2, 3
+_INET_DIAG_INFO = 2
+_ALL_STATES = 0xFFFFFFFF
+_TCPI_BYTES_ACKED = 120  # offset of tcpi_bytes_acked in struct tcp_info
+
+
+def rung_video_args(video_args, rung, source_height=1080, rescale=True):
+    """video_args re-targeted at a rung: bitrate, a one-second VBV so bursts stay short, and a downscale.
+
+    rescale=False keeps the resolution, for an encoder whose output is
+    already being stream-copied onward (fan-out relays keep the sequence
+    header they connected with, so only the bitrate may change under them).
+    """
+    args = with_arg(video_args, '-b:v', f'{rung.video_kbps}k')
+    args = with_arg(args, '-maxrate', f'{rung.video_kbps}k')
+    args = with_arg(args, '-bufsize', f'{rung.video_kbps}k')
+    if rescale and rung.height < source_height:
+        args = with_arg(args, '-vf', f'scale=-2:{rung.height}')
+    return args
+
+
+def adaptable(video_args):
+    """Only encodes can be adapted; a stream copy sends whatever the source has"""
+    return arg_value(video_args, '-c:v') not in (None, 'copy')
+
+
+def socket_inodes(pid):
+    """Inodes of the sockets pid has open (Linux /proc); None if the process is gone or not ours"""
+    try:
+        fds = os.listdir(f'/proc/{pid}/fd')
+    except OSError:
+        return None
+    inodes = set()
+    for fd in fds:
+        try:
+            target = os.readlink(f'/proc/{pid}/fd/{fd}')
+        except OSError:
+            continue
+        if target.startswith('socket:['):
+            inodes.add(int(target[8:-1]))
+    return inodes
+
+
+def tcp_sockets():
+    """inode -> (bytes acknowledged by the peer, bytes queued unacknowledged) for every TCP socket.
+
+    One sock_diag netlink dump per address family, the same query `ss -ti`
+    makes; the counters come from the kernel's tcp_info, so they are what
+    actually reached the other end, whatever syscalls the process used.
+    Returns None where that isn't available (not Linux).
+    """
+    if not hasattr(socket, 'AF_NETLINK'):
+        return None
+    sockets = {}
+    try:
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_SOCK_DIAG) as s:
+            for family in (socket.AF_INET, socket.AF_INET6):
+                request = struct.pack('=BBBxI', family, socket.IPPROTO_TCP, 1 << (_INET_DIAG_INFO - 1),
+                                      _ALL_STATES) + bytes(48)
+                s.send(struct.pack('=IHHII', 16 + len(request), _SOCK_DIAG_BY_FAMILY, _NLM_F_DUMP_REQUEST, 1, 0)
+                       + request)
+                _read_dump(s, sockets)
+    except OSError:
+        return None
+    return sockets
+
+
+def _read_dump(s, sockets):
+    while True:
+        data = s.recv(65536)
+        offset = 0
+        while offset + 16 <= len(data):
+            length, kind = struct.unpack_from('=IH', data, offset)
+            if kind in (_NLMSG_DONE, _NLMSG_ERROR) or length < 16:
+                return
+            message = data[offset + 16:offset + length]
+            # inet_diag_msg: idiag_wqueue at 60, idiag_inode at 68, attributes from 72
+            queued, inode = struct.unpack_from('=I4xI', message, 60)
+            attr = 72
+            while attr + 4 <= len(message):
+                attr_len, attr_type = struct.unpack_from('=HH', message, attr)
+                if attr_len < 4:
+                    break
+                if attr_type == _INET_DIAG_INFO and attr_len >= 4 + _TCPI_BYTES_ACKED + 8:
+                    (acked,) = struct.unpack_from('=Q', message, attr + 4 + _TCPI_BYTES_ACKED)
+                    sockets[inode] = (acked, queued)
+                attr += (attr_len + 3) & ~3
+            offset += (length + 3) & ~3
+
+
+class OutputSampler:
+    """Measures one output's real send rate and backlog from outside the process.
+
+    Throughput is the growth of the bytes the peer has acknowledged on the
+    process's TCP sockets; backlog is what is still unacknowledged in their
+    send buffers, plus anything waiting in front of the process (e.g. a
+    fan-out relay's queue, via extra_backlog()).
+    """
+
+    def __init__(self, pid, extra_backlog=None):
+        self.pid = pid
+        self.extra_backlog = extra_backlog
+        self._last = None  # (time, {inode: bytes acked})
+
+    def sample(self, now=None):
+        """(throughput_kbps or None, backlog_bytes or None)"""
+        return sample_outputs([self], now)[0]
+
+    def _measure(self, now, inodes, sockets):
+        if not inodes or sockets is None:
+            return None, None
+        mine = {inode: sockets[inode] for inode in inodes if inode in sockets}
+        acked = {inode: counters[0] for inode, counters in mine.items()}
+        throughput = None
+        if self._last and now > self._last[0]:
+            # Only sockets seen both times, so a reconnect doesn't count as a burst
+            sent = sum(acked[inode] - before for inode, before in self._last[1].items() if inode in acked)
+            throughput = max(sent, 0) * 8 / 1000 / (now - self._last[0])
+        self._last = (now, acked)
+        backlog = sum(counters[1] for counters in mine.values())
+        if self.extra_backlog:
+            backlog += self.extra_backlog()
+        return throughput, backlog
+
+
+def sample_outputs(samplers, now=None):
+    """sample() for several outputs from a single sock_diag dump; one result per sampler, in order"""
+    now = time.perf_counter() if now is None else now
+    inodes = [socket_inodes(sampler.pid) for sampler in samplers]
+    sockets = tcp_sockets() if any(inodes) else None
+    return [sampler._measure(now, mine, sockets) for sampler, mine in zip(samplers, inodes)]
+
+
+class BandwidthController:
+    """Keeps one output's bitrate under what its uplink can actually carry.
+
+    update() is fed the measured send throughput and backlog about once a
+    second. A backlog of more than high_backlog_s of video that hasn't
+    started draining within down_after_s means the link is saturated: the
+    output drops straight to the best rung that fits in headroom x the
+    throughput it achieved. Stepping back up is one rung at a time and
+    only after the backlog has stayed under low_backlog_s for up_after_s
+    (and cooldown_s since the last change). An up-step that congests again
+    within up_after_s doubles the wait before the next probe, up to
+    max_up_after_s, so a marginal link isn't flapped.
+    """
+
+    def __init__(self, name, rungs=RUNGS, start=0, high_backlog_s=1.0, low_backlog_s=0.25, down_after_s=3.0,
+                 up_after_s=30.0, max_up_after_s=300.0, cooldown_s=20.0, headroom=0.8):
+        self.name = name
+        self.rungs = rungs
+        self.rung = start
+        self.high_backlog_s = high_backlog_s
+        self.low_backlog_s = low_backlog_s
+        self.down_after_s = down_after_s
+        self.base_up_after_s = up_after_s
+        self.up_after_s = up_after_s
+        self.max_up_after_s = max_up_after_s
+        self.cooldown_s = cooldown_s
+        self.headroom = headroom
+        self.throughput_kbps = None
+        self.backlog_s = 0.0
+        self.changes = 0
+        self._congested_since = None
+        self._congested_backlog_s = 0.0
+        self._clear_since = None
+        self._changed_at = None
+        self._last_up_at = None
+
+    @property
+    def current(self):
+        return self.rungs[self.rung]
+
+    def update(self, throughput_kbps, backlog_bytes, now=None):
+        """Returns the new rung index when the output should change, else None"""
+        now = time.perf_counter() if now is None else now
+        if throughput_kbps is not None:
+            # Smooth over a few seconds; ingest servers read in bursts
+            self.throughput_kbps = throughput_kbps if self.throughput_kbps is None else \
+                0.7 * self.throughput_kbps + 0.3 * throughput_kbps
+        if backlog_bytes is None:
+            return None
+        sending_kbps = self.current.video_kbps + AUDIO_KBPS
+        self.backlog_s = backlog_bytes * 8 / 1000 / sending_kbps
+
+        if self.backlog_s > self.high_backlog_s:
+            self._clear_since = None
+            if self._congested_since is None or self.backlog_s < 0.8 * self._congested_backlog_s:
+                # Newly congested, or draining (e.g. after a step down): give it down_after_s from here
+                self._congested_since, self._congested_backlog_s = now, self.backlog_s
+            if now - self._congested_since >= self.down_after_s and self.rung < len(self.rungs) - 1:
+                return self._step_down(now)
+        elif self.backlog_s < self.low_backlog_s:
+            self._congested_since = None
+            self._clear_since = self._clear_since or now
+            settled = self._changed_at is None or now - self._changed_at >= self.cooldown_s
+            if now - self._clear_since >= self.up_after_s and settled and self.rung > 0:
+                return self._change(self.rung - 1, now, "uplink clear", up=True)
+        else:
+            self._congested_since = self._clear_since = None
+        return None
+
+    def _step_down(self, now):
+        capacity = (self.throughput_kbps or 0.0) * self.headroom
+        target = next((i for i in range(self.rung + 1, len(self.rungs))
+                       if self.rungs[i].video_kbps + AUDIO_KBPS <= capacity), len(self.rungs) - 1)
+        if self._last_up_at is not None and now - self._last_up_at < self.up_after_s:
+            # The last probe upwards didn't hold; wait longer before the next one
+            self.up_after_s = min(self.max_up_after_s, self.up_after_s * 2)
+        return self._change(target, now,
+                            f"backlog {self.backlog_s:.1f} s, sending {self.throughput_kbps or 0:.0f} kb/s")
+
+    def _change(self, rung, now, reason, up=False):
+        previous = self.current
+        self.rung = rung
+        self.changes += 1
+        self._changed_at = now
+        self._congested_since = self._clear_since = None
+        if up:
+            self._last_up_at = now
+        elif self._last_up_at is None or now - self._last_up_at >= self.up_after_s:
+            self.up_after_s = self.base_up_after_s
+        logger.info(f"{self.name}: {previous.name} {previous.video_kbps}k -> "
+                    f"{self.current.name} {self.current.video_kbps}k ({reason})")
+        return rung
+
+    def stats(self):
+        return {
+            "rung": self.current.name,
+            "video_kbps": self.current.video_kbps,
+            "throughput_kbps": self.throughput_kbps or 0.0,
+            "backlog_s": self.backlog_s,
+            "changes": self.changes,
+            "up_after_s": self.up_after_s
+        }
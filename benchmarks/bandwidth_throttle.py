@@ -0,0 +1,210 @@
+"""Adaptive bitrate against a local throttled sink: latency and bitrate over time, adaptive vs. fixed 3000k.
+
+    python benchmarks/bandwidth_throttle.py --duration 180 --out results/
+
+The sink accepts the publisher's TCP stream (what an RTMP server reads
+after its handshake) but only reads it at the uplink capacity of the
+moment, stepping through a weak-4G schedule. The publisher is a small
+constant-bitrate process standing in for FFmpeg: it stamps every record
+with the media time it was due to be sent, so the sink sees how far
+behind live the stream has fallen. The same BandwidthController,
+OutputSampler and StreamSupervisor.restart() that rtmpstream uses drive
+it. Each run writes a CSV and both are charted in an SVG.
+"""
+import argparse
+import csv
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bandwidth import AUDIO_KBPS, RUNGS, BandwidthController, OutputSampler  # noqa: E402
+from supervisor import StreamSupervisor  # noqa: E402
+
+RECORD = 1316  # 7 TS packets, what FFmpeg writes per UDP/TCP chunk
+PUBLISHER = r"""
+import socket, struct, sys, time
+port, kbps = int(sys.argv[1]), float(sys.argv[2])
+rate = kbps * 1000 / 8
+s = socket.create_connection(("127.0.0.1", port))
+pad = b"\0" * (1316 - 8)
+start, sent = time.time(), 0
+try:
+    while True:
+        due = start + sent / rate
+        if due > time.time():
+            time.sleep(due - time.time())
+        s.sendall(struct.pack("!d", due) + pad)
+        sent += 1316
+except OSError:
+    sys.exit(1)
+"""
+
+# (from fraction of the run, capacity kb/s): good signal, a weak spell, worse, then recovered
+SCHEDULE = [(0.0, 5000), (0.2, 1600), (0.5, 900), (0.75, 4000)]
+
+
+class ThrottledSink:
+    """Reads one connection at a time at a capacity that follows a schedule"""
+
+    def __init__(self, port, schedule, duration):
+        self.schedule = [(at * duration, kbps) for at, kbps in schedule]
+        self.started = time.perf_counter()
+        self.latency_s = 0.0
+        self.received = 0
+        self.running = True
+        self.server = socket.create_server(("127.0.0.1", port))
+        # A small receive window keeps the queue on the sender's side, as on a real bottleneck
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 * 1024)
+        self.server.settimeout(0.2)
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def capacity_kbps(self):
+        elapsed = time.perf_counter() - self.started
+        return [kbps for at, kbps in self.schedule if at <= elapsed][-1]
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        budget, last = 0.0, time.perf_counter()
+        pending = b""
+        with conn:
+            while self.running:
+                now = time.perf_counter()
+                budget = min(budget + (now - last) * self.capacity_kbps() * 1000 / 8, 64 * 1024)
+                last = now
+                if budget < RECORD:
+                    time.sleep(0.005)
+                    continue
+                try:
+                    data = conn.recv(int(budget))
+                except OSError:
+                    return
+                if not data:
+                    return
+                budget -= len(data)
+                self.received += len(data)
+                pending += data
+                whole = len(pending) - len(pending) % RECORD
+                if whole:
+                    # Latency of the newest complete record
+                    (due,) = struct.unpack("!d", pending[whole - RECORD:whole - RECORD + 8])
+                    self.latency_s = time.time() - due
+                    pending = pending[whole:]
+
+    def close(self):
+        self.running = False
+        self._thread.join()
+        self.server.close()
+
+
+def run(label, port, duration, adaptive, out_dir):
+    sink = ThrottledSink(port, SCHEDULE, duration)
+    spawn_at = lambda rung: (lambda: subprocess.Popen(
+        [sys.executable, '-c', PUBLISHER, str(port), str(rung.video_kbps + AUDIO_KBPS)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    supervisor = StreamSupervisor(base_delay=0.2, max_delay=1.0)
+    # The fixed baseline gets a one-rung ladder: measured the same way, never changed
+    controller = BandwidthController(label, RUNGS if adaptive else RUNGS[:1], up_after_s=15, cooldown_s=10)
+    supervisor.watch("uplink", spawn_at(RUNGS[0])(), spawn_at(RUNGS[0]))
+    sampler, sampled = None, None
+    rows = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        time.sleep(1.0)
+        process = supervisor.outputs["uplink"].process
+        if sampled is not process:
+            sampler, sampled = OutputSampler(process.pid), process
+        throughput, backlog = sampler.sample()
+        rung = controller.update(throughput, backlog)
+        if rung is not None:
+            supervisor.restart("uplink", spawn_at(RUNGS[rung]))
+        rows.append({
+            "t": round(time.perf_counter() - start, 1),
+            "capacity_kbps": sink.capacity_kbps(),
+            "bitrate_kbps": controller.current.video_kbps + AUDIO_KBPS,
+            "throughput_kbps": round(throughput or 0.0),
+            "backlog_s": round(controller.backlog_s, 2),
+            "latency_s": round(max(sink.latency_s, 0.0), 2),
+            "rung": controller.current.name
+        })
+    supervisor.stop("uplink")
+    sink.close()
+    with open(os.path.join(out_dir, f"{label}.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def polyline(rows, key, x_scale, y_scale, height, colour, dash=""):
+    points = " ".join(f"{r['t'] * x_scale:.1f},{height - r[key] * y_scale:.1f}" for r in rows)
+    return f'<polyline points="{points}" fill="none" stroke="{colour}" stroke-width="1.5" {dash}/>'
+
+
+def chart(runs, path, width=900, height=220):
+    """Two stacked panels: kb/s (capacity, sent) and latency, one colour per run"""
+    duration = max(r["t"] for rows in runs.values() for r in rows)
+    max_kbps = max(r["capacity_kbps"] for rows in runs.values() for r in rows) * 1.1
+    max_latency = max(max(r["latency_s"] for rows in runs.values() for r in rows), 1.0) * 1.1
+    x_scale = width / duration
+    colours = {"adaptive": "#2e86de", "fixed": "#e74c3c"}
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width + 60}" height="{2 * height + 80}" '
+             f'font-family="sans-serif" font-size="11">',
+             f'<text x="0" y="12">kb/s (grey: uplink capacity, dashed: throughput) - max {max_kbps:.0f}</text>',
+             f'<g transform="translate(40,20)"><rect width="{width}" height="{height}" fill="none" stroke="#ccc"/>',
+             polyline(next(iter(runs.values())), "capacity_kbps", x_scale, height / max_kbps, height, "#999")]
+    for label, rows in runs.items():
+        parts.append(polyline(rows, "bitrate_kbps", x_scale, height / max_kbps, height, colours.get(label, "#333")))
+        parts.append(polyline(rows, "throughput_kbps", x_scale, height / max_kbps, height,
+                              colours.get(label, "#333"), 'stroke-dasharray="3,3"'))
+    parts.append('</g>')
+    parts.append(f'<text x="0" y="{height + 45}">latency behind live, s - max {max_latency:.1f} '
+                 f'(blue: adaptive, red: fixed 3000k)</text>')
+    parts.append(f'<g transform="translate(40,{height + 55})"><rect width="{width}" height="{height}" fill="none" '
+                 f'stroke="#ccc"/>')
+    for label, rows in runs.items():
+        parts.append(polyline(rows, "latency_s", x_scale, height / max_latency, height, colours.get(label, "#333")))
+    parts.append('</g></svg>')
+    with open(path, "w") as f:
+        f.write("\n".join(parts))
+
+
+def summary(rows):
+    latencies = sorted(r["latency_s"] for r in rows)
+    return (f"latency p50 {latencies[len(latencies) // 2]:.1f} s, p95 {latencies[int(len(latencies) * 0.95)]:.1f} s, "
+            f"max {latencies[-1]:.1f} s; mean bitrate {sum(r['bitrate_kbps'] for r in rows) / len(rows):.0f} kb/s, "
+            f"{len(set(r['rung'] for r in rows))} rungs used")
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    os.makedirs(args.out, exist_ok=True)
+    runs = {}
+    for label, adaptive in (("adaptive", True), ("fixed", False)):
+        runs[label] = run(label, args.port, args.duration, adaptive, args.out)
+        print(f"{label:>8}: {summary(runs[label])}")
+    chart(runs, os.path.join(args.out, "bandwidth.svg"))
+    print(f"CSV and chart in {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=180, help="seconds per run (two runs)")
+    parser.add_argument("--port", type=int, default=19360)
+    parser.add_argument("--out", default="bandwidth-results")
+    parser.add_argument("--verbose", action="store_true")
+    main(parser.parse_args())
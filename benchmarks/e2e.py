@@ -0,0 +1,349 @@
+"""End-to-end benchmark suite: synthetic cameras, the app's streaming paths and local ingest sinks, 1..N platforms.
+
+    python benchmarks/e2e.py --platforms 1 2 4 --duration 60 --json e2e.json
+    python benchmarks/e2e.py --scenarios fanout --platforms 2 --stages
+    python benchmarks/e2e.py --compare before.json after.json
+
+Runs headless on one Linux box with no network (see harness.py for the
+cameras and sinks). Two scenarios, each with every platform count:
+
+  per-platform  one FFmpeg per platform pulling the camera and encoding,
+                as start_streaming does without fan-out
+  fanout        camera decode, scoreboard compositing, one shared encoder
+                and a stream-copy relay per platform, cutting between
+                cameras every --switch-every s while a scripted match
+                drives the scoreboard; with --stages the program is also
+                stamped and traced through each stage (latency.py)
+
+Each run records CPU and RSS per process, encoder speed, fps and drops
+from FFmpeg's progress output, camera switch time (in the compositor and
+until the new camera's frames reach each sink), overlay render time and
+glass-to-glass latency at every sink. Results go to a JSON file, tagged
+with the git version, that --compare lines up against another.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from compositor import CompositingPipeline, FrameReader, OverlayCompositor, raw_video_input_args  # noqa: E402
+from fanout import DEFAULT_AUDIO_ARGS, DEFAULT_VIDEO_ARGS, FanoutEncoder  # noqa: E402
+from harness import FFMPEG, ProcessSampler, ScriptedScorer, SyntheticCamera, summarize  # noqa: E402
+from latency import FlvSink, LatencyProbe  # noqa: E402
+from match_engine import MatchEngine  # noqa: E402
+from overlay import scoreboard_renderer  # noqa: E402
+from telemetry import PROGRESS_ARGS, EncoderTelemetry  # noqa: E402
+
+REPO = os.path.join(os.path.dirname(__file__), "..")
+
+# (path into a run's results, label) for --compare; lower is better for all but speed
+KEY_METRICS = [
+    ("totals.cpu_cores", "CPU cores"),
+    ("totals.rss_mb", "RSS MB"),
+    ("totals.min_speed", "min encoder speed"),
+    ("glass_to_glass_ms.all.p50", "glass-to-glass p50 ms"),
+    ("glass_to_glass_ms.all.p95", "glass-to-glass p95 ms"),
+    ("stages.stages_ms.decode.p50_ms", "decode stage p50 ms"),
+    ("stages.stages_ms.encode.p50_ms", "encode stage p50 ms"),
+    ("stages.stages_ms.mux.p50_ms", "mux stage p50 ms"),
+    ("stages.overlay_ms.total.p50_ms", "score to sink p50 ms"),
+    ("camera_switch_ms.compositor.p50_ms", "switch in compositor p50 ms"),
+    ("camera_switch_ms.at_sink.all.p50", "switch at sink p50 ms"),
+    ("overlay.render_ms.p95", "overlay render p95 ms"),
+    ("overlay.event_to_overlay_ms.p95", "event to overlay p95 ms")
+]
+
+
+def git_version():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def ffmpeg_version():
+    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else None
+
+
+def ticks(duration, telemetry, encoders):
+    """Yield about once a second for duration, collecting encoder progress meanwhile"""
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        time.sleep(min(1.0, max(0.0, end - time.perf_counter())))
+        for name, stats in telemetry.snapshot().items():
+            if stats["running"] and stats["updated"]:
+                encoders.setdefault(name, []).append(stats)
+        yield time.perf_counter()
+
+
+def run_per_platform(args, cameras, sinks, telemetry, sampler, encoders):
+    processes = []
+    for sink in sinks:
+        process = subprocess.Popen([*FFMPEG, *PROGRESS_ARGS, '-re', '-i', cameras[0].url, *DEFAULT_VIDEO_ARGS,
+                                    *DEFAULT_AUDIO_ARGS, '-f', 'flv', sink.url],
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        telemetry.register(sink.name, process)
+        sampler.track(sink.name, lambda process=process: process.pid)
+        processes.append(process)
+    for _ in ticks(args.duration, telemetry, encoders):
+        pass
+    for process in processes:
+        process.terminate()
+    return {}
+
+
+def run_fanout(args, cameras, sinks, telemetry, sampler, encoders):
+    # Every camera decoded and warm, as the camera engine keeps them
+    readers = [FrameReader(camera.url) for camera in cameras]
+    for camera, reader in zip(cameras, readers):
+        reader.start()
+        sampler.track(f"Camera {camera.index} decode", lambda reader=reader: reader.process.pid)
+    compositor = OverlayCompositor()
+    probe = None
+    if args.stages:
+        probe = LatencyProbe(compositor, port=args.port + 50, source_clock=camera_clock(cameras)).start()
+        probe.watch_source(cameras[0].url)
+    fanout = FanoutEncoder(raw_video_input_args(audio_source=cameras[0].url), DEFAULT_VIDEO_ARGS,
+                           DEFAULT_AUDIO_ARGS, frame_input=True, telemetry=telemetry,
+                           taps=[probe.tap] if probe else ())
+    pipeline = CompositingPipeline(readers[0], compositor, fanout, owns_reader=False, probe=probe)
+    pipeline.start()
+    sampler.track(FanoutEncoder.ENCODER_NAME, lambda: fanout.process.pid)
+    sampler.track("Compositor (this process)", os.getpid)
+    for sink in sinks:
+        relay = fanout.add_destination(sink.name, sink.url)
+        sampler.track(sink.name, lambda relay=relay: relay.process.pid)
+    if probe:
+        fanout.add_destination(probe.VERIFIER, probe.verifier.url)
+    scorer = ScriptedScorer(MatchEngine(), scoreboard_renderer(), compositor, args.script, args.event_interval,
+                            probe=probe)
+    scorer.start()
+
+    switches = []
+    next_switch = time.perf_counter() + args.switch_every
+    program = 0
+    for now in ticks(args.duration, telemetry, encoders):
+        if len(cameras) > 1 and now >= next_switch:
+            program = (program + 1) % len(cameras)
+            switches.append((time.perf_counter(), cameras[program].index))
+            pipeline.set_reader(readers[program])
+            if probe:
+                probe.watch_source(cameras[program].url)
+            next_switch += args.switch_every
+    scorer.stop()
+    pipeline.stop()
+    fanout.stop()
+    for reader in readers:
+        reader.stop()
+    stages = None
+    if probe:
+        stages = probe.report()
+        probe.stop()
+
+    at_sink = {sink.name: switch_at_sink(sink, switches) for sink in sinks}
+    return {
+        "camera_switch_ms": {
+            "switches": len(switches),
+            "compositor": pipeline.switch_delay.summary(),
+            "at_sink": {**{name: summarize(ms) for name, ms in at_sink.items()},
+                        "all": summarize([ms for values in at_sink.values() for ms in values])}
+        },
+        "overlay": scorer.summary(),
+        "composite_ms": compositor.stats(),
+        "repeated_frames": pipeline.repeated_frames,
+        "stages": stages
+    }
+
+
+SCENARIOS = {"per-platform": run_per_platform, "fanout": run_fanout}
+
+
+def camera_clock(cameras):
+    """source_clock for LatencyProbe: when a camera frame was taken, with each camera's epoch refreshed every 2 s"""
+    by_index = {camera.index: camera for camera in cameras}
+    epochs = {}
+
+    def clock(index, frame):
+        camera = by_index.get(index)
+        if camera is None:
+            return None
+        epoch, at = epochs.get(index, (None, 0.0))
+        if epoch is None or time.perf_counter() - at > 2.0:
+            epoch = camera.epoch()
+            epochs[index] = (epoch, time.perf_counter())
+        return None if epoch is None else epoch + frame / camera.fps
+
+    return clock
+
+
+def glass_to_glass(sink, cameras, after):
+    """ms from each frame leaving its camera to it being decodable at the sink"""
+    epochs = {camera.index: (camera.epoch(), camera.fps) for camera in cameras}
+    latencies = []
+    for (index, frame), arrived in sink.frames.items():
+        epoch, fps = epochs.get(index, (None, None))
+        if epoch is not None and arrived >= after:
+            latencies.append((arrived - (epoch + frame / fps)) * 1000)
+    return latencies
+
+
+def switch_at_sink(sink, switches):
+    """ms from each cut until the first frame of the new camera reached the sink"""
+    arrivals = sorted((t, index) for (index, _), t in sink.frames.items())
+    delays = []
+    for at, index in switches:
+        first = next((t for t, camera in arrivals if t >= at and camera == index), None)
+        if first is not None:
+            delays.append((first - at) * 1000)
+    return delays
+
+
+def run(scenario, platforms, args):
+    cameras = [SyntheticCamera(i, args.port + 100 + i, fps=args.fps).start() for i in range(args.cameras)]
+    sinks = [FlvSink(f"Platform {n + 1}", args.port + n, cameras[0].barcode.read).start()
+             for n in range(platforms)]
+    telemetry = EncoderTelemetry()
+    telemetry.start()
+    sampler = ProcessSampler().start()
+    encoders = {}
+    time.sleep(2.0)  # let the cameras settle
+    started = time.perf_counter()
+    try:
+        extra = SCENARIOS[scenario](args, cameras, sinks, telemetry, sampler, encoders)
+        time.sleep(1.0)  # the last frames in flight
+    finally:
+        sampler.stop()
+        telemetry.stop()
+        for sink in sinks:
+            sink.stop()
+        for camera in cameras:
+            camera.stop()
+
+    after = started + args.warmup
+    latencies = {sink.name: glass_to_glass(sink, cameras, after) for sink in sinks}
+    processes = sampler.summary()
+    encoder_stats = {
+        name: {"speed_mean": sum(s["speed"] for s in samples) / len(samples),
+               "speed_min": min(s["speed"] for s in samples),
+               "fps_mean": sum(s["fps"] for s in samples) / len(samples),
+               "drop_frames": samples[-1]["drop_frames"], "dup_frames": samples[-1]["dup_frames"]}
+        for name, samples in encoders.items()
+    }
+    return {
+        "scenario": scenario,
+        "platforms": platforms,
+        "duration_s": args.duration,
+        "processes": processes,
+        "encoders": encoder_stats,
+        "totals": {
+            "cpu_cores": sum(p["cpu_cores_mean"] for p in processes.values()),
+            "rss_mb": sum(p["rss_mb_max"] for p in processes.values()),
+            "min_speed": min((e["speed_min"] for e in encoder_stats.values()), default=None)
+        },
+        "glass_to_glass_ms": {**{name: summarize(ms) for name, ms in latencies.items()},
+                              "all": summarize([ms for values in latencies.values() for ms in values])},
+        "sinks": {sink.name: {"kbps": sink.kbps(), "connections": sink.connections, "frames": len(sink.frames),
+                              "unreadable_frames": sum(r.unreadable for r in sink.readers)} for sink in sinks},
+        **extra
+    }
+
+
+def lookup(result, path):
+    for key in path.split("."):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before.get('version')} -> {after.get('version')}")
+    old_runs = {(r["scenario"], r["platforms"]): r for r in before["runs"]}
+    for new in after["runs"]:
+        old = old_runs.get((new["scenario"], new["platforms"]))
+        if old is None:
+            continue
+        print(f"\n{new['scenario']}, {new['platforms']} platform(s)")
+        for path, label in KEY_METRICS:
+            a, b = lookup(old, path), lookup(new, path)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a:+.0%}" if a else ""
+            print(f"  {label:<30}{a:>10.2f}{b:>10.2f}{change:>8}")
+
+
+def print_run(result):
+    g2g = result["glass_to_glass_ms"]["all"]
+    totals = result["totals"]
+    line = (f"{result['scenario']:<13}{result['platforms']:>3} platform(s): {totals['cpu_cores']:.2f} cores, "
+            f"{totals['rss_mb']:.0f} MB RSS, min speed {totals['min_speed'] or 0:.2f}x")
+    if g2g["count"]:
+        line += f", glass-to-glass p50 {g2g['p50']:.0f} ms p95 {g2g['p95']:.0f} ms"
+    switch = lookup(result, "camera_switch_ms.at_sink.all")
+    if switch and switch["count"]:
+        line += f", switch at sink p50 {switch['p50']:.0f} ms"
+    overlay = lookup(result, "overlay.render_ms")
+    if overlay and overlay["count"]:
+        line += f", overlay render p95 {overlay['p95']:.2f} ms"
+    print(line)
+    stages = lookup(result, "stages.stages_ms")
+    if stages:
+        print("    stages p50/p95 ms: " + ", ".join(f"{stage} {s['p50_ms']:.0f}/{s['p95_ms']:.0f}"
+                                               for stage, s in stages.items() if s["count"]))
+
+
+def main(args):
+    if args.compare:
+        compare(*args.compare)
+        return
+    if shutil.which('ffmpeg') is None:
+        sys.exit("ffmpeg is needed for this benchmark")
+    version = git_version()
+    results = {
+        "schema": 1,
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version(),
+                 "ffmpeg": ffmpeg_version()},
+        "args": {k: v for k, v in vars(args).items() if k not in ("compare", "json")},
+        "runs": []
+    }
+    for scenario in args.scenarios:
+        for platforms in args.platforms:
+            result = run(scenario, platforms, args)
+            results["runs"].append(result)
+            print_run(result)
+    path = args.json or f"e2e-{version or 'unknown'}.json"
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results in {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--platforms", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=60, help="seconds per run")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of each run left out of latency figures")
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--switch-every", type=float, default=10)
+    parser.add_argument("--script", choices=["match", "corrections"], default="match")
+    parser.add_argument("--event-interval", type=float, default=2.0, help="seconds between scripted scoring events")
+    parser.add_argument("--stages", action="store_true", help="stamp the program and break latency down by stage")
+    parser.add_argument("--port", type=int, default=19400)
+    parser.add_argument("--json", help="results file (default e2e-<git version>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results files")
+    main(parser.parse_args())
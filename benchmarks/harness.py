@@ -0,0 +1,303 @@
+"""Building blocks for headless end-to-end benchmarks: no network, no cameras, no platforms.
+
+SyntheticCamera serves an FFmpeg test pattern as MPEG-TS over local TCP,
+like an IP camera, with the camera index and frame number burned into
+the bottom-left corner as latency.CAMERA_BARCODE. latency.FlvSink stands
+in for an RTMP ingest server and decodes what it receives, so every
+frame that arrives can be traced back to the camera frame it came from.
+ProcessSampler reads per-process CPU and RSS from /proc, and
+ScriptedScorer drives the match engine and scoreboard overlay through a
+fixed sequence of scoring events.
+"""
+import itertools
+import logging
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fanout import CHUNK_SIZE  # noqa: E402
+from latency import CAMERA_BITS, FFMPEG, FRAME_BITS, Barcode, BarcodeReader  # noqa: E402
+from metrics import process_usage  # noqa: E402
+from overlay import scoreboard_overlay_values  # noqa: E402
+from scoreboard import scoreboard_values  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticCamera:
+    """A generated test pattern served as live MPEG-TS on tcp://127.0.0.1:port.
+
+    Any number of clients can connect; each gets the feed from the moment
+    it joins, and one that can't keep up is dropped like a real camera
+    would. Its own output is decoded too, which gives the time each frame
+    left the camera: epoch + n / fps.
+    """
+
+    def __init__(self, index, port, width=1920, height=1080, fps=30, bitrate="6000k"):
+        self.index = index
+        self.port = port
+        self.width, self.height, self.fps = width, height, fps
+        self.barcode = Barcode((CAMERA_BITS, FRAME_BITS), width=width, height=height)
+        self.bitrate = bitrate
+        self.url = f"tcp://127.0.0.1:{port}"
+        self.clients = []
+        self.process = None
+        self.reader = BarcodeReader(self.barcode.read, 'mpegts')
+        self.lock = threading.Lock()
+        self.running = False
+
+    def command(self):
+        return [
+            *FFMPEG, '-re',
+            '-f', 'lavfi', '-i', f'testsrc2=size={self.width}x{self.height}:rate={self.fps}',
+            '-f', 'lavfi', '-i', f'sine=frequency={440 + 110 * self.index}',
+            '-vf', self.barcode.drawbox_filter((self.index, None)),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-g', str(self.fps),
+            '-b:v', self.bitrate, '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '128k',
+            '-f', 'mpegts', 'pipe:1'
+        ]
+
+    def start(self):
+        self.server = socket.create_server(("127.0.0.1", self.port))
+        self.server.settimeout(0.2)
+        self.running = True
+        self.reader.start()
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._accept, name=f"camera-{self.index}-accept", daemon=True).start()
+        threading.Thread(target=self._pump, name=f"camera-{self.index}", daemon=True).start()
+        return self
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            client = queue.Queue(maxsize=256)
+            with self.lock:
+                self.clients.append(client)
+            threading.Thread(target=self._serve, args=(conn, client), daemon=True).start()
+
+    def _serve(self, conn, client):
+        with conn:
+            while self.running:
+                chunk = client.get()
+                if chunk is None:
+                    break
+                try:
+                    conn.sendall(chunk)
+                except OSError:
+                    break
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def _pump(self):
+        stdout = self.process.stdout
+        while True:
+            # Whatever is ready, so the camera itself doesn't add a chunk's worth of delay
+            chunk = stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.reader.feed(chunk)
+            with self.lock:
+                clients = list(self.clients)
+            for client in clients:
+                try:
+                    client.put_nowait(chunk)
+                except queue.Full:
+                    # Too slow: make room for the sentinel and disconnect it
+                    try:
+                        client.get_nowait()
+                    except queue.Empty:
+                        pass
+                    client.put_nowait(None)
+                    with self.lock:
+                        if client in self.clients:
+                            self.clients.remove(client)
+
+    def epoch(self):
+        """perf_counter time at which frame 0 left the camera (the median over all frames seen)"""
+        with self.reader.lock:
+            offsets = sorted(t - frame / self.fps for (camera, frame), t in self.reader.frames.items())
+        return offsets[len(offsets) // 2] if offsets else None
+
+    def stop(self):
+        self.running = False
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+        self.reader.close()
+        with self.lock:
+            for client in self.clients:
+                try:
+                    client.put_nowait(None)
+                except queue.Full:
+                    pass
+        self.server.close()
+
+
+class ProcessSampler:
+    """Samples CPU and RSS of named processes once a second.
+
+    track() takes a callable returning the current pid, so an output that
+    is restarted keeps being measured under the same name.
+    """
+
+    def __init__(self, interval_s=1.0):
+        self.interval_s = interval_s
+        self.pids = {}
+        self.samples = {}  # name -> [(cores, rss bytes)]
+        self._last = {}
+        self.running = False
+
+    def track(self, name, pid):
+        self.pids[name] = pid
+        self.samples.setdefault(name, [])
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="process-sampler", daemon=True).start()
+        return self
+
+    def _run(self):
+        while self.running:
+            now = time.perf_counter()
+            for name, pid in list(self.pids.items()):
+                try:
+                    usage = process_usage(pid())
+                except (AttributeError, TypeError):
+                    usage = None
+                if usage is None:
+                    continue
+                last = self._last.get(name)
+                if last and last[0] < now and usage[0] >= last[1]:
+                    self.samples[name].append(((usage[0] - last[1]) / (now - last[0]), usage[1]))
+                self._last[name] = (now, usage[0])
+            time.sleep(self.interval_s)
+
+    def summary(self):
+        result = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            cores = [c for c, _ in samples]
+            rss = [r / 1e6 for _, r in samples]
+            result[name] = {"cpu_cores_mean": sum(cores) / len(cores), "cpu_cores_max": max(cores),
+                            "rss_mb_mean": sum(rss) / len(rss), "rss_mb_max": max(rss)}
+        return result
+
+    def stop(self):
+        self.running = False
+
+
+def summarize(samples):
+    """count, mean and percentiles of a list of numbers"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {"count": len(ordered), "mean": sum(ordered) / len(ordered), "p50": pct(0.5), "p95": pct(0.95),
+            "p99": pct(0.99), "max": ordered[-1]}
+
+
+# Ball outcomes and their weights for the "match" script, roughly a T20 innings
+OUTCOMES = [(("runs", 0), 35), (("runs", 1), 30), (("runs", 2), 8), (("runs", 4), 12), (("runs", 6), 5),
+            (("wicket", ""), 4), (("extra", "wides"), 4), (("extra", "noballs"), 1), (("extra", "legbyes"), 1)]
+SCRIPTS = {
+    # One ball every interval, with bowler changes at the end of each over
+    "match": lambda rng: (rng.choices([o for o, _ in OUTCOMES], [w for _, w in OUTCOMES])[0]
+                          for _ in itertools.count()),
+    # A scorer correcting mistakes: bursts of undo/redo between balls
+    "corrections": lambda rng: (action for _ in itertools.count()
+                                for action in (("runs", rng.choice([1, 4])), ("undo", None), ("redo", None),
+                                               ("undo", None), ("runs", 2)))
+}
+
+
+class ScriptedScorer:
+    """Plays a scoring script into a MatchEngine and the broadcast overlay, timing each step.
+
+    Every interval_s it applies the next action, recomputes the scoreboard
+    values, renders the overlay and hands it to the compositor (what the
+    app's add_runs/generate_overlay do). event_times records when each
+    overlay went live, for tracing it to the sink, and a probe
+    (latency.LatencyProbe) is told about each new overlay.
+    """
+
+    def __init__(self, engine, renderer, compositor, script="match", interval_s=2.0, seed=1, probe=None):
+        self.engine = engine
+        self.probe = probe
+        self.renderer = renderer
+        self.compositor = compositor
+        self.actions = SCRIPTS[script](random.Random(seed))
+        self.interval_s = interval_s
+        self.render_ms = []
+        self.set_overlay_ms = []
+        self.event_ms = []
+        self.event_times = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="scripted-scorer", daemon=True).start()
+        return self
+
+    def step(self):
+        start = time.perf_counter()
+        kind, value = next(self.actions)
+        engine = self.engine
+        if kind == "runs":
+            engine.add_runs(value)
+        elif kind == "wicket":
+            engine.add_wicket(value)
+        elif kind == "extra":
+            engine.add_extra(value)
+        elif kind == "undo":
+            engine.undo()
+        elif kind == "redo":
+            engine.redo()
+        if engine.batting.balls and engine.batting.balls % 6 == 0 and kind in ("runs", "wicket"):
+            engine.new_bowler(f"Bowler {len(engine.batting.bowlers) % 5 + 1}")
+        if engine.innings_complete():
+            if engine.current == 0:
+                engine.switch_innings()
+            else:
+                self.running = False
+        overlay = self.renderer.render(scoreboard_overlay_values(scoreboard_values(engine)))
+        self.render_ms.append(self.renderer.last_render_ms)
+        if self.renderer.changed:
+            set_start = time.perf_counter()
+            self.compositor.set_overlay(overlay)
+            self.set_overlay_ms.append((time.perf_counter() - set_start) * 1000)
+            if self.probe is not None:
+                self.probe.overlay_changed(start)
+        done = time.perf_counter()
+        self.event_ms.append((done - start) * 1000)
+        self.event_times.append(done)
+
+    def _run(self):
+        next_at = time.perf_counter()
+        while self.running:
+            self.step()
+            next_at += self.interval_s
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def stop(self):
+        self.running = False
+
+    def summary(self):
+        return {"events": len(self.event_ms), "render_ms": summarize(self.render_ms),
+                "set_overlay_ms": summarize(self.set_overlay_ms), "event_to_overlay_ms": summarize(self.event_ms)}
@@ -0,0 +1,98 @@
+"""CPU cost of each extra HLS rendition: one decode and a shared scaling graph vs. a process per rendition.
+
+    python benchmarks/hls_ladder_cost.py --duration 20 --json results.json
+
+A 1080p30 H.264/AAC test clip is generated first. Each ladder prefix
+(1080p; 1080p+720p; ...) is then encoded as fast as possible, once as a
+single FFmpeg process (what rtmpstream's local HLS uses) and once as one
+process per rendition, each doing its own decode. CPU time is read from
+the children's rusage and reported as cores needed to keep up in real
+time, with the increment each rung adds.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hls import LADDER, ladder_output_args, prepare_directory  # noqa: E402
+
+FFMPEG = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y']
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_source(path, duration):
+    subprocess.run(FFMPEG + ['-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration}',
+                             '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                             '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-b:v', '6000k',
+                             '-c:a', 'aac', '-b:a', '128k', '-f', 'mpegts', path], check=True)
+
+
+def run_all(commands):
+    """Run commands concurrently; (cpu seconds, wall seconds)"""
+    cpu, start = children_cpu(), time.perf_counter()
+    processes = [subprocess.Popen(cmd) for cmd in commands]
+    if any(p.wait() for p in processes):
+        raise RuntimeError("ffmpeg failed")
+    return children_cpu() - cpu, time.perf_counter() - start
+
+
+def main(args):
+    if shutil.which('ffmpeg') is None:
+        sys.exit("ffmpeg is needed for this benchmark")
+    work = tempfile.mkdtemp(prefix="hls-bench-")
+    source = os.path.join(work, "source.ts")
+    make_source(source, args.duration)
+    results = []
+    try:
+        for count in range(1, len(LADDER) + 1):
+            renditions = LADDER[:count]
+            single_dir = os.path.join(work, "single")
+            prepare_directory(single_dir, renditions)
+            single_cpu, single_wall = run_all([FFMPEG + ['-i', source, *ladder_output_args(single_dir, renditions)]])
+
+            commands = []
+            for n, rendition in enumerate(renditions):
+                out = os.path.join(work, f"separate{n}")
+                prepare_directory(out, [rendition])
+                commands.append(FFMPEG + ['-i', source, *ladder_output_args(out, [rendition])])
+            separate_cpu, separate_wall = run_all(commands)
+
+            results.append({
+                "renditions": [r.name for r in renditions],
+                "single_pass_cores": single_cpu / args.duration,
+                "separate_cores": separate_cpu / args.duration,
+                "single_pass_wall_s": single_wall,
+                "separate_wall_s": separate_wall
+            })
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(f"{'ladder':<28}{'single pass':>14}{'+ this rung':>14}{'per process':>14}{'saved':>8}")
+    previous = 0.0
+    for result in results:
+        single, separate = result["single_pass_cores"], result["separate_cores"]
+        print(f"{'+'.join(result['renditions']):<28}{single:>11.2f} c{single - previous:>11.2f} c"
+              f"{separate:>11.2f} c{(1 - single / separate) if separate else 0:>8.0%}")
+        previous = single
+    print("(c = cores needed to encode in real time)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"duration_s": args.duration, "cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=int, default=20, help="seconds of 1080p30 source to encode")
+    parser.add_argument("--json", help="also write the results here")
+    main(parser.parse_args())
@@ -0,0 +1,248 @@
+"""How many concurrent 720p matches the multi-match server sustains on a given number of cores.
+
+    python benchmarks/match_throughput.py --cores 8 --matches 1 2 4 6 8 --duration 30 --json throughput.json
+
+For each match count a fresh match_server.py runs in its own process,
+confined to the first --cores CPUs, and that many matches are created
+through its control API. Each decodes the same --cameras synthetic 720p
+cameras and pushes to its own local ingest sink (see harness.py and
+latency.FlvSink), while every --event-interval s a scoring event is
+posted to each match and every --switch-every s each cuts camera. The
+cameras and sinks run on the remaining CPUs when there are any, so they
+don't count against the server's share.
+
+After --warmup s it records, per count: matches admitted and refused by
+the governor, each match's encoder speed, frames the compositor had to
+repeat and distinct camera frames reaching its sink per second, busy
+cores measured against cores the governor committed, and the control
+API's round trip. A count is sustained when every match was admitted and
+each one kept encoding in real time with its sink getting the full
+frame rate.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from harness import OUTCOMES, SyntheticCamera, summarize  # noqa: E402
+from latency import FlvSink  # noqa: E402
+
+REPO = os.path.join(os.path.dirname(__file__), "..")
+
+# What counts as keeping up
+MIN_SPEED = 0.97
+MIN_SINK_FPS_RATIO = 0.95
+MAX_REPEATED_RATIO = 0.02
+
+
+class ControlClient:
+    """Calls the match server's JSON API and times each round trip"""
+
+    def __init__(self, port):
+        self.base = f"http://127.0.0.1:{port}"
+        self.round_trip_ms = []
+
+    def request(self, method, path, body=None, timeout=40):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                status, result = response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            status, result = e.code, json.loads(e.read() or b"{}")
+        self.round_trip_ms.append((time.perf_counter() - start) * 1000)
+        return status, result
+
+    def wait_ready(self, timeout=15):
+        end = time.perf_counter() + timeout
+        while time.perf_counter() < end:
+            try:
+                return self.request("GET", "/stats")[1]
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("match server didn't start")
+
+
+def split_cpus(cores):
+    """(server CPUs, harness CPUs): the first cores for the server, the rest (or all, if none are left) for us"""
+    cpus = sorted(os.sched_getaffinity(0))
+    if cores > len(cpus):
+        sys.exit(f"only {len(cpus)} CPUs available")
+    return cpus[:cores], cpus[cores:] or cpus
+
+
+def start_server(args, directory, cpus):
+    command = [sys.executable, os.path.join(REPO, "match_server.py"), "--port", str(args.port + 90),
+               "--directory", directory]
+    return subprocess.Popen(command, cwd=REPO, preexec_fn=lambda: os.sched_setaffinity(0, cpus),
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+
+def run(count, args, cameras, server_cpus):
+    directory = tempfile.mkdtemp(prefix="match-bench-")
+    server = start_server(args, directory, server_cpus)
+    client = ControlClient(args.port + 90)
+    sinks = [FlvSink(f"match{n}", args.port + n, cameras[0].barcode.read).start() for n in range(count)]
+    rng = random.Random(count)
+    outcomes, weights = [o for o, _ in OUTCOMES], [w for _, w in OUTCOMES]
+    samples = {}
+    busy = []
+    try:
+        client.wait_ready()
+        admitted, refused = [], {}
+        for sink in sinks:
+            config = {"id": sink.name, "cameras": [camera.url for camera in cameras],
+                      "destinations": {"sink": sink.url}, "width": args.width, "height": args.height,
+                      "fps": args.fps}
+            status, result = client.request("POST", "/matches", config)
+            if status == 201:
+                admitted.append(sink.name)
+            else:
+                refused[sink.name] = result.get("error")
+        client.round_trip_ms.clear()  # creation times aren't control latency
+        score_ms = []
+        start = time.perf_counter()
+        measure_from, end = start + args.warmup, start + args.warmup + args.duration
+        next_event, next_switch, program = start, start + args.switch_every, 0
+        while (now := time.perf_counter()) < end:
+            if now >= next_event:
+                for match in admitted:
+                    kind, value = rng.choices(outcomes, weights)[0]
+                    before = len(client.round_trip_ms)
+                    client.request("POST", f"/matches/{match}/score", {"action": kind, "value": value})
+                    score_ms.extend(client.round_trip_ms[before:])
+                next_event += args.event_interval
+            if len(cameras) > 1 and now >= next_switch:
+                program = (program + 1) % len(cameras)
+                for match in admitted:
+                    client.request("POST", f"/matches/{match}/camera", {"index": program})
+                next_switch += args.switch_every
+            if now >= measure_from:
+                for match in admitted:
+                    status, stats = client.request("GET", f"/matches/{match}")
+                    if status == 200 and stats.get("encoder"):
+                        samples.setdefault(match, []).append(stats)
+                busy.append(client.request("GET", "/stats")[1])
+            time.sleep(1.0)
+        measured_s = time.perf_counter() - measure_from
+        matches = {}
+        for match in admitted:
+            stats = samples.get(match, [])
+            sink = next(s for s in sinks if s.name == match)
+            arrived = sum(1 for t in sink.frames.values() if t >= measure_from)
+            if len(stats) < 2:
+                matches[match] = {"samples": len(stats), "sink_fps": arrived / measured_s, "speed_min": None}
+                continue
+            first, last = stats[0], stats[-1]
+            frames = last["frames"] - first["frames"]
+            speeds = [s["encoder"]["speed"] or 0.0 for s in stats[1:]]
+            matches[match] = {
+                "samples": len(stats),
+                "speed_mean": sum(speeds) / len(speeds),
+                "speed_min": min(speeds),
+                "repeated_ratio": (last["repeated_frames"] - first["repeated_frames"]) / frames if frames else 1.0,
+                "composite_ms": last["composite"]["avg_ms"],
+                "sink_fps": arrived / measured_s,
+                "destinations": last["destinations"]
+            }
+        sustained = len(admitted) == count and all(
+            m["speed_min"] is not None and m["speed_min"] >= MIN_SPEED
+            and m["sink_fps"] >= MIN_SINK_FPS_RATIO * args.fps and m["repeated_ratio"] <= MAX_REPEATED_RATIO
+            for m in matches.values())
+        measured = [b["busy_cores"] for b in busy if b.get("busy_cores") is not None]
+        for match in admitted:
+            client.request("DELETE", f"/matches/{match}")
+        return {
+            "matches": count,
+            "admitted": len(admitted),
+            "refused": refused,
+            "sustained": sustained,
+            "busy_cores": summarize(measured),
+            "committed_cores": busy[-1]["committed_cores"] if busy else None,
+            "score_round_trip_ms": summarize(score_ms),
+            "control_round_trip_ms": summarize(client.round_trip_ms),
+            "per_match": matches
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        for sink in sinks:
+            sink.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_run(result, cores):
+    busy, score = result["busy_cores"], result["score_round_trip_ms"]
+    speeds = [m["speed_min"] for m in result["per_match"].values() if m["speed_min"] is not None]
+    fps = [m["sink_fps"] for m in result["per_match"].values()]
+    line = (f"{result['matches']:>3} matches on {cores} cores: {result['admitted']} admitted, "
+            f"{'sustained' if result['sustained'] else 'NOT sustained'}")
+    if busy["count"]:
+        line += f", {busy['mean']:.1f} cores busy ({result['committed_cores'] or 0:.1f} committed)"
+    if speeds:
+        line += f", slowest encoder {min(speeds):.2f}x, sink fps {min(fps):.1f}-{max(fps):.1f}"
+    if score["count"]:
+        line += f", score API p50 {score['p50']:.0f} ms p95 {score['p95']:.0f} ms"
+    print(line)
+    for match, error in result["refused"].items():
+        print(f"    {match} refused: {error}")
+
+
+def main(args):
+    if shutil.which('ffmpeg') is None:
+        sys.exit("ffmpeg is needed for this benchmark")
+    server_cpus, harness_cpus = split_cpus(args.cores)
+    # The cameras and sinks (and their FFmpeg children) stay off the server's cores
+    os.sched_setaffinity(0, harness_cpus)
+    cameras = [SyntheticCamera(i, args.port + 100 + i, width=args.width, height=args.height, fps=args.fps).start()
+               for i in range(args.cameras)]
+    results = []
+    try:
+        time.sleep(2.0)  # let the cameras settle
+        for count in args.matches:
+            result = run(count, args, cameras, server_cpus)
+            results.append(result)
+            print_run(result, args.cores)
+    finally:
+        for camera in cameras:
+            camera.stop()
+    best = max((r["matches"] for r in results if r["sustained"]), default=0)
+    print(f"{args.cores} cores sustain {best} concurrent {args.height}p{args.fps} matches "
+          f"(of those tried: {', '.join(map(str, args.matches))})")
+    if args.json:
+        shared = not set(harness_cpus).isdisjoint(server_cpus)
+        with open(args.json, "w") as f:
+            json.dump({"cores": args.cores, "cpus": os.cpu_count(), "harness_on_server_cores": shared,
+                       "args": vars(args), "sustained_matches": best, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="CPUs the match server may use")
+    parser.add_argument("--matches", type=int, nargs="+", default=[1, 2, 4, 6])
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per match count")
+    parser.add_argument("--warmup", type=float, default=10, help="seconds after the matches start before measuring")
+    parser.add_argument("--cameras", type=int, default=2, help="cameras, shared by every match")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--event-interval", type=float, default=2.0, help="seconds between scoring events")
+    parser.add_argument("--switch-every", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=19600)
+    parser.add_argument("--verbose", action="store_true", help="show the match server's log")
+    parser.add_argument("--json", help="also write the results here")
+    main(parser.parse_args())
@@ -0,0 +1,127 @@
+"""Load test for score_server: many local SSE subscribers, p50/p99 push latency.
+
+    python benchmarks/score_push_load.py --clients 2000 --updates 50
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from match_engine import MatchEngine  # noqa: E402
+from score_server import ScoreServer, score_state  # noqa: E402
+
+
+async def subscriber(port, latencies, connected):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    connected.release()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b"data: "):
+                message = json.loads(line[6:])
+                if message["type"] == "delta":
+                    latencies.append((time.time() - message["ts"]) * 1000)
+    finally:
+        writer.close()
+
+
+async def client_group(port, count, conn):
+    latencies = []
+    connected = asyncio.Semaphore(0)
+    tasks = [asyncio.ensure_future(subscriber(port, latencies, connected)) for _ in range(count)]
+    for _ in range(count):
+        await connected.acquire()
+    conn.send("connected")
+    # Main process says when publishing is over
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    for task in tasks:
+        task.cancel()
+    conn.send(latencies)
+
+
+def run_client_group(port, count, conn):
+    raise_fd_limit(count)
+    asyncio.run(client_group(port, count, conn))
+
+
+def raise_fd_limit(count):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, count * 2 + 256)), hard))
+
+
+def main(args):
+    # Clients live in their own processes so their parsing doesn't steal the
+    # server's GIL; the server runs embedded, as in the app
+    raise_fd_limit(args.clients)
+    server = ScoreServer("127.0.0.1", args.port)
+    server.start_in_thread()
+    if server.loop is None:
+        sys.exit("server failed to start")
+
+    groups = []
+    per_group = -(-args.clients // args.procs)
+    for i in range(args.procs):
+        count = min(per_group, args.clients - i * per_group)
+        parent, child = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=run_client_group, args=(args.port, count, child), daemon=True)
+        proc.start()
+        groups.append((proc, parent))
+    for _, conn in groups:
+        conn.recv()
+    while len(server.subscribers) < args.clients:
+        time.sleep(0.01)
+    print(f"{args.clients} subscribers connected over {args.procs} client processes")
+
+    engine = MatchEngine()
+    start = time.perf_counter()
+    publish_us, publish_cpu_us = [], []
+    for i in range(args.updates):
+        engine.add_runs(i % 7 if i % 7 != 5 else 1)
+        t, cpu = time.perf_counter(), time.thread_time()
+        server.publish(score_state(engine))
+        publish_us.append((time.perf_counter() - t) * 1e6)
+        publish_cpu_us.append((time.thread_time() - cpu) * 1e6)
+        time.sleep(args.interval_ms / 1000)
+    time.sleep(1.0)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for proc, conn in groups:
+        conn.send("stop")
+        latencies += conn.recv()
+        proc.join()
+    server.stop()
+
+    latencies.sort()
+    publish_us.sort()
+    publish_cpu_us.sort()
+    coalesced = args.clients * args.updates - len(latencies)
+    print(f"{len(latencies)} deltas delivered in {elapsed:.1f} s ({coalesced} coalesced)")
+    if latencies:
+        print(f"push latency p50 {latencies[len(latencies) // 2]:.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, max {latencies[-1]:.1f} ms")
+    # Wall time includes waiting for the GIL while the server fans out, and being preempted when
+    # the cores are shared with the clients; CPU time is what the call itself costs
+    print(f"publish() call p50 {publish_us[len(publish_us) // 2]:.1f} us, "
+          f"p99 {publish_us[int(len(publish_us) * 0.99)]:.1f} us wall (time the scorer thread waits), "
+          f"p99 {publish_cpu_us[int(len(publish_cpu_us) * 0.99)]:.1f} us CPU, on {os.cpu_count()} CPUs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=100)
+    parser.add_argument("--procs", type=int, default=4, help="client processes")
+    parser.add_argument("--port", type=int, default=8799)
+    main(parser.parse_args())
@@ -0,0 +1,150 @@
+"""Supervisor behaviour against a local ingest stand-in that drops connections on purpose.
+
+    python benchmarks/supervisor_drops.py --duration 20
+
+The sink accepts FLV over plain TCP (what an RTMP server receives after
+its handshake) and discards it, cutting every connection after a random
+0.5-3 s and going fully dark for a while in the middle of the run. The
+publisher is FFmpeg pushing a test pattern when it's installed, otherwise
+a small Python process that streams bytes and exits non-zero when its
+connection breaks. Three scenarios are checked: reconnect after drops,
+clean stop is not restarted, and a persistent outage ends in "gave up".
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from supervisor import StreamSupervisor, RUNNING, BACKOFF, STOPPED, GAVE_UP  # noqa: E402
+
+FAKE_PUBLISHER = r"""
+import socket, sys
+try:
+    s = socket.create_connection(("127.0.0.1", int(sys.argv[1])), timeout=2)
+    chunk = b"\0" * 4096
+    while True:
+        s.sendall(chunk)
+except OSError:
+    sys.exit(1)
+"""
+
+
+class DroppingSink:
+    """TCP sink that cuts connections after a random time and can go dark"""
+
+    def __init__(self, port, min_s=0.5, max_s=3.0):
+        self.port = port
+        self.min_s, self.max_s = min_s, max_s
+        self.dark = False
+        self.connections = 0
+        self.bytes = 0
+        self.running = True
+        self.server = socket.create_server(("127.0.0.1", port), reuse_port=False)
+        self.server.settimeout(0.2)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            if self.dark:
+                conn.close()  # refused, as far as the publisher can tell
+                continue
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        deadline = time.perf_counter() + random.uniform(self.min_s, self.max_s)
+        conn.settimeout(0.2)
+        with conn:
+            while self.running and not self.dark and time.perf_counter() < deadline:
+                try:
+                    data = conn.recv(65536)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                if not data:
+                    return
+                self.bytes += len(data)
+            # Abortive close (RST) like an ingest server dropping us
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\1\0\0\0\0\0\0\0")
+
+    def close(self):
+        self.running = False
+        self.server.close()
+
+
+def publisher_command(port, use_ffmpeg):
+    if use_ffmpeg:
+        return ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-re',
+                '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30', '-f', 'lavfi', '-i', 'sine',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac',
+                '-f', 'flv', f'tcp://127.0.0.1:{port}']
+    return [sys.executable, '-c', FAKE_PUBLISHER, str(port)]
+
+
+def main(args):
+    logging.basicConfig(level=logging.ERROR)
+    use_ffmpeg = shutil.which('ffmpeg') is not None and not args.fake_publisher
+    print(f"publisher: {'ffmpeg' if use_ffmpeg else 'python stand-in'}")
+    sink = DroppingSink(args.port)
+    cmd = publisher_command(args.port, use_ffmpeg)
+    spawn = lambda: subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    supervisor = StreamSupervisor(base_delay=0.25, max_delay=2.0, storm_limit=1000, healthy_after_s=1.0)
+    checks = []
+
+    # 1. Drops (and a short outage) are ridden out
+    supervisor.watch("drops", spawn(), spawn)
+    time.sleep(args.duration / 2)
+    sink.dark = True
+    time.sleep(2.0)
+    sink.dark = False
+    time.sleep(args.duration / 2)
+    stats = supervisor.stats("drops")
+    print(f"drops: {sink.connections} connections, {stats['crashes']} crashes, {stats['restarts']} restarts, "
+          f"uptime {stats['uptime_s']:.1f} of {args.duration + 2:.0f} s, "
+          f"recover p50 {stats['recover_time']['p50_ms']:.0f} ms, p95 {stats['recover_time']['p95_ms']:.0f} ms, "
+          f"max {stats['recover_time']['max_ms']:.0f} ms")
+    checks.append(("restarted after drops", stats['restarts'] > 0 and stats['state'] in (RUNNING, BACKOFF)))
+
+    # 2. A clean stop stays stopped
+    supervisor.stop("drops")
+    time.sleep(3.0)
+    stats = supervisor.stats("drops")
+    checks.append(("clean stop not restarted", stats['state'] == STOPPED))
+
+    # 3. A sink that never comes back ends in "gave up" instead of a restart storm
+    sink.dark = True
+    stormy = StreamSupervisor(base_delay=0.25, max_delay=2.0, storm_limit=args.storm_limit, storm_window_s=60)
+    start = time.perf_counter()
+    stormy.watch("outage", spawn(), spawn)
+    while stormy.stats("outage")['state'] != GAVE_UP and time.perf_counter() - start < 60:
+        time.sleep(0.1)
+    stats = stormy.stats("outage")
+    print(f"outage: gave up after {stats['restarts']} restarts in {time.perf_counter() - start:.1f} s")
+    checks.append(("storm limited", stats['state'] == GAVE_UP and stats['restarts'] <= args.storm_limit))
+
+    sink.close()
+    for name, ok in checks:
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--storm-limit", type=int, default=6)
+    parser.add_argument("--port", type=int, default=19350)
+    parser.add_argument("--fake-publisher", action="store_true", help="don't use ffmpeg even if installed")
+    main(parser.parse_args())
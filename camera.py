@@ -0,0 +1,253 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+import tkinter as tk
+
+import vlc
+
+from compositor import FrameReader
+from events import DelayTracker
+
+logger = logging.getLogger(__name__)
+
+# Standby players only need a small buffer since they are already connected
+STANDBY_CACHING_MS = 300
+
+
+def _run_inline(fn, *args, on_done=None, on_error=None):
+    try:
+        result = fn(*args)
+    except Exception as e:
+        if on_error is None:
+            raise
+        on_error(e)
+    else:
+        if on_done:
+            on_done(result)
+
+
+class Camera:
+    """A warm source: a muted VLC player drawing into its own stacked frame.
+
+    Tk work happens on the calling (Tk) thread; everything that talks to
+    libvlc or starts/stops FFmpeg goes through run, which is the media
+    worker's submit when there is one. The player is created by the first
+    run job, so it is None until then. on_state(name, state) is called on
+    libvlc's thread for every player state change.
+    """
+
+    def __init__(self, name, url, vlc_instance, container, on_error=None, caching_ms=STANDBY_CACHING_MS,
+                 run=_run_inline, on_state=None):
+        self.name = name
+        self.url = url
+        self.vlc_instance = vlc_instance
+        self.on_error = on_error
+        self.on_state = on_state
+        self.caching_ms = caching_ms
+        self.run = run
+        self.frame = tk.Frame(container, bg='black')
+        self.frame.place(x=0, y=0, relwidth=1, relheight=1)
+        self.frame.lower()
+        self.player = None
+        # Player state is cached from libvlc's events so the GUI never has to ask
+        self.playing = False
+        self.state = None
+        self.reader = None
+
+    def _create_player(self):
+        player = self.vlc_instance.media_player_new()
+        caching = self.caching_ms
+        media = self.vlc_instance.media_new(self.url, f':network-caching={caching}',
+                                            f':live-caching={caching}', f':file-caching={caching}')
+        player.set_media(media)
+        events = player.event_manager()
+        for event_type, state in ((vlc.EventType.MediaPlayerPlaying, "playing"),
+                                  (vlc.EventType.MediaPlayerPaused, "paused"),
+                                  (vlc.EventType.MediaPlayerStopped, "stopped"),
+                                  (vlc.EventType.MediaPlayerEndReached, "ended"),
+                                  (vlc.EventType.MediaPlayerEncounteredError, "error")):
+            events.event_attach(event_type, self._set_state, state)
+        if self.on_error:
+            events.event_attach(vlc.EventType.MediaPlayerEncounteredError,
+                                lambda event: self.on_error(self.name, event))
+        self.player = player
+
+    def _set_state(self, event, state):
+        self.playing = state == "playing"
+        self.state = state
+        if self.on_state:
+            self.on_state(self.name, state)
+
+    def start(self):
+        self.run(self._play, self.frame.winfo_id())
+
+    def _play(self, window):
+        if self.player is None:
+            self._create_player()
+        if os.name == 'nt':
+            self.player.set_hwnd(window)
+        else:
+            self.player.set_xwindow(window)
+        self.player.audio_set_mute(True)
+        if self.player.play() == -1:
+            raise Exception(f"Failed to play {self.name}")
+
+    def restart(self):
+        """Reconnect the player (and program decoder, if running)"""
+        if self.reader is not None:
+            self.stop_program_reader()
+            self.program_reader()
+        self.run(self._restart, self.frame.winfo_id())
+
+    def _restart(self, window):
+        if self.player is not None:
+            self.player.stop()
+        self._play(window)
+
+    def set_muted(self, muted):
+        self.run(self._set_muted, muted)
+
+    def _set_muted(self, muted):
+        if self.player is not None:
+            self.player.audio_set_mute(muted)
+
+    def program_reader(self):
+        """Decoder feeding the outgoing program when this camera is cut to"""
+        if self.reader is None:
+            self.reader = FrameReader(self.url)
+            self.run(self.reader.start)
+        return self.reader
+
+    def stop_program_reader(self):
+        reader, self.reader = self.reader, None
+        if reader:
+            self.run(reader.stop)
+
+    def stop(self):
+        self.stop_program_reader()
+        # libvlc draws into the frame's window until the player is released, so the frame goes only after that
+        self.frame.lower()
+        self.run(self._release, on_done=self._destroy_frame, on_error=self._destroy_frame)
+
+    def _destroy_frame(self, _result=None):
+        self.frame.destroy()
+
+    def _release(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player.release()
+            self.player = None
+        self.playing = False
+
+
+class CameraEngine:
+    """Keeps several camera sources connected so a cut is only a swap.
+
+    Up to max_warm sources stay playing, muted, each in its own frame
+    stacked inside container; a cut raises the chosen frame and unmutes
+    it. While a program pipeline is attached, every warm camera also runs
+    a FrameReader and the cut repoints the pipeline at it. Beyond the cap
+    the least recently used source is shut down; pinned sources and the
+    one on air are never evicted. With a media worker (MediaWorker), the
+    libvlc and FFmpeg calls behind a cut run there, so switch() itself
+    only costs the Tk frame swap.
+    """
+
+    def __init__(self, vlc_instance, container, streams, max_warm=3, on_error=None, keep_on_top=(), media=None,
+                 on_state=None):
+        self.vlc_instance = vlc_instance
+        self.container = container
+        self.streams = streams
+        self.max_warm = max_warm
+        self.on_error = on_error
+        self.on_state = on_state
+        self.keep_on_top = list(keep_on_top)
+        self.cameras = OrderedDict()
+        self.pinned = set()
+        self.active = None
+        self.pipeline = None
+        self.switch_time = DelayTracker()
+        self.run = media.submit if media else _run_inline
+
+    def warm(self, name):
+        """Make sure a source is connected and decoding; returns its Camera"""
+        camera = self.cameras.get(name)
+        if camera is None:
+            camera = Camera(name, self.streams[name], self.vlc_instance, self.container, self.on_error,
+                            run=self.run, on_state=self.on_state)
+            camera.start()
+            self.cameras[name] = camera
+            logger.info(f"Warmed up {name}")
+        self.cameras.move_to_end(name)
+        if self.pipeline:
+            camera.program_reader()
+        self._evict()
+        return camera
+
+    def warm_all(self):
+        """Warm sources in configured order until the cap is reached"""
+        for name in list(self.streams)[:self.max_warm]:
+            self.warm(name)
+
+    def pin(self, name):
+        """Keep a source warm regardless of the cap (e.g. the fallback)"""
+        self.pinned.add(name)
+        self.warm(name)
+
+    def _evict(self):
+        while len(self.cameras) > max(self.max_warm, len(self.pinned) + 1):
+            victim = next((n for n in self.cameras if n != self.active and n not in self.pinned), None)
+            if victim is None:
+                break
+            self.cameras.pop(victim).stop()
+            logger.info(f"Released {victim} (warm source cap {self.max_warm})")
+
+    def switch(self, name):
+        """Cut to a source, warming it first if it isn't already"""
+        start = time.perf_counter()
+        camera = self.warm(name)
+        previous = self.cameras.get(self.active)
+        camera.frame.lift()
+        for widget in self.keep_on_top:
+            widget.lift()
+        camera.set_muted(False)
+        if previous is not None and previous is not camera:
+            previous.set_muted(True)
+        if self.pipeline:
+            self.run(self.pipeline.set_reader, camera.program_reader())
+        self.active = name
+        self.switch_time.record((time.perf_counter() - start) * 1000)
+        return camera
+
+    def active_camera(self):
+        return self.cameras.get(self.active)
+
+    def is_playing(self):
+        camera = self.active_camera()
+        return bool(camera and camera.playing)
+
+    def program_reader(self):
+        """Decoder for the camera currently on air"""
+        return self.active_camera().program_reader()
+
+    def attach_program(self, pipeline):
+        """Keep a decoder running for every warm camera while pipeline is on air"""
+        self.pipeline = pipeline
+        for camera in self.cameras.values():
+            camera.program_reader()
+
+    def detach_program(self, pipeline=None):
+        """Stop the program decoders (only if pipeline, when given, is still the attached one)"""
+        if pipeline is not None and pipeline is not self.pipeline:
+            return
+        self.pipeline = None
+        for camera in self.cameras.values():
+            camera.stop_program_reader()
+
+    def stop_all(self):
+        self.pipeline = None
+        for camera in self.cameras.values():
+            camera.stop()
+        self.cameras.clear()
+        self.active = None
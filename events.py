@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from collections import deque
+
+
+class DelayTracker:
+    """Keeps the most recent delay samples (ms) and summarises them"""
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, delay_ms):
+        with self.lock:
+            self.samples.append(delay_ms)
+
+    def summary(self):
+        with self.lock:
+            last = self.samples[-1] if self.samples else 0.0
+            samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0, "last_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        return {
+            "count": len(samples),
+            "last_ms": last,
+            "p50_ms": samples[len(samples) // 2],
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max_ms": samples[-1]
+        }
+
+
+class ScoreEvents:
+    """Bounded, thread-safe handoff of score changes from the Tk thread.
+
+    Publishers pass a snapshot of the overlay fields taken on their own
+    thread, so the consumer never reads the live match dicts. The consumer
+    takes a whole burst at once and only needs the newest snapshot, which
+    is why a full queue simply drops its oldest entry.
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, maxsize=64):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.delay = DelayTracker()
+        self.dropped = 0
+
+    def publish(self, kind, fields):
+        event = (time.perf_counter(), kind, fields)
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def wait_burst(self, timeout=None):
+        """Block for the next change, then drain the rest of the burst.
+
+        Returns (first_timestamp, kinds, latest_fields), or None on timeout
+        or close.
+        """
+        try:
+            event = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event is self._CLOSED:
+            return None
+        first_ts, kind, fields = event
+        kinds = [kind]
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is self._CLOSED:
+                break
+            _, kind, fields = event
+            kinds.append(kind)
+        return first_ts, kinds, fields
+
+    def mark_on_screen(self, first_ts):
+        """Record score-to-screen delay for a burst that just reached the encoder"""
+        self.delay.record((time.perf_counter() - first_ts) * 1000)
+
+    def close(self):
+        """Wake a waiting consumer"""
+        try:
+            self.queue.put_nowait(self._CLOSED)
+        except queue.Full:
+            pass
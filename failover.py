@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+
+import vlc
+
+from events import DelayTracker
+
+logger = logging.getLogger(__name__)
+
+HEALTHY, CONNECTING, FAILED = "healthy", "connecting", "failed"
+
+
+class SourceHealth:
+    """Progress markers for one source, used to spot stalls before VLC errors out"""
+
+    def __init__(self, now):
+        self.reset(now)
+
+    def reset(self, now):
+        self.reset_at = now
+        self.started = False
+        self.stalled_for = 0.0
+        self.last_time = None
+        self.last_bytes = None
+        self.time_moved = now
+        self.bytes_moved = None  # until VLC has reported demux stats at all
+        self.sampled_at = now
+        self.healthy_since = None
+        self.error = False
+
+
+class FailoverMonitor:
+    """Hot-standby failover between the watched camera and a fallback.
+
+    The fallback is pinned warm in the CameraEngine so cutting to it is a
+    swap. The watched source counts as stalled when its playback clock is
+    frozen, no bytes have been demuxed, or its program decoder has stopped
+    producing frames for stall_ms, or when VLC reports an error. stall_ms
+    defaults to well under a typical 2 s GOP. Once on fallback, the primary
+    is retried every retry_s and only cut back to after staying healthy for
+    recover_s. A source that hasn't started playing yet gets startup_grace_s
+    to connect before it counts as failed. Decisions and cuts happen on the
+    Tk thread via root.after; the player's clock and demux stats are read
+    on the media worker (MediaWorker) when there is one, one sample in
+    flight at a time, and posted back. Their progress is judged as of the
+    latest sample, so a worker busy with a slow command delays detection
+    rather than faking a stall. report_error may be called from libvlc's
+    callback thread.
+    """
+
+    def __init__(self, root, cameras, fallback, stall_ms=800, recover_s=10.0, retry_s=5.0,
+                 startup_grace_s=10.0, interval_ms=200, on_change=None, media=None):
+        self.root = root
+        self.media = media
+        self.cameras = cameras
+        self.fallback = fallback
+        self.stall_s = stall_ms / 1000
+        self.recover_s = recover_s
+        self.retry_s = retry_s
+        self.startup_grace_s = startup_grace_s
+        self.interval_ms = interval_ms
+        self.on_change = on_change
+        self.primary = None
+        self.on_fallback = False
+        self.health = SourceHealth(time.perf_counter())
+        self._errors = set()
+        self._sampling = False
+        self._lock = threading.Lock()
+        self._fallback_started = None
+        self._last_retry = 0.0
+        self.failovers = 0
+        self.fallback_seconds = 0.0
+        self.switch_latency = DelayTracker()
+
+    def start(self):
+        self.cameras.pin(self.fallback)
+        self.root.after(self.interval_ms, self._poll)
+
+    def watch(self, name):
+        """Make name the primary source (the operator cut to it)"""
+        if name == self.fallback:
+            return
+        if self.primary and self.primary != name:
+            self.cameras.pinned.discard(self.primary)
+        self.primary = name
+        self.cameras.pinned.add(name)
+        self.health.reset(time.perf_counter())
+        if self.on_fallback:
+            self._end_fallback_episode()
+
+    def report_error(self, name):
+        """Safe to call from any thread"""
+        with self._lock:
+            self._errors.add(name)
+
+    def _check(self, now):
+        camera = self.cameras.cameras.get(self.primary)
+        health = self.health
+        if camera is None:
+            return FAILED
+        with self._lock:
+            if self.primary in self._errors:
+                self._errors.discard(self.primary)
+                health.error = True
+        if health.error:
+            return FAILED
+        if not health.started:
+            # Still connecting: not a stall, unless it never comes up
+            health.stalled_for = 0.0
+            return CONNECTING if now - health.reset_at < self.startup_grace_s else FAILED
+        # Frozen clock or no bytes arriving both count as a stall; bytes only once VLC has given stats
+        moved = health.time_moved if health.bytes_moved is None else min(health.time_moved, health.bytes_moved)
+        health.stalled_for = health.sampled_at - moved
+        if camera.reader is not None and camera.reader.last_frame_time:
+            health.stalled_for = max(health.stalled_for, now - camera.reader.last_frame_time)
+        return HEALTHY if health.stalled_for < self.stall_s else FAILED
+
+    def _sample(self, name, player):
+        """Playback clock and demuxed bytes of name's player; runs on the media worker"""
+        # The player is created on the media worker; until then it is still connecting
+        player_time = player.get_time() if player is not None else -1
+        stats = vlc.MediaStats()
+        media = player.get_media() if player is not None else None
+        read_bytes = stats.demux_read_bytes if media is not None and media.get_stats(stats) else None
+        return name, player, player_time, read_bytes, time.perf_counter()
+
+    def _sampled(self, sample):
+        self._sampling = False
+        name, player, player_time, read_bytes, sampled_at = sample
+        camera = self.cameras.cameras.get(self.primary)
+        health = self.health
+        if name != self.primary or camera is None or camera.player is not player or sampled_at < health.reset_at:
+            return  # cut away, restarted or reset since it was taken
+        health.sampled_at = sampled_at
+        if player_time != health.last_time:
+            health.last_time = player_time
+            health.time_moved = sampled_at
+            health.started = health.started or player_time > 0
+        if read_bytes is not None and read_bytes != health.last_bytes:
+            health.last_bytes = read_bytes
+            health.bytes_moved = sampled_at
+
+    def _sample_failed(self, error):
+        self._sampling = False
+
+    def _request_sample(self):
+        camera = self.cameras.cameras.get(self.primary)
+        if camera is None or self._sampling:
+            return
+        if self.media is None:
+            self._sampled(self._sample(self.primary, camera.player))
+            return
+        self._sampling = True
+        self.media.submit(self._sample, self.primary, camera.player, on_done=self._sampled,
+                          on_error=self._sample_failed)
+
+    def _poll(self):
+        now = time.perf_counter()
+        if self.primary:
+            self._request_sample()
+            state = self._check(now)
+            if state == HEALTHY and self.health.healthy_since is None:
+                self.health.healthy_since = now
+            elif state != HEALTHY:
+                self.health.healthy_since = None
+
+            if not self.on_fallback and state == FAILED:
+                self._fail_over(now)
+            elif self.on_fallback and state == HEALTHY and now - self.health.healthy_since >= self.recover_s:
+                self._recover()
+            elif self.on_fallback and state == FAILED and now - self._last_retry >= self.retry_s:
+                self._retry_primary(now)
+        self.root.after(self.interval_ms, self._poll)
+
+    def _fail_over(self, now):
+        reason = "error" if self.health.error else "stall"
+        detected_after = self.health.stalled_for
+        start = time.perf_counter()
+        self.cameras.switch(self.fallback)
+        switch_ms = (time.perf_counter() - start) * 1000
+        self.switch_latency.record(switch_ms)
+        self.on_fallback = True
+        self.failovers += 1
+        self._fallback_started = now
+        self._last_retry = now
+        logger.warning(f"{self.primary} {reason} (no progress for {detected_after * 1000:.0f} ms), "
+                       f"switched to {self.fallback} in {switch_ms:.1f} ms")
+        if self.on_change:
+            self.on_change(self.fallback, f"{self.primary} {reason} - on fallback")
+
+    def _retry_primary(self, now):
+        self._last_retry = now
+        camera = self.cameras.cameras.get(self.primary)
+        if camera is None:
+            camera = self.cameras.warm(self.primary)
+        else:
+            camera.restart()
+        self.health.reset(now)
+        logger.info(f"Retrying {self.primary}")
+
+    def _end_fallback_episode(self):
+        spent = time.perf_counter() - self._fallback_started
+        self.fallback_seconds += spent
+        self.on_fallback = False
+        return spent
+
+    def _recover(self):
+        start = time.perf_counter()
+        self.cameras.switch(self.primary)
+        switch_ms = (time.perf_counter() - start) * 1000
+        self.switch_latency.record(switch_ms)
+        spent = self._end_fallback_episode()
+        logger.info(f"{self.primary} healthy again, switched back in {switch_ms:.1f} ms "
+                    f"after {spent:.1f} s on {self.fallback}")
+        if self.on_change:
+            self.on_change(self.primary, "Connected")
+
+    def stats(self):
+        on_fallback_now = time.perf_counter() - self._fallback_started if self.on_fallback else 0.0
+        return {
+            "primary": self.primary,
+            "on_fallback": self.on_fallback,
+            "failovers": self.failovers,
+            "fallback_seconds": self.fallback_seconds + on_fallback_now,
+            "switch_latency": self.switch_latency.summary()
+        }
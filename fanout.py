@@ -0,0 +1,362 @@
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+from telemetry import PROGRESS_ARGS
+
+logger = logging.getLogger(__name__)
+
+# Read/write whole MPEG-TS packets so a relay never starts mid-packet
+TS_PACKET_SIZE = 188
+CHUNK_SIZE = TS_PACKET_SIZE * 348
+
+DEFAULT_VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '3000k']
+DEFAULT_AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '128k']
+
+# How long a removed destination gets to send what it has queued and exit before it is terminated
+RELAY_FLUSH_S = 3.0
+
+# What a relay reports when its FFmpeg exited cleanly only because the shared encoder failed
+ENCODER_FAILED = 1
+
+
+class Relay:
+    """Copies the shared encoded feed to a single RTMP destination.
+
+    Quacks like the subprocess.Popen objects kept in ffmpeg_processes
+    (wait/terminate/poll) so the app can monitor and stop it the same way.
+    output_args replaces the stream copy to output_url, for destinations
+    that process the feed further (e.g. the local HLS ladder).
+    """
+
+    def __init__(self, owner, name, output_url, max_chunks=256, telemetry=None, output_args=None):
+        self.owner = owner
+        self.telemetry = telemetry
+        self.name = name
+        self.output_url = output_url
+        self.output_args = output_args
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.dropped_chunks = 0
+        self.process = None
+        self.alive = False
+        self.encoder_failed = False
+        self._writer = None
+
+    def command(self):
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', *PROGRESS_ARGS,
+            '-f', 'mpegts', '-i', 'pipe:0',
+            *(self.output_args or ['-c', 'copy', '-f', 'flv', self.output_url])
+        ]
+
+    def start(self):
+        stderr = subprocess.PIPE if self.telemetry else subprocess.DEVNULL
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=stderr)
+        if self.telemetry:
+            self.telemetry.register(self.name, self.process, queue_depth=self.queue_depth)
+        self.alive = True
+        self._writer = threading.Thread(target=self._write_loop, name=f"relay-{self.name}", daemon=True)
+        self._writer.start()
+
+    def push(self, chunk):
+        """Queue a chunk without ever blocking the distributor"""
+        if not self.alive:
+            return
+        try:
+            self.queue.put_nowait(chunk)
+        except queue.Full:
+            # A slow destination loses its oldest data instead of stalling everyone else
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped_chunks += 1
+            try:
+                self.queue.put_nowait(chunk)
+            except queue.Full:
+                pass
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def backlog_bytes(self):
+        """Bytes waiting in front of the FFmpeg process (for the bandwidth sampler)"""
+        return self.queue.qsize() * CHUNK_SIZE
+
+    def _write_loop(self):
+        stdin = self.process.stdin
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            try:
+                stdin.write(chunk)
+            except (BrokenPipeError, OSError, ValueError) as e:
+                logger.warning(f"Relay {self.name} failed: {e}")
+                break
+        self.alive = False
+        try:
+            stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def close(self, encoder_failed=False):
+        """Let the relay flush what it has and exit"""
+        self.encoder_failed = self.encoder_failed or encoder_failed
+        if not self.alive:
+            return
+        self.alive = False
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def finish(self, timeout=RELAY_FLUSH_S):
+        """Close, give FFmpeg up to timeout s to send what was queued and exit, then terminate it"""
+        self.close()
+        deadline = time.perf_counter() + timeout
+        if self._writer is not None:
+            self._writer.join(timeout)
+        try:
+            self.process.wait(max(0.0, deadline - time.perf_counter()))
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Relay {self.name} didn't finish within {timeout:.0f} s, terminating it")
+            self.process.terminate()
+
+    def poll(self):
+        return self.process.poll() if self.process else None
+
+    def wait(self, timeout=None):
+        returncode = self.process.wait(timeout)
+        # FFmpeg exits cleanly at the end of its input; if that was the encoder failing, it's not the end
+        return ENCODER_FAILED if returncode == 0 and self.encoder_failed else returncode
+
+    def terminate(self):
+        self.owner.remove_destination(self.name)
+
+
+class FanoutEncoder:
+    """Decodes and encodes the program feed once, then fans the packets out.
+
+    The encoder writes MPEG-TS to stdout; a distributor thread hands each
+    chunk to every relay. Relays are stream-copy FFmpeg processes that can
+    be added or removed while the encoder keeps running, and a failing
+    relay only takes itself down.
+
+    With frame_input=True the encoder reads raw frames from stdin (see
+    compositor.raw_video_input_args) that are supplied via write_frame.
+    Each of taps is called with every encoded chunk on the distributor
+    thread (e.g. ReplayBuffer.append, Recording.write) and must not block.
+    With a spool (spool.Spool, which should also be a tap) destinations
+    read the feed back from disk instead of from memory, so a stalled one
+    falls behind rather than losing chunks.
+
+    With a supervisor (supervisor.StreamSupervisor) the encoder is watched
+    like any output: when it crashes the relays stay attached, frames are
+    dropped meanwhile, and the respawned encoder feeds them. Relays only
+    end with the input (the encoder exiting cleanly) or stop(); without a
+    supervisor, an encoder crash closes them reporting ENCODER_FAILED.
+    A respawned or restarted encoder's timestamps are offset by the time
+    since the first one started, so the relays' copies carry on from where
+    they were rather than jumping back to zero.
+    """
+
+    ENCODER_NAME = "Shared encoder"
+
+    def __init__(self, input_args, video_args=None, audio_args=None, frame_input=False, telemetry=None, taps=(),
+                 spool=None, supervisor=None):
+        self.input_args = list(input_args)
+        self.spool = spool
+        self.telemetry = telemetry
+        self.taps = list(taps)
+        self.frame_input = frame_input
+        self.video_args = list(video_args or DEFAULT_VIDEO_ARGS)
+        self.audio_args = list(audio_args or DEFAULT_AUDIO_ARGS)
+        self.supervisor = supervisor
+        self.process = None
+        self.ended = False
+        self.relays = {}
+        self.lock = threading.Lock()
+        self._distributor = None
+        self._supervised = None
+        self._started_at = None
+
+    def encoder_command(self, ts_offset=0.0):
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', *PROGRESS_ARGS,
+            *self.input_args,
+            *self.video_args,
+            *self.audio_args,
+            *(['-output_ts_offset', f'{ts_offset:.3f}'] if ts_offset else []),
+            '-f', 'mpegts', 'pipe:1'
+        ]
+
+    def is_running(self):
+        """Encoding, or down for a moment while the supervisor brings it back"""
+        if self.process is None or self.ended:
+            return False
+        return self.supervisor is not None or self.process.poll() is None
+
+    def start(self):
+        if self.is_running():
+            return
+        self.ended = False
+        self._started_at = None
+        self._spawn()
+        if self.supervisor is not None:
+            self._supervised = self.supervisor.watch(self.ENCODER_NAME, self, self._respawn)
+        logger.info("Shared encoder started")
+
+    def _respawn(self):
+        # The supervisor's restart after a crash; the relays are still attached
+        if self.ended:
+            raise RuntimeError("the shared encoder was stopped")
+        self._spawn()
+        return self
+
+    # The supervisor watches the encoder through these, like a process
+
+    def wait(self, timeout=None):
+        """The encoder's exit code once it exits on its own; a restart() swap doesn't count"""
+        while True:
+            process = self.process
+            returncode = process.wait(timeout)
+            if process is self.process:
+                return returncode
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def _spawn(self):
+        stdin = subprocess.PIPE if self.frame_input else subprocess.DEVNULL
+        stderr = subprocess.PIPE if self.telemetry else subprocess.DEVNULL
+        now = time.perf_counter()
+        if self._started_at is None:
+            self._started_at = now
+        process = subprocess.Popen(self.encoder_command(now - self._started_at), stdin=stdin, stdout=subprocess.PIPE,
+                                   stderr=stderr)
+        self.process = process
+        if self.telemetry:
+            self.telemetry.register(self.ENCODER_NAME, process)
+        self._distributor = threading.Thread(target=self._distribute, args=(process,), name="fanout-distributor",
+                                             daemon=True)
+        self._distributor.start()
+
+    def restart(self, video_args):
+        """Swap in an encoder with new video settings; relays keep running and carry on with its output.
+
+        The relays keep the sequence header they connected with, so this is
+        for rate settings; a new frame size needs the relays restarted too.
+        """
+        self.video_args = list(video_args)
+        if self.process is None or self.process.poll() is not None:
+            return  # the next start() or respawn uses them
+        old = self.process
+        self._spawn()
+        if old.stdin:
+            try:
+                old.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+        old.terminate()
+        logger.info(f"Shared encoder restarted with {' '.join(self.video_args)}")
+
+    def write_frame(self, frame):
+        """Feed one raw frame to the encoder; False once it has gone away"""
+        process = self.process
+        try:
+            process.stdin.write(frame)
+            return True
+        except (BrokenPipeError, OSError, ValueError, AttributeError):
+            if self.process is not process:
+                # Swapped for a new encoder mid-write (restart): carry on with that one
+                return self.write_frame(frame)
+            # Crashed: drop frames until the supervisor has brought it back
+            return self.is_running()
+
+    def _distribute(self, process):
+        stdout = process.stdout
+        while True:
+            chunk = stdout.read(CHUNK_SIZE)
+            if not chunk or process is not self.process:
+                break
+            for tap in self.taps:
+                tap(chunk)
+            with self.lock:
+                relays = list(self.relays.values())
+            for relay in relays:
+                relay.push(chunk)
+                if relay.poll() is not None:
+                    # The destination went away on its own; don't keep feeding it, but keep
+                    # encoding so it can be re-added (e.g. by the supervisor) without a restart
+                    self.remove_destination(relay.name, stop_when_empty=False)
+        if process is not self.process:
+            return  # replaced by restart(); the new encoder's distributor has taken over
+        returncode = process.wait()
+        if returncode != 0 and self.is_running():
+            logger.warning(f"Shared encoder exited with {returncode}; destinations wait for its restart")
+            return
+        failed = returncode != 0 and not self.ended
+        self.ended = True
+        logger.info("Shared encoder failed" if failed else "Shared encoder output ended")
+        with self.lock:
+            relays = list(self.relays.values())
+            self.relays.clear()
+        for relay in relays:
+            relay.close(encoder_failed=failed)
+
+    def add_destination(self, name, output_url, output_args=None, from_spool=True):
+        """from_spool=False keeps a local destination (e.g. the HLS ladder) on the live in-memory feed"""
+        with self.lock:
+            if name in self.relays:
+                raise ValueError(f"{name} is already a destination")
+        if not self.is_running():
+            self.start()
+        if self.spool is not None and from_spool:
+            relay = self.spool.relay(self, name, output_url, telemetry=self.telemetry, output_args=output_args)
+        else:
+            relay = Relay(self, name, output_url, telemetry=self.telemetry, output_args=output_args)
+        relay.start()
+        with self.lock:
+            self.relays[name] = relay
+        logger.info(f"Added fan-out destination {name}")
+        return relay
+
+    def remove_destination(self, name, stop_when_empty=True):
+        with self.lock:
+            relay = self.relays.pop(name, None)
+            remaining = len(self.relays)
+        if relay is None:
+            return
+        # Bounded, and off the caller's thread (the distributor, the media worker or a supervisor)
+        threading.Thread(target=relay.finish, name=f"relay-finish-{name}", daemon=True).start()
+        logger.info(f"Removed fan-out destination {name}")
+        if remaining == 0 and stop_when_empty:
+            self.stop()
+
+    def destinations(self):
+        with self.lock:
+            return list(self.relays)
+
+    def stop(self):
+        self.ended = True
+        supervisor = self.supervisor
+        if supervisor is not None and supervisor.outputs.get(self.ENCODER_NAME) is self._supervised:
+            supervisor.stop(self.ENCODER_NAME)
+        with self.lock:
+            relays = list(self.relays.values())
+            self.relays.clear()
+        for relay in relays:
+            relay.close()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            logger.info("Shared encoder stopped")
@@ -0,0 +1,206 @@
+import logging
+import math
+import os
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# x264 presets from fastest to slowest, with roughly how many cores each
+# needs for a real-time 1080p30 encode (scaled by pixel rate for others)
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium']
+PRESET_CORES_1080P30 = {'ultrafast': 0.8, 'superfast': 1.1, 'veryfast': 1.6, 'faster': 2.3, 'fast': 2.9,
+                        'medium': 3.6}
+COPY_CORES = 0.05  # remux/relay only
+PIXEL_RATE_1080P30 = 1920 * 1080 * 30
+
+ENCODER_NICE = 5
+RELAY_NICE = 2
+
+EncodePlan = namedtuple('EncodePlan', 'name preset threads cores nice cost video_args')
+
+
+class AdmissionError(RuntimeError):
+    """The box can't sustain another real-time encode"""
+
+
+def default_reserve(cpus):
+    """Cores kept for the UI and decoders: one, less on small boxes, but never so much that an ultrafast
+    1080p30 encode doesn't fit"""
+    return max(0.0, min(1.0, cpus / 4, cpus - PRESET_CORES_1080P30['ultrafast']))
+
+
+def arg_value(args, flag):
+    return args[args.index(flag) + 1] if flag in args[:-1] else None
+
+
+def with_arg(args, flag, value):
+    args = list(args)
+    if flag in args[:-1]:
+        args[args.index(flag) + 1] = value
+    else:
+        args += [flag, value]
+    return args
+
+
+class ResourceGovernor:
+    """Gives every FFmpeg output a CPU budget before it starts.
+
+    plan() estimates an output's cost from its preset and pixel rate and
+    admits it only if that fits in what is left: the cores not already
+    committed to running outputs, less reserve_cores for the Tk UI and
+    decoders (default_reserve: 0.2 on one core, so an ultrafast 1080p30
+    encode still fits), and never more than the machine is measured to
+    have idle. If the requested preset doesn't fit, faster presets are
+    tried before refusing. An admitted encoder gets its own set of cores
+    (the first core is left to the UI when there are enough), a matching
+    -threads cap and a nice level; apply() puts those on the process once
+    spawned.
+    """
+
+    def __init__(self, reserve_cores=None):
+        self.cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else \
+            list(range(os.cpu_count() or 1))
+        self.reserve_cores = reserve_cores if reserve_cores is not None else default_reserve(len(self.cpus))
+        self.plans = {}
+        self.core_load = {cpu: 0.0 for cpu in self.cpus}
+        self.lock = threading.Lock()
+        self._last_times = None
+        self.busy_cores = None
+
+    # CPU accounting
+
+    def committed(self):
+        with self.lock:
+            return sum(plan.cost for plan in self.plans.values())
+
+    def sample(self):
+        """Measure busy cores since the last call (Linux /proc/stat); None elsewhere"""
+        try:
+            with open('/proc/stat') as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle, total = fields[3] + fields[4], sum(fields[:8])
+        if self._last_times:
+            d_total = total - self._last_times[1]
+            if d_total > 0:
+                busy = 1 - (idle - self._last_times[0]) / d_total
+                self.busy_cores = busy * (os.cpu_count() or len(self.cpus))
+        self._last_times = (idle, total)
+        return self.busy_cores
+
+    def headroom(self):
+        """Cores still free for new outputs"""
+        free = len(self.cpus) - self.reserve_cores - self.committed()
+        if self.busy_cores is not None:
+            free = min(free, len(self.cpus) - self.reserve_cores - self.busy_cores)
+        return free
+
+    def estimate(self, video_args, width=1920, height=1080, fps=30):
+        if arg_value(video_args, '-c:v') == 'copy':
+            return COPY_CORES
+        preset = arg_value(video_args, '-preset') or 'medium'
+        return PRESET_CORES_1080P30.get(preset, PRESET_CORES_1080P30['medium']) * \
+            (width * height * fps) / PIXEL_RATE_1080P30
+
+    # Admission
+
+    def plan(self, name, video_args, width=1920, height=1080, fps=30):
+        """Admit an output, downgrading its x264 preset if needed; raises AdmissionError"""
+        self.release(name)
+        free = self.headroom()
+        if arg_value(video_args, '-c:v') == 'copy':
+            return self._admit(EncodePlan(name, None, 0, (), RELAY_NICE, COPY_CORES, list(video_args)))
+
+        requested = arg_value(video_args, '-preset') or 'medium'
+        candidates = X264_PRESETS[:X264_PRESETS.index(requested) + 1] if requested in X264_PRESETS else \
+            X264_PRESETS
+        for preset in reversed(candidates):
+            args = with_arg(video_args, '-preset', preset)
+            cost = self.estimate(args, width, height, fps)
+            if cost <= free:
+                break
+        else:
+            raise AdmissionError(f"{name} needs {cost:.1f} cores even at {preset}; "
+                                 f"only {max(free, 0):.1f} free")
+        if preset != requested:
+            logger.warning(f"{name}: {requested} doesn't fit in {free:.1f} free cores, using {preset}")
+
+        cores = self._pick_cores(math.ceil(cost))
+        args = with_arg(args, '-threads', str(len(cores)))
+        return self._admit(EncodePlan(name, preset, len(cores), cores, ENCODER_NICE, cost, args))
+
+    def reserve(self, name, cost):
+        """Admit work with a known cost that isn't an FFmpeg output (e.g. decoding and compositing), unpinned"""
+        self.release(name)
+        free = self.headroom()
+        if cost > free:
+            raise AdmissionError(f"{name} needs {cost:.1f} cores; only {max(free, 0):.1f} free")
+        return self._admit(EncodePlan(name, None, 0, (), 0, cost, []))
+
+    def _pick_cores(self, count):
+        # Least loaded cores first; keep the first core for the UI when there are spares
+        pool = self.cpus[1:] if len(self.cpus) > 2 else self.cpus
+        with self.lock:
+            ranked = sorted(pool, key=lambda cpu: self.core_load[cpu])
+        return tuple(sorted(ranked[:max(1, min(count, len(pool)))]))
+
+    def _admit(self, plan):
+        with self.lock:
+            self.plans[plan.name] = plan
+            for cpu in plan.cores:
+                self.core_load[cpu] += plan.cost / len(plan.cores)
+        return plan
+
+    def release(self, name):
+        with self.lock:
+            plan = self.plans.pop(name, None)
+            if plan:
+                for cpu in plan.cores:
+                    self.core_load[cpu] -= plan.cost / len(plan.cores)
+
+    def apply(self, plan, pid):
+        """Pin a spawned process (all its threads so far) to its cores and set its nice level"""
+        tids = [pid]
+        try:
+            tids = [int(tid) for tid in os.listdir(f'/proc/{pid}/task')]
+        except OSError:
+            pass
+        for tid in tids:
+            try:
+                if plan.cores and hasattr(os, 'sched_setaffinity'):
+                    os.sched_setaffinity(tid, plan.cores)
+                if hasattr(os, 'setpriority'):
+                    os.setpriority(os.PRIO_PROCESS, tid, plan.nice)
+            except OSError as e:
+                logger.debug(f"Could not apply {plan.name} limits to {tid}: {e}")
+
+    def stats(self):
+        return {
+            "cpus": len(self.cpus),
+            "busy_cores": self.busy_cores,
+            "committed_cores": self.committed(),
+            "headroom_cores": self.headroom(),
+            "outputs": len(self.plans)
+        }
+
+
+if __name__ == "__main__":
+    # Admit 1080p30 veryfast outputs until the box is full, as on 1-, 2-, 4- and 8-core machines
+    for cpus in (1, 2, 4, 8):
+        governor = ResourceGovernor()
+        governor.cpus = list(range(cpus))
+        governor.core_load = {cpu: 0.0 for cpu in governor.cpus}
+        governor.reserve_cores = default_reserve(cpus)
+        print(f"{cpus} cores, {governor.reserve_cores:.1f} reserved")
+        for n in range(1, 6):
+            try:
+                plan = governor.plan(f"output {n}", ['-c:v', 'libx264', '-preset', 'veryfast'])
+            except AdmissionError as e:
+                print(f"  refused: {e}")
+                break
+            print(f"  output {n}: {plan.preset}, {plan.cost:.1f} cores on {list(plan.cores)}, "
+                  f"headroom now {governor.headroom():.1f}")
+        relay = governor.plan("relay", ['-c:v', 'copy'])
+        print(f"  relay: {relay.cost:.2f} cores, headroom now {governor.headroom():.1f}")
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import logging
+import mimetypes
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Rendition = namedtuple('Rendition', 'name height video_kbps audio_kbps')
+
+# Video rungs first; an entry without a height is audio-only
+LADDER = [
+    Rendition('1080p', 1080, 5000, 128),
+    Rendition('720p', 720, 2800, 128),
+    Rendition('480p', 480, 1200, 96),
+    Rendition('audio', None, 0, 64)
+]
+
+SEGMENT_S = 2
+PLAYLIST_TYPES = ('.m3u8',)
+CONTENT_TYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.m4s': 'video/iso.segment', '.mp4': 'video/mp4',
+                 '.ts': 'video/mp2t'}
+
+PLAYER_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Live</title>
+<script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+<style>body{margin:0;background:#000}video{width:100vw;height:100vh}</style></head>
+<body><video id="v" controls autoplay muted playsinline></video><script>
+const v = document.getElementById("v");
+if (v.canPlayType("application/vnd.apple.mpegurl")) { v.src = "master.m3u8"; }
+else { const h = new Hls({lowLatencyMode: false}); h.loadSource("master.m3u8"); h.attachMedia(v); }
+</script></body></html>"""
+
+
+def ladder_output_args(directory, renditions=LADDER, fps=30, preset='veryfast', segment_s=SEGMENT_S):
+    """FFmpeg output arguments for an HLS (fMP4/CMAF) ladder from one decode.
+
+    The decoded input goes through a single split/scale filter graph and
+    every rung is encoded in the same process. Keyframes are forced every
+    segment_s on all rungs alike, so players can switch at any segment.
+    """
+    video = [r for r in renditions if r.height]
+    audio = renditions
+    gop = str(int(fps * segment_s))
+    args = []
+    if video:
+        graph = f"[0:v]split={len(video)}" + "".join(f"[s{i}]" for i in range(len(video)))
+        graph += "".join(f";[s{i}]scale=-2:{r.height}[v{i}]" for i, r in enumerate(video))
+        args += ['-filter_complex', graph]
+    for i, r in enumerate(video):
+        args += ['-map', f'[v{i}]', f'-c:v:{i}', 'libx264', f'-b:v:{i}', f'{r.video_kbps}k',
+                 f'-maxrate:v:{i}', f'{int(r.video_kbps * 1.1)}k', f'-bufsize:v:{i}', f'{r.video_kbps * 2}k']
+    if video:
+        args += ['-preset', preset, '-g', gop, '-keyint_min', gop, '-sc_threshold', '0']
+    for j, r in enumerate(audio):
+        args += ['-map', '0:a:0', f'-c:a:{j}', 'aac', f'-b:a:{j}', f'{r.audio_kbps}k']
+    stream_map = []
+    for j, r in enumerate(audio):
+        stream_map.append(f"v:{j},a:{j},name:{r.name}" if r.height else f"a:{j},name:{r.name}")
+    args += [
+        '-f', 'hls', '-hls_time', str(segment_s), '-hls_list_size', '6',
+        '-hls_flags', 'delete_segments+independent_segments', '-hls_segment_type', 'fmp4',
+        '-master_pl_name', 'master.m3u8', '-var_stream_map', " ".join(stream_map),
+        '-hls_segment_filename', os.path.join(directory, '%v', 'seg_%05d.m4s'),
+        os.path.join(directory, '%v', 'index.m3u8')
+    ]
+    return args
+
+
+def ladder_pixel_rate(renditions=LADDER, width=1920, height=1080, fps=30):
+    """Pixels per second encoded across all video rungs (for the resource governor)"""
+    return sum(round(width * r.height / height) * r.height for r in renditions if r.height) * fps
+
+
+def local_address():
+    """This machine's address on the LAN (what viewers on the ground's Wi-Fi connect to)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            # No packet is sent; this only picks the outgoing interface
+            s.connect(("10.255.255.255", 1))
+            return s.getsockname()[0]
+        except OSError:
+            return "127.0.0.1"
+
+
+def prepare_directory(directory, renditions=LADDER):
+    """Empty the output directory so players never see a previous run's segments"""
+    shutil.rmtree(directory, ignore_errors=True)
+    for r in renditions:
+        os.makedirs(os.path.join(directory, r.name), exist_ok=True)
+
+
+class SegmentCache:
+    """Serves files from the HLS output directory out of memory.
+
+    Entries are keyed by path, size and mtime, so a playlist that FFmpeg
+    rewrote or a segment name reused after a restart is read afresh, while
+    every other request costs one stat(). Concurrent misses for the same
+    new segment share a single read. Least recently used entries go once
+    max_bytes is exceeded.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = os.path.realpath(directory)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # path -> (size, mtime_ns, data)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._reading = {}
+
+    def resolve(self, url_path):
+        path = os.path.realpath(os.path.join(self.directory, url_path.lstrip('/')))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        return path
+
+    async def get(self, path):
+        """File contents, or None if it doesn't exist"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[2]
+        key = (path, st.st_size, st.st_mtime_ns)
+        pending = self._reading.get(key)
+        if pending is None:
+            self.misses += 1
+            pending = asyncio.get_running_loop().run_in_executor(None, self._read, path)
+            self._reading[key] = pending
+            try:
+                data = await pending
+            finally:
+                del self._reading[key]
+            if data is not None:
+                self._store(path, st, data)
+            return data
+        return await pending
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, path, st, data):
+        old = self.entries.pop(path, None)
+        if old:
+            self.bytes -= len(old[2])
+        self.entries[path] = (st.st_size, st.st_mtime_ns, data)
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes and self.entries:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+
+class HlsOrigin:
+    """Local HTTP origin for the HLS ladder, for viewers on the ground's network.
+
+    Serves the output directory from a SegmentCache with keep-alive
+    connections, so a room full of phones costs disk reads once per
+    segment and nothing on the uplink. Runs on its own asyncio loop like
+    the score server; / is a small hls.js player page.
+    """
+
+    def __init__(self, directory, host="0.0.0.0", port=8080, max_cache_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.cache = SegmentCache(directory, max_cache_bytes)
+        self.requests = 0
+        self.bytes_served = 0
+        self.writers = set()
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    def start_in_thread(self):
+        threading.Thread(target=self.run, name="hls-origin", daemon=True).start()
+        self._ready.wait(5)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error(f"HLS origin could not listen on {self.host}:{self.port}: {e}")
+            self.loop = None
+            self._ready.set()
+            return
+        logger.info(f"HLS origin serving {self.directory} on http://{self.host}:{self.port}/")
+        self._ready.set()
+        self._stopped = asyncio.Event()
+        async with self._server:
+            await self._stopped.wait()
+            # Let idle keep-alive connections see their close before the loop goes away
+            await asyncio.sleep(0.1)
+
+    def stop(self):
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._server.close()
+        for writer in list(self.writers):
+            writer.close()
+        self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                text = request.decode(errors="replace")
+                parts = text.split("\r\n", 1)[0].split(" ")
+                method = parts[0]
+                path = parts[1].split("?")[0] if len(parts) > 1 else "/"
+                keep_alive = "connection: close" not in text.lower()
+                await self._serve_path(writer, method, path, keep_alive)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _serve_path(self, writer, method, path, keep_alive):
+        self.requests += 1
+        if path == "/":
+            return await self._respond(writer, "200 OK", "text/html; charset=utf-8", PLAYER_PAGE.encode(),
+                                       keep_alive, method)
+        file_path = self.cache.resolve(path)
+        data = await self.cache.get(file_path) if file_path else None
+        if data is None:
+            return await self._respond(writer, "404 Not Found", "text/plain", b"not found", keep_alive, method)
+        ext = os.path.splitext(path)[1]
+        content_type = CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        # Playlists change every segment; segments never do
+        cache_control = "no-cache" if ext in PLAYLIST_TYPES else "max-age=60"
+        await self._respond(writer, "200 OK", content_type, data, keep_alive, method, cache_control)
+
+    async def _respond(self, writer, status, content_type, data, keep_alive, method="GET", cache_control="no-cache"):
+        header = (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                  f"Cache-Control: {cache_control}\r\nAccess-Control-Allow-Origin: *\r\n"
+                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode()
+        if method == "HEAD":
+            writer.write(header)
+        else:
+            self.bytes_served += len(data)
+            writer.writelines((header, data))
+        await writer.drain()
+
+    def stats(self):
+        cache = self.cache
+        lookups = cache.hits + cache.misses
+        return {
+            "requests": self.requests,
+            "connections": len(self.writers),
+            "bytes_served": self.bytes_served,
+            "cached_bytes": cache.bytes,
+            "hit_rate": cache.hits / lookups if lookups else 0.0
+        }
+
+
+if __name__ == "__main__":
+    # Standalone: encode a source into the ladder and serve it
+    parser = argparse.ArgumentParser(description="Encode a source into a local HLS ladder and serve it")
+    parser.add_argument("source", help="input URL or file")
+    parser.add_argument("--dir", default="hls")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    prepare_directory(args.dir)
+    origin = HlsOrigin(args.dir, port=args.port)
+    origin.start_in_thread()
+    process = subprocess.Popen(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-re', '-i', args.source,
+                                *ladder_output_args(args.dir)])
+    try:
+        while process.poll() is None:
+            time.sleep(5)
+            stats = origin.stats()
+            print(f"{stats['requests']} requests, {stats['connections']} connections, "
+                  f"{stats['bytes_served'] / 1e6:.0f} MB served, cache {stats['cached_bytes'] / 1e6:.0f} MB, "
+                  f"hit rate {stats['hit_rate']:.0%}")
+    except KeyboardInterrupt:
+        process.terminate()
+    origin.stop()
@@ -0,0 +1,283 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from match_engine import Event, MatchEngine, BALL, NEW_BOWLER, NO_EXTRA
+
+logger = logging.getLogger(__name__)
+
+# Record types
+RECORD_EVENT, RECORD_UNDO, RECORD_REDO = 1, 2, 3
+
+# length, crc32 of the body; body is seq, type, kind, runs, extra, wicket, name
+_HEADER = struct.Struct('<HI')
+_BODY = struct.Struct('<IBBhBB')
+
+JOURNAL_FILE = "journal.bin"
+
+
+def encode_record(seq, record_type, event=None):
+    if event is None:
+        body = _BODY.pack(seq, record_type, 0, 0, 0, 0)
+    else:
+        body = _BODY.pack(seq, record_type, event.kind, event.runs, event.extra, event.wicket) + \
+            event.name.encode()
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_records(data):
+    """Yield (seq, type, event, end_offset) from journal bytes, stopping at a torn or corrupt tail"""
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        body = data[offset + _HEADER.size:offset + _HEADER.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+        seq, record_type, kind, runs, extra, wicket = _BODY.unpack_from(body)
+        event = None
+        if record_type == RECORD_EVENT:
+            event = Event(kind, runs, extra, bool(wicket), body[_BODY.size:].decode())
+        offset += _HEADER.size + length
+        yield seq, record_type, event, offset
+
+
+def compacted_records(seq, events, redo):
+    """Records that rebuild a match with this log and redo stack, all stamped seq"""
+    # Redoable events are recorded and then undone, most recently undone last
+    records = [encode_record(seq, RECORD_EVENT, event) for event in (*events, *reversed(redo))]
+    records += [encode_record(seq, RECORD_UNDO)] * len(redo)
+    return b"".join(records)
+
+
+def fsync_directory(path):
+    """Make a rename in path durable (a no-op where directories can't be opened, e.g. Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def load_engine(path, factory):
+    """Read-only recovery of a journal directory.
+
+    Returns (engine, last_seq, replayed_records, good_length, total_length);
+    good_length is where the last intact journal record ends.
+    """
+    engine = factory()
+    try:
+        with open(os.path.join(path, JOURNAL_FILE), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    last_seq, replayed, good_length = 0, 0, 0
+    for seq, record_type, event, good_length in read_records(data):
+        if record_type == RECORD_EVENT:
+            engine.record(event)
+        elif record_type == RECORD_UNDO:
+            engine.undo()
+        elif record_type == RECORD_REDO:
+            engine.redo()
+        last_seq = seq
+        replayed += 1
+    return engine, last_seq, replayed, good_length, len(data)
+
+
+class MatchJournal:
+    """Crash-safe append-only journal of scoring actions.
+
+    Records are appended to journal.bin without waiting for the disk; a
+    committer thread gathers whatever arrived within commit_window_ms and
+    covers the whole burst with one fsync. Every snapshot_every records
+    the journal is compacted: the match so far (its event log and redo
+    stack, with the undone branches dropped) plus the newer tail are
+    written to journal.bin.tmp, fsynced and renamed over journal.bin, so
+    a crash at any point leaves one complete journal and recovery replays
+    only what still counts. The Tk thread only copies two lists for it.
+    """
+
+    def __init__(self, path, commit_window_ms=5, snapshot_every=200):
+        self.path = path
+        self.commit_window = commit_window_ms / 1000
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.since_snapshot = 0
+        self.fsyncs = 0
+        self._file = None
+        self._cond = threading.Condition()
+        self._dirty = False
+        self._durable_seq = 0
+        self._pending_snapshot = None
+        self._running = False
+        self._thread = None
+        os.makedirs(path, exist_ok=True)
+
+    def _journal_path(self):
+        return os.path.join(self.path, JOURNAL_FILE)
+
+    def recover(self, factory):
+        """Rebuild the engine from the journal; factory() makes a fresh one"""
+        start = time.perf_counter()
+        try:
+            # Left by a crash mid-compaction; journal.bin is still whole
+            os.remove(self._journal_path() + ".tmp")
+        except FileNotFoundError:
+            pass
+        engine, self.seq, replayed, good_length, total_length = load_engine(self.path, factory)
+        self.since_snapshot = replayed
+
+        # Drop a torn tail so new records follow the last good one
+        self._file = open(self._journal_path(), 'ab')
+        if good_length < total_length:
+            logger.warning(f"Discarding {total_length - good_length} bytes of torn journal tail")
+            self._file.truncate(good_length)
+        self._durable_seq = self.seq
+        self._start_committer()
+        logger.info(f"Recovered match at seq {self.seq} ({replayed} journal records) "
+                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return engine
+
+    def _start_committer(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._commit_loop, name="journal-commit", daemon=True)
+        self._thread.start()
+
+    def _append(self, record_type, event=None):
+        with self._cond:
+            self.seq += 1
+            self._file.write(encode_record(self.seq, record_type, event))
+            self.since_snapshot += 1
+            self._dirty = True
+            self._cond.notify_all()
+            return self.seq
+
+    def record(self, event):
+        return self._append(RECORD_EVENT, event)
+
+    def undo(self):
+        return self._append(RECORD_UNDO)
+
+    def redo(self):
+        return self._append(RECORD_REDO)
+
+    def maybe_snapshot(self, engine):
+        """Queue a compaction once enough records have piled up"""
+        if self.since_snapshot < self.snapshot_every:
+            return False
+        with self._cond:
+            self._pending_snapshot = (self.seq, *engine.history())
+            self.since_snapshot = 0
+            self._cond.notify_all()
+        return True
+
+    def wait_durable(self, seq, timeout=None):
+        """Block until seq has been fsynced"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._durable_seq >= seq, timeout)
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._dirty or self._pending_snapshot or not self._running)
+                if not self._running and not self._dirty and not self._pending_snapshot:
+                    return
+            # Let the rest of a burst of taps land before paying for the fsync
+            time.sleep(self.commit_window)
+            with self._cond:
+                self._file.flush()
+                seq = self.seq
+                self._dirty = False
+                snapshot, self._pending_snapshot = self._pending_snapshot, None
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+            with self._cond:
+                self._durable_seq = seq
+                self._cond.notify_all()
+            if snapshot:
+                self._compact(*snapshot)
+
+    def _compact(self, seq, events, redo):
+        # On the committer thread, right after an fsync, so nothing else becomes durable meanwhile
+        start = time.perf_counter()
+        path = self._journal_path()
+        tmp = path + ".tmp"
+        with open(path, 'rb') as f:
+            data = f.read()
+        tail_start = good_length = 0
+        for record_seq, _, _, end in read_records(data):
+            if record_seq <= seq:
+                tail_start = end
+            good_length = end
+        with open(tmp, 'wb') as f:
+            f.write(compacted_records(seq, events, redo))
+            f.write(data[tail_start:good_length])
+            f.flush()
+            os.fsync(f.fileno())
+        with self._cond:
+            # Appends since the read aren't durable yet; they follow in the new file and its next fsync
+            self._file.flush()
+            with open(path, 'rb') as f:
+                f.seek(good_length)
+                newer = f.read()
+            if newer:
+                with open(tmp, 'ab') as f:
+                    f.write(newer)
+                self._dirty = True
+                self._cond.notify_all()
+            os.replace(tmp, path)
+            self._file.close()
+            self._file = open(path, 'ab')
+        fsync_directory(self.path)
+        logger.info(f"Journal compacted at seq {seq} to {len(events) + 2 * len(redo)} records "
+                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._file:
+            self._file.close()
+
+
+if __name__ == "__main__":
+    # Journal write latency per event and recovery time for a full day's scoring
+    import shutil
+    import tempfile
+
+    path = tempfile.mkdtemp()
+    journal = MatchJournal(path)
+    engine = journal.recover(MatchEngine)
+    latencies = []
+    for i in range(2000):
+        event = Event(NEW_BOWLER, 0, NO_EXTRA, False, f"Bowler {i % 5}") if i % 7 == 0 else \
+            Event(BALL, i % 5, NO_EXTRA, False, "")
+        start = time.perf_counter()
+        engine.record(event)
+        seq = journal.record(event)
+        journal.maybe_snapshot(engine)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        if i % 50 == 0:
+            journal.wait_durable(seq)
+    journal.wait_durable(journal.seq)
+    journal.close()
+    latencies.sort()
+    print(f"append p50 {latencies[len(latencies) // 2]:.1f} us, p99 {latencies[int(len(latencies) * 0.99)]:.1f} us, "
+          f"{journal.fsyncs} fsyncs for {len(latencies)} events")
+
+    start = time.perf_counter()
+    recovered = MatchJournal(path)
+    engine2 = recovered.recover(MatchEngine)
+    print(f"recovered {len(engine2.log)} events in {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"score {engine2.batting.runs}/{engine2.batting.wickets} (expected {engine.batting.runs})")
+    recovered.close()
+    shutil.rmtree(path)
@@ -0,0 +1,461 @@
+import logging
+import queue
+import socket
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from compositor import FRAME_WIDTH, FRAME_HEIGHT
+from events import DelayTracker
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+# What stamp decoders scale to before sampling: small, so decoding stays cheap
+READ_WIDTH, READ_HEIGHT = 480, 270
+
+CAMERA_BITS = 3
+FRAME_BITS = 20
+SEQ_BITS = 20
+VERSION_BITS = 8
+
+STAGES = ("capture", "decode", "composite", "encode", "mux", "send")
+OVERLAY_STAGES = ("render", "to_frame", "to_sink")
+
+
+class Barcode:
+    """A row of square cells along the bottom edge of a frame that carries a few numbers.
+
+    A white sync cell, each field's bits LSB first, then a black end cell,
+    so a frame without the barcode (or with it half covered) reads as None.
+    bits lists the field widths. The cells are big enough to survive
+    encoding and a downscale to READ_WIDTH x READ_HEIGHT, which is what
+    read() samples; read_frame() samples a full-size BGR frame.
+    """
+
+    def __init__(self, bits, right=False, cell=None, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        self.bits = tuple(bits)
+        self.cells = 2 + sum(self.bits)
+        self.cell = cell or max(8, height // 45)
+        self.width, self.height = width, height
+        self.x = width - self.cells * self.cell if right else 0
+        self.y = height - self.cell
+
+    def _bits(self, values):
+        bits = [True]
+        for value, width in zip(values, self.bits):
+            bits += [bool(value >> b & 1) for b in range(width)]
+        return bits + [False]
+
+    def _decode(self, bit):
+        if not bit(0) or bit(self.cells - 1):
+            return None
+        values, index = [], 1
+        for width in self.bits:
+            values.append(sum(1 << b for b in range(width) if bit(index + b)))
+            index += width
+        return tuple(values)
+
+    def stamp(self, frame, values):
+        """Burn values into a HxWx3 uint8 frame, in place"""
+        cell, y = self.cell, self.y
+        strip = frame[y:y + cell, self.x:self.x + self.cells * cell]
+        strip[:] = 0
+        for index, on in enumerate(self._bits(values)):
+            if on:
+                strip[:, index * cell:(index + 1) * cell] = 255
+
+    def drawbox_filter(self, values):
+        """FFmpeg filter chain drawing the barcode; a value of None is the frame number"""
+        cell, y = self.cell, self.y
+        boxes = [f"drawbox=x={self.x}:y={y}:w={self.cells * cell}:h={cell}:color=black:t=fill",
+                 f"drawbox=x={self.x}:y={y}:w={cell}:h={cell}:color=white:t=fill"]
+        index = 1
+        for value, width in zip(values, self.bits):
+            for b in range(width):
+                box = f"drawbox=x={self.x + (index + b) * cell}:y={y}:w={cell}:h={cell}:color=white:t=fill"
+                if value is None:
+                    boxes.append(f"{box}:enable='eq(mod(floor(n/{2 ** b}),2),1)'")
+                elif value >> b & 1:
+                    boxes.append(box)
+            index += width
+        return ",".join(boxes)
+
+    def read(self, gray, width=READ_WIDTH, height=READ_HEIGHT):
+        """The values from a gray frame (bytes, row-major) scaled to width x height, or None"""
+        scale_x, scale_y = width / self.width, height / self.height
+        row = int((self.y + self.cell / 2) * scale_y) * width
+        return self._decode(lambda i: gray[row + int((self.x + (i + 0.5) * self.cell) * scale_x)] >= 128)
+
+    def read_frame(self, frame):
+        """The values from a full-size HxWx3 frame, or None"""
+        row = frame[self.y + self.cell // 2]
+        return self._decode(lambda i: row[self.x + int((i + 0.5) * self.cell), 1] >= 128)
+
+
+# Test cameras: camera index and frame number, bottom left. The program: frame sequence and overlay version,
+# bottom right, so a test camera's stamp survives into the program alongside it
+CAMERA_BARCODE = Barcode((CAMERA_BITS, FRAME_BITS))
+PROGRAM_STAMP = Barcode((SEQ_BITS, VERSION_BITS), right=True)
+
+
+class BarcodeReader:
+    """Decodes a stream and logs when each barcoded frame first appears.
+
+    Either pulls source (a URL) itself or decodes what is fed to feed() in
+    input_format. frames maps each code read (a tuple, see Barcode.read)
+    to its perf_counter arrival, and on_frame(code, t) is called on first
+    arrival. With max_frames only the latest are kept. The decoder runs
+    with minimal buffering so it adds as little as it can; whatever it does
+    add is the same at every point it's used.
+    """
+
+    def __init__(self, read, input_format=None, source=None, on_frame=None, max_frames=None):
+        self.read = read
+        self.input_format = input_format
+        self.source = source
+        self.on_frame = on_frame
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.decoded = 0
+        self.unreadable = 0
+        self.process = None
+        self.lock = threading.Lock()
+
+    def command(self):
+        source = ['-i', self.source] if self.source else ['-f', self.input_format, '-i', 'pipe:0']
+        return [*FFMPEG, '-fflags', 'nobuffer', '-flags', 'low_delay', '-probesize', '65536', '-analyzeduration', '0',
+                *source, '-map', '0:v:0',
+                '-vf', f'scale={READ_WIDTH}:{READ_HEIGHT}', '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+
+    def start(self):
+        stdin = subprocess.DEVNULL if self.source else subprocess.PIPE
+        self.process = subprocess.Popen(self.command(), stdin=stdin, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._read, name="barcode-reader", daemon=True).start()
+        return self
+
+    def feed(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+
+    def _read(self):
+        size = READ_WIDTH * READ_HEIGHT
+        stdout = self.process.stdout
+        while True:
+            frame = stdout.read(size)
+            if len(frame) < size:
+                return
+            now = time.perf_counter()
+            code = self.read(frame)
+            with self.lock:
+                self.decoded += 1
+                if code is None:
+                    self.unreadable += 1
+                    continue
+                if code in self.frames:
+                    continue
+                self.frames[code] = now
+                if self.max_frames and len(self.frames) > self.max_frames:
+                    self.frames.popitem(last=False)
+            if self.on_frame:
+                self.on_frame(code, now)
+
+    def close(self):
+        if self.process:
+            if self.process.stdin:
+                try:
+                    self.process.stdin.close()
+                except (BrokenPipeError, OSError):
+                    pass
+            self.process.terminate()
+
+
+class FlvSink:
+    """Local stand-in for a platform's RTMP ingest: accepts FLV over TCP and decodes it.
+
+    Outputs push to url (tcp://127.0.0.1:port, what an RTMP server reads
+    after its handshake). Each connection (a publisher reconnecting makes
+    a new one) gets its own BarcodeReader using read; frames merges them,
+    keeping each frame's first arrival.
+    """
+
+    def __init__(self, name, port, read, on_frame=None, max_frames=None):
+        self.name = name
+        self.port = port
+        self.read = read
+        self.on_frame = on_frame
+        self.max_frames = max_frames
+        self.url = f"tcp://127.0.0.1:{port}"
+        self.bytes = 0
+        self.connections = 0
+        self.readers = []
+        self.running = False
+        self.server = None
+
+    def start(self):
+        self.server = socket.create_server(("127.0.0.1", self.port))
+        self.server.settimeout(0.2)
+        self.running = True
+        self.started = time.perf_counter()
+        threading.Thread(target=self._accept, name=f"sink-{self.name}", daemon=True).start()
+        return self
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.connections += 1
+            reader = BarcodeReader(self.read, 'flv', on_frame=self.on_frame, max_frames=self.max_frames).start()
+            self.readers.append(reader)
+            threading.Thread(target=self._serve, args=(conn, reader), daemon=True).start()
+
+    def _serve(self, conn, reader):
+        conn.settimeout(0.5)
+        with conn:
+            while self.running:
+                try:
+                    data = conn.recv(65536)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                self.bytes += len(data)
+                reader.feed(data)
+        reader.close()
+
+    @property
+    def frames(self):
+        merged = {}
+        for reader in self.readers:
+            with reader.lock:
+                for code, t in reader.frames.items():
+                    if code not in merged or t < merged[code]:
+                        merged[code] = t
+        return merged
+
+    def kbps(self):
+        elapsed = time.perf_counter() - self.started
+        return self.bytes * 8 / 1000 / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        self.running = False
+        if self.server:
+            self.server.close()
+        for reader in self.readers:
+            reader.close()
+
+
+class LatencyProbe:
+    """Glass-to-glass instrumentation: stamps every program frame and traces it to a local sink.
+
+    The compositing pipeline calls frame() for each frame it sends, which
+    burns PROGRAM_STAMP (a sequence number and the overlay version) into
+    the frame. tap() goes on the shared encoder's taps to see each stamp
+    leave the encoder, and verifier is an FlvSink to add as a fan-out
+    destination, where each stamp's arrival completes its timeline.
+    watch_source() also decodes the program camera directly; if it burns
+    in CAMERA_BARCODE (like the benchmark cameras), frames are traced back
+    to it, and with source_clock(camera, frame) to when it was taken.
+
+    Stages of each frame, in ms:
+      capture    the camera's clock to the direct decode of its feed
+      decode     direct decode to the program decoder's output (-re pacing, scaling)
+      composite  program decoder output to stamped (waiting for the pipeline, overlay blend)
+      encode     stamped to out of the shared encoder (pipe, lookahead, rate control)
+      mux        out of the encoder to the verifier (spool, relay remux, loopback)
+      send       the worst uplink's send queue, from send_backlog_s()
+    Points after the pipeline are taken by low-delay decoders, so encode
+    and capture include one such decode and the others cancel it out.
+    Overlay changes are timed from the score event to the overlay being
+    set (render), the first frame carrying it (to_frame), and that frame
+    reaching the verifier (to_sink).
+    """
+
+    VERIFIER = "Latency verifier"
+
+    def __init__(self, compositor, port=19350, source_clock=None, send_backlog_s=None, window=3000):
+        self.compositor = compositor
+        self.source_clock = source_clock
+        self.send_backlog_s = send_backlog_s
+        self.window = window
+        self.seq = 0
+        self.frames = OrderedDict()  # seq -> {point: perf_counter time}
+        self.overlays = OrderedDict()  # overlay version -> {point: perf_counter time}
+        self.lock = threading.Lock()
+        self.stages = {stage: DelayTracker() for stage in (*STAGES, "total")}
+        self.overlay_stages = {stage: DelayTracker() for stage in (*OVERLAY_STAGES, "total")}
+        self.encoded = BarcodeReader(PROGRAM_STAMP.read, 'mpegts', on_frame=self._encoded, max_frames=window)
+        self.verifier = FlvSink(self.VERIFIER, port, PROGRAM_STAMP.read, on_frame=self._delivered,
+                                max_frames=window)
+        self.source = None
+        self._chunks = queue.Queue(maxsize=256)
+        self.dropped_chunks = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.encoded.start()
+        self.verifier.start()
+        threading.Thread(target=self._feed_encoded, name="latency-tap", daemon=True).start()
+        return self
+
+    def watch_source(self, url):
+        """Decode the program camera directly, for the capture and decode stages"""
+        if self.source is not None:
+            self.source.close()
+        self.source = BarcodeReader(CAMERA_BARCODE.read, source=url, max_frames=self.window).start()
+
+    def frame(self, frame, reader, fresh):
+        """Stamp an outgoing program frame (fresh=False for a repeat of the last one)"""
+        now = time.perf_counter()
+        source = CAMERA_BARCODE.read_frame(frame) if fresh else None
+        # Replays carry the overlay they were recorded with, not a version of the current one
+        version = 0 if reader.composited else self.compositor.frame_version % (1 << VERSION_BITS)
+        with self.lock:
+            self.seq = (self.seq + 1) % (1 << SEQ_BITS)
+            seq = self.seq
+            self.frames[seq] = {"source": source, "decoded": reader.read_frame_time if fresh else None,
+                                "composited": now}
+            while len(self.frames) > self.window:
+                self.frames.popitem(last=False)
+            overlay = self.overlays.setdefault(version, {})
+            overlay.setdefault("composited", now)
+            while len(self.overlays) > 64:
+                self.overlays.popitem(last=False)
+        PROGRAM_STAMP.stamp(frame, (seq, version))
+
+    def overlay_changed(self, event_time=None):
+        """The compositor was just given a new overlay, for a score event at event_time"""
+        now = time.perf_counter()
+        with self.lock:
+            overlay = self.overlays.setdefault(self.compositor.version % (1 << VERSION_BITS), {})
+            overlay.update({"event": event_time or now, "set": now})
+
+    def tap(self, chunk):
+        """Encoded program chunk from FanoutEncoder's taps; never blocks the distributor"""
+        try:
+            self._chunks.put_nowait(chunk)
+        except queue.Full:
+            self.dropped_chunks += 1
+
+    def _feed_encoded(self):
+        while self.running:
+            try:
+                chunk = self._chunks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.encoded.feed(chunk)
+
+    def _encoded(self, code, t):
+        with self.lock:
+            entry = self.frames.get(code[0])
+            if entry is not None:
+                entry["encoded"] = t
+
+    def _delivered(self, code, t):
+        seq, version = code
+        with self.lock:
+            entry = self.frames.get(seq)
+            overlay = self.overlays.get(version)
+            if overlay is not None and "delivered" not in overlay and "event" in overlay:
+                overlay["delivered"] = t
+            else:
+                overlay = None
+        if entry is not None:
+            self._record_frame(entry, t)
+        if overlay is not None:
+            self._record_overlay(overlay)
+
+    def _source_points(self, source):
+        if source is None or self.source is None:
+            return None, None
+        with self.source.lock:
+            arrived = self.source.frames.get(source)
+        captured = self.source_clock(*source) if self.source_clock and arrived is not None else None
+        return captured, arrived
+
+    def _record_frame(self, entry, delivered):
+        captured, arrived = self._source_points(entry["source"])
+        decoded, composited, encoded = entry["decoded"], entry["composited"], entry.get("encoded")
+        points = [("capture", captured, arrived), ("decode", arrived, decoded), ("composite", decoded, composited),
+                  ("encode", composited, encoded), ("mux", encoded, delivered)]
+        for stage, start, end in points:
+            if start is not None and end is not None:
+                self.stages[stage].record((end - start) * 1000)
+        send_ms = self.send_backlog_s() * 1000 if self.send_backlog_s else 0.0
+        self.stages["send"].record(send_ms)
+        first = next(t for t in (captured, arrived, decoded, composited) if t is not None)
+        self.stages["total"].record((delivered - first) * 1000 + send_ms)
+
+    def _record_overlay(self, overlay):
+        points = [("render", "event", "set"), ("to_frame", "set", "composited"),
+                  ("to_sink", "composited", "delivered"), ("total", "event", "delivered")]
+        for stage, start, end in points:
+            if start in overlay and end in overlay:
+                # A frame can pick the overlay up before set is noted
+                self.overlay_stages[stage].record(max(0.0, overlay[end] - overlay[start]) * 1000)
+
+    def report(self):
+        """Percentiles per stage (DelayTracker summaries) and how many frames got through"""
+        source = self.source
+        if source is not None and not source.frames and source.unreadable > 150:
+            # A real camera: nothing to trace capture and decode by
+            logger.info("Program source carries no camera barcode; capture and decode stages need a stamped source")
+            self.source = None
+            source.close()
+        return {
+            "stages_ms": {stage: tracker.summary() for stage, tracker in self.stages.items()},
+            "overlay_ms": {stage: tracker.summary() for stage, tracker in self.overlay_stages.items()},
+            "stamped_frames": self.seq,
+            "verified_frames": len(self.verifier.frames),
+            "unreadable_at_sink": sum(reader.unreadable for reader in self.verifier.readers),
+            "dropped_tap_chunks": self.dropped_chunks
+        }
+
+    def text(self):
+        """One status line: where the glass-to-glass p50 goes, and score-to-stream"""
+        report = self.report()
+        stages = report["stages_ms"]
+        if not stages["total"]["count"]:
+            return f"Latency probe: waiting for stamped frames at the verifier ({report['stamped_frames']} sent)"
+        parts = ", ".join(f"{stage} {stages[stage]['p50_ms']:.0f}" for stage in STAGES if stages[stage]["count"])
+        total = stages["total"]
+        text = f"Glass-to-glass p50 {total['p50_ms']:.0f} ms, p95 {total['p95_ms']:.0f} ms ({parts})"
+        overlay = report["overlay_ms"]["total"]
+        if overlay["count"]:
+            text += f"  |  score to stream p50 {overlay['p50_ms']:.0f} ms"
+        return text
+
+    def stop(self):
+        self.running = False
+        self.encoded.close()
+        self.verifier.stop()
+        if self.source is not None:
+            self.source.close()
+
+
+if __name__ == "__main__":
+    # Stamp a frame, shrink it the way the decoders do, and read it back; plus the stamping cost per frame
+    import numpy as np
+
+    frame = np.random.randint(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    CAMERA_BARCODE.stamp(frame, (5, 123456))
+    runs = 1000
+    start = time.perf_counter()
+    for seq in range(runs):
+        PROGRAM_STAMP.stamp(frame, (seq, 7))
+    stamp_ms = (time.perf_counter() - start) * 1000 / runs
+    gray = frame[::FRAME_HEIGHT // READ_HEIGHT, ::FRAME_WIDTH // READ_WIDTH, 1].tobytes()
+    print(f"camera {CAMERA_BARCODE.read(gray)}, program {PROGRAM_STAMP.read(gray)} "
+          f"(full size: {PROGRAM_STAMP.read_frame(frame)}); stamping {stamp_ms:.3f} ms per frame")
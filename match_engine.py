@@ -0,0 +1,321 @@
+import time
+from collections import namedtuple
+
+# Event kinds
+BALL, NEW_BOWLER, SWITCH_INNINGS = 0, 1, 2
+
+# Extra types, indexed the same way as Innings.extras
+NO_EXTRA, WIDE, NO_BALL, BYE, LEG_BYE = 0, 1, 2, 3, 4
+EXTRA_NAMES = {"wides": WIDE, "noballs": NO_BALL, "byes": BYE, "legbyes": LEG_BYE}
+
+BALLS_PER_OVER = 6
+# A wide or no-ball's extra runs start with this penalty, which the batters didn't run
+PENALTY_RUNS = 1
+
+# One immutable record per scoring action. runs are off the bat for a
+# normal ball and the extra runs for an extra; name is only used by
+# NEW_BOWLER (bowler) and wickets (dismissal text, filled in if empty).
+Event = namedtuple('Event', 'kind runs extra wicket name')
+
+
+def overs_str(balls):
+    return f"{balls // BALLS_PER_OVER}.{balls % BALLS_PER_OVER}"
+
+
+class Batter:
+    __slots__ = ('name', 'runs', 'balls', 'fours', 'sixes', 'out', 'dismissal')
+
+    def __init__(self, name):
+        self.name = name
+        self.runs = self.balls = self.fours = self.sixes = 0
+        self.out = False
+        self.dismissal = ""
+
+    def state(self):
+        return (self.runs, self.balls, self.fours, self.sixes, self.out, self.dismissal)
+
+    def restore(self, state):
+        self.runs, self.balls, self.fours, self.sixes, self.out, self.dismissal = state
+
+
+class Bowler:
+    __slots__ = ('name', 'balls', 'maidens', 'runs', 'wickets')
+
+    def __init__(self, name):
+        self.name = name
+        self.balls = self.maidens = self.runs = self.wickets = 0
+
+    def state(self):
+        return (self.balls, self.maidens, self.runs, self.wickets)
+
+    def restore(self, state):
+        self.balls, self.maidens, self.runs, self.wickets = state
+
+    def figures(self):
+        return f"{overs_str(self.balls)}-{self.maidens}-{self.runs}-{self.wickets}"
+
+
+class Innings:
+    """Running aggregates for one team's innings, updated per event"""
+
+    __slots__ = ('team', 'runs', 'wickets', 'balls', 'extras', 'batters', 'striker', 'non_striker',
+                 'bowlers', 'bowler', 'partnership_runs', 'partnership_balls', 'over_runs')
+
+    def __init__(self, team, batters=None, bowler="Bowler 1"):
+        names = list(batters or [])
+        names += [f"Batsman {i + 1}" for i in range(len(names), 2)]
+        self.team = team
+        self.runs = self.wickets = self.balls = 0
+        self.extras = [0, 0, 0, 0, 0]
+        self.batters = [Batter(names[0]), Batter(names[1])]
+        self.striker, self.non_striker = 0, 1
+        self.bowlers = {bowler: Bowler(bowler)}
+        self.bowler = bowler
+        self.partnership_runs = self.partnership_balls = 0
+        self.over_runs = 0  # charged to the bowlers in the current over, for maiden detection
+
+    def scalars(self):
+        return (self.runs, self.wickets, self.balls, tuple(self.extras), self.striker, self.non_striker,
+                self.partnership_runs, self.partnership_balls, len(self.batters), self.over_runs)
+
+    def restore_scalars(self, state):
+        (self.runs, self.wickets, self.balls, extras, self.striker, self.non_striker,
+         self.partnership_runs, self.partnership_balls, batter_count, self.over_runs) = state
+        self.extras[:] = extras
+        del self.batters[batter_count:]
+
+    def current_bowler(self):
+        return self.bowlers[self.bowler]
+
+    def extras_total(self):
+        return sum(self.extras)
+
+    def run_rate(self):
+        return self.runs * BALLS_PER_OVER / self.balls if self.balls else 0.0
+
+
+class MatchEngine:
+    """Headless, event-sourced scoring engine.
+
+    Every scoring action is an immutable Event appended to the log and
+    applied to incrementally maintained aggregates (totals, partnerships,
+    batter and bowler figures); balls are counted as integers. Applying an
+    event saves a fixed-size memento of what it touched, so undo and redo
+    are O(1). MatchEngine.replay() rebuilds a match from its event log.
+    Observers are called as observer(engine, event, memento, applied)
+    after each event is applied (applied=True, memento saying what the
+    engine looked like before it) or reverted; they aren't pickled with
+    the engine.
+    """
+
+    def __init__(self, team1="Team A", team2="Team B", max_overs=20, batters1=None, batters2=None,
+                 bowler1="Bowler 1", bowler2="Bowler 1"):
+        self.teams = (team1, team2)
+        self.max_overs = max_overs
+        self.innings = [Innings(team1, batters1, bowler1), Innings(team2, batters2, bowler2)]
+        self.current = 0
+        self.target = 0
+        self.log = []
+        self._undo = []
+        self._redo = []
+        self.observers = []
+
+    def __getstate__(self):
+        # Observers belong to this process (e.g. analytics), not to the match; snapshots leave them out
+        state = self.__dict__.copy()
+        state['observers'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('observers', [])
+
+    # Scoring actions
+
+    def add_runs(self, runs):
+        return self.record(Event(BALL, runs, NO_EXTRA, False, ""))
+
+    def add_wicket(self, dismissal=""):
+        return self.record(Event(BALL, 0, NO_EXTRA, True, dismissal))
+
+    def add_extra(self, extra_type, runs=1):
+        extra = EXTRA_NAMES.get(extra_type, extra_type)
+        return self.record(Event(BALL, runs, extra, False, ""))
+
+    def new_bowler(self, name):
+        return self.record(Event(NEW_BOWLER, 0, NO_EXTRA, False, name))
+
+    def switch_innings(self):
+        return self.record(Event(SWITCH_INNINGS, 0, NO_EXTRA, False, ""))
+
+    def record(self, event):
+        self._undo.append(self._apply(event))
+        self.log.append(event)
+        self._redo.clear()
+        return event
+
+    def undo(self):
+        if not self.log:
+            return None
+        event = self.log.pop()
+        self._revert(event, self._undo.pop())
+        self._redo.append(event)
+        return event
+
+    def redo(self):
+        if not self._redo:
+            return None
+        event = self._redo.pop()
+        self._undo.append(self._apply(event))
+        self.log.append(event)
+        return event
+
+    def history(self):
+        """Copies of the event log and the redo stack, which are all it takes to rebuild this state"""
+        return list(self.log), list(self._redo)
+
+    @classmethod
+    def replay(cls, events, **kwargs):
+        engine = cls(**kwargs)
+        apply = engine._apply
+        engine._undo = [apply(event) for event in events]
+        engine.log = list(events)
+        return engine
+
+    # Event application
+
+    def _apply(self, event):
+        memento = self._apply_event(event)
+        for observer in self.observers:
+            observer(self, event, memento, True)
+        return memento
+
+    def _apply_event(self, event):
+        if event.kind == BALL:
+            return self._apply_ball(event)
+        if event.kind == NEW_BOWLER:
+            innings = self.batting
+            created = event.name not in innings.bowlers
+            if created:
+                innings.bowlers[event.name] = Bowler(event.name)
+            previous = innings.bowler
+            innings.bowler = event.name
+            return (previous, created)
+        if event.kind == SWITCH_INNINGS:
+            previous = (self.current, self.target)
+            if self.current == 0:
+                self.target = self.innings[0].runs + 1
+                self.current = 1
+            else:
+                self.current = 0
+                self.target = 0
+            return previous
+        raise ValueError(f"Unknown event kind {event.kind}")
+
+    def _apply_ball(self, event):
+        innings = self.batting
+        bowler = innings.current_bowler()
+        striker = innings.batters[innings.striker]
+        memento = (innings.scalars(), innings.striker, striker.state(), bowler.name, bowler.state())
+
+        extra = event.extra
+        legal = extra not in (WIDE, NO_BALL)
+        if extra == NO_EXTRA:
+            striker.runs += event.runs
+            if event.runs == 4:
+                striker.fours += 1
+            elif event.runs == 6:
+                striker.sixes += 1
+        else:
+            innings.extras[extra] += event.runs
+        innings.runs += event.runs
+        innings.partnership_runs += event.runs
+        if extra in (NO_EXTRA, WIDE, NO_BALL):
+            # Byes and leg byes aren't charged to the bowler
+            bowler.runs += event.runs
+            innings.over_runs += event.runs
+        if extra != WIDE:
+            striker.balls += 1
+
+        if event.wicket:
+            innings.wickets += 1
+            bowler.wickets += 1
+            striker.out = True
+            striker.dismissal = event.name or f"b {bowler.name}"
+            innings.partnership_runs = innings.partnership_balls = 0
+            innings.batters.append(Batter(f"Batsman {len(innings.batters) + 1}"))
+            innings.striker = len(innings.batters) - 1
+        elif (event.runs - PENALTY_RUNS * (not legal)) % 2 == 1:
+            # Only runs actually run change ends, not a wide's or no-ball's penalty
+            innings.striker, innings.non_striker = innings.non_striker, innings.striker
+
+        if legal:
+            innings.balls += 1
+            innings.partnership_balls += 1
+            bowler.balls += 1
+            # The over ends on the innings' ball count, whoever bowled its earlier balls
+            if innings.balls % BALLS_PER_OVER == 0:
+                if innings.over_runs == 0:
+                    bowler.maidens += 1
+                innings.over_runs = 0
+                innings.striker, innings.non_striker = innings.non_striker, innings.striker
+        return memento
+
+    def _revert(self, event, memento):
+        if event.kind == BALL:
+            scalars, striker_index, striker_state, bowler_name, bowler_state = memento
+            innings = self.batting
+            innings.restore_scalars(scalars)
+            innings.batters[striker_index].restore(striker_state)
+            innings.bowlers[bowler_name].restore(bowler_state)
+        elif event.kind == NEW_BOWLER:
+            previous, created = memento
+            innings = self.batting
+            if created:
+                del innings.bowlers[event.name]
+            innings.bowler = previous
+        elif event.kind == SWITCH_INNINGS:
+            self.current, self.target = memento
+        for observer in self.observers:
+            observer(self, event, memento, False)
+
+    # Derived values, all O(1)
+
+    @property
+    def batting(self):
+        return self.innings[self.current]
+
+    def innings_complete(self):
+        innings = self.batting
+        if self.current == 1 and 0 < self.target <= innings.runs:
+            return True  # chase won
+        return innings.wickets >= 10 or innings.balls >= self.max_overs * BALLS_PER_OVER
+
+    def balls_left(self):
+        return max(0, self.max_overs * BALLS_PER_OVER - self.batting.balls)
+
+    def required(self):
+        """(runs needed, balls left, required rate), or None when not chasing"""
+        if self.current != 1 or self.target <= 0:
+            return None
+        remaining = self.target - self.batting.runs
+        balls_left = self.balls_left()
+        rate = remaining * BALLS_PER_OVER / balls_left if balls_left > 0 else 0.0
+        return remaining, balls_left, rate
+
+
+if __name__ == "__main__":
+    # Replay a full 50-over innings pair from its event log
+    pattern = [Event(BALL, r, NO_EXTRA, False, "") for r in (0, 1, 4, 0, 2, 6)]
+    events = []
+    for innings in range(2):
+        for over in range(50):
+            events.append(Event(NEW_BOWLER, 0, NO_EXTRA, False, f"Bowler {over % 5 + 1}"))
+            events += pattern
+            events.append(Event(BALL, 1, WIDE, False, ""))
+        events.append(Event(SWITCH_INNINGS, 0, NO_EXTRA, False, ""))
+    start = time.perf_counter()
+    engine = MatchEngine.replay(events, max_overs=50)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Replayed {len(events)} events in {elapsed:.2f} ms "
+          f"({engine.innings[0].runs}/{engine.innings[0].wickets} vs {engine.innings[1].runs})")
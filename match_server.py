@@ -0,0 +1,600 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+from analytics import MatchAnalytics
+from bandwidth import RUNGS, rung_video_args
+from compositor import CompositingPipeline, FrameReader, OverlayCompositor, raw_video_input_args
+from fanout import DEFAULT_AUDIO_ARGS, DEFAULT_VIDEO_ARGS, FanoutEncoder
+from governor import PIXEL_RATE_1080P30, AdmissionError, ResourceGovernor
+from journal import MatchJournal
+from match_engine import EXTRA_NAMES, MatchEngine
+from overlay import scoreboard_overlay_values, scoreboard_renderer
+from probe import COPY_VIDEO_ARGS
+from score_server import score_state
+from scoreboard import scoreboard_values
+from telemetry import EncoderTelemetry
+
+logger = logging.getLogger(__name__)
+
+# Per-match work besides the encoder, for a 1080p30 program: decoding one
+# camera, and compositing in the worker (scaled by pixel rate like encodes)
+DECODE_CORES_1080P30 = 0.3
+COMPOSITE_CORES_1080P30 = 0.25
+
+MATCH_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+MATCH_DEFAULTS = {
+    "team1": "Team A",
+    "team2": "Team B",
+    "max_overs": 20,
+    "width": 1280,
+    "height": 720,
+    "fps": 30,
+    "video_args": rung_video_args(DEFAULT_VIDEO_ARGS, RUNGS[1], 720),
+    "destinations": {}
+}
+STATUSES = ("starting", "running", "stopped", "failed")
+
+
+class MatchError(RuntimeError):
+    """A match can't do what was asked: not running, already exists, or its worker failed the command"""
+
+
+def match_config(config, directory):
+    """A complete match configuration from what a client sent; raises ValueError"""
+    if not isinstance(config, dict):
+        raise ValueError("A match is a JSON object")
+    unknown = set(config) - set(MATCH_DEFAULTS) - {"id", "cameras"}
+    if unknown:
+        raise ValueError(f"Unknown match settings: {', '.join(sorted(unknown))}")
+    match_id = str(config.get("id", ""))
+    if not MATCH_ID.fullmatch(match_id):
+        raise ValueError("A match id is 1-64 letters, digits, - or _")
+    cameras = config.get("cameras")
+    if not isinstance(cameras, list) or not cameras or not all(isinstance(url, str) for url in cameras):
+        raise ValueError("cameras must be a list of camera URLs")
+    config = {**MATCH_DEFAULTS, **config, "id": match_id, "directory": os.path.join(directory, match_id)}
+    if not isinstance(config["destinations"], dict):
+        raise ValueError("destinations must map names to RTMP URLs")
+    for key in ("width", "height", "fps", "max_overs"):
+        config[key] = int(config[key])
+    return config
+
+
+class MatchWorker:
+    """One match in its own process: scoring, journal, compositing and the shared encoder.
+
+    Commands arrive over a multiprocessing connection as (seq, op, args)
+    and are answered one at a time with (seq, "ok", result), or with
+    "invalid" (bad arguments) or "error" and a message, so the match needs
+    no locking of its own. Every camera is decoded and kept warm for
+    instant cuts. A crash takes down only this match; the server notices,
+    and a restart recovers the score from the journal.
+    """
+
+    def __init__(self, config, video_args, conn):
+        self.config = config
+        self.video_args = video_args
+        self.conn = conn
+        self.program = 0
+        self.started = time.perf_counter()
+        self.journal = self.engine = self.telemetry = self.fanout = self.pipeline = None
+        self.readers = []
+        self.commands = {
+            "start": self.start,
+            "score": self.score,
+            "camera": self.cut,
+            "add_destination": self.add_destination,
+            "remove_destination": self.remove_destination,
+            "stats": self.stats,
+            "stop": self.stop
+        }
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    seq, op, args = self.conn.recv()
+                except (EOFError, OSError):
+                    logger.warning("Match server went away")
+                    break
+                try:
+                    reply = (seq, "ok", self.commands[op](*args))
+                except (ValueError, TypeError) as e:
+                    reply = (seq, "invalid", str(e))
+                except Exception as e:
+                    logger.warning(f"{op} failed: {e}")
+                    reply = (seq, "error", str(e) or type(e).__name__)
+                self.conn.send(reply)
+                if op == "stop":
+                    break
+        finally:
+            self.stop()
+
+    def start(self):
+        config = self.config
+        width, height, fps = config["width"], config["height"], config["fps"]
+        self.journal = MatchJournal(os.path.join(config["directory"], "journal"))
+        self.engine = self.journal.recover(lambda: MatchEngine(config["team1"], config["team2"],
+                                                               max_overs=config["max_overs"]))
+        self.analytics = MatchAnalytics()
+        self.analytics.attach(self.engine)
+        self.renderer = scoreboard_renderer()
+        self.compositor = OverlayCompositor()
+        self.telemetry = EncoderTelemetry()
+        self.telemetry.start()
+        self.readers = [FrameReader(url, width, height, fps) for url in config["cameras"]]
+        for reader in self.readers:
+            reader.start()
+        self.fanout = FanoutEncoder(raw_video_input_args(width, height, fps, audio_source=config["cameras"][0]),
+                                    self.video_args, DEFAULT_AUDIO_ARGS, frame_input=True, telemetry=self.telemetry)
+        self.pipeline = CompositingPipeline(self.readers[0], self.compositor, self.fanout, owns_reader=False)
+        self.refresh_overlay()
+        self.pipeline.start()
+        for name, url in config["destinations"].items():
+            self.fanout.add_destination(name, url)
+        logger.info(f"Match {config['id']} on air with {len(self.readers)} cameras, "
+                    f"{len(config['destinations'])} destinations")
+        return self.pids()
+
+    def pids(self):
+        return {
+            "worker": os.getpid(),
+            "encoder": self.fanout.process.pid,
+            "decoders": [reader.process.pid for reader in self.readers],
+            "destinations": {name: relay.process.pid for name, relay in list(self.fanout.relays.items())}
+        }
+
+    # Commands
+
+    def score(self, action, value=None):
+        engine = self.engine
+        if action in ("undo", "redo"):
+            if getattr(engine, action)():
+                getattr(self.journal, action)()
+        else:
+            if action == "runs":
+                event = engine.add_runs(int(value))
+            elif action == "wicket":
+                event = engine.add_wicket(value or "")
+            elif action == "extra":
+                if (value or "wides") not in EXTRA_NAMES:
+                    raise ValueError(f"extra is one of {', '.join(EXTRA_NAMES)}")
+                event = engine.add_extra(value or "wides")
+            elif action == "bowler":
+                event = engine.new_bowler(value or f"Bowler {len(engine.batting.bowlers) + 1}")
+            elif action == "innings":
+                event = engine.switch_innings()
+            else:
+                raise ValueError(f"Unknown scoring action {action}")
+            self.journal.record(event)
+            if action in ("runs", "wicket", "extra") and engine.innings_complete() and engine.current == 0:
+                self.journal.record(engine.switch_innings())
+            self.journal.maybe_snapshot(engine)
+        self.refresh_overlay()
+        return score_state(engine)
+
+    def refresh_overlay(self):
+        overlay = self.renderer.render(scoreboard_overlay_values(scoreboard_values(self.engine, self.analytics)))
+        if self.renderer.changed:
+            self.compositor.set_overlay(overlay)
+
+    def cut(self, index):
+        if not 0 <= index < len(self.readers):
+            raise ValueError(f"Camera {index} doesn't exist; there are {len(self.readers)}")
+        self.pipeline.set_reader(self.readers[index])
+        self.program = index
+        return index
+
+    def add_destination(self, name, url):
+        return self.fanout.add_destination(name, url).process.pid
+
+    def remove_destination(self, name):
+        self.fanout.remove_destination(name, stop_when_empty=False)
+        return self.fanout.destinations()
+
+    def stats(self):
+        encoder = self.telemetry.snapshot(FanoutEncoder.ENCODER_NAME) or {}
+        return {
+            "score": score_state(self.engine),
+            "program": self.program,
+            "uptime_s": time.perf_counter() - self.started,
+            "frames": self.pipeline.frames,
+            "repeated_frames": self.pipeline.repeated_frames,
+            "composite": self.compositor.stats(),
+            "encoder": {key: encoder.get(key) for key in ("fps", "speed", "bitrate_kbps", "drop_frames")},
+            "destinations": self.fanout.destinations()
+        }
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.fanout.stop()
+            self.pipeline = None
+        for reader in self.readers:
+            reader.stop()
+        self.readers = []
+        if self.telemetry is not None:
+            self.telemetry.stop()
+            self.telemetry = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+def worker_main(config, video_args, conn):
+    """Entry point of a match's worker process"""
+    logging.basicConfig(level=logging.INFO,
+                        format=f"%(asctime)s [{config['id']}] %(levelname)s %(name)s: %(message)s")
+    MatchWorker(config, video_args, conn).run()
+
+
+class MatchHandle:
+    """The server's side of one match: its worker process, connection and CPU plans"""
+
+    def __init__(self, config, process, conn):
+        self.config = config
+        self.id = config["id"]
+        self.process = process
+        self.conn = conn
+        self.status = "starting"
+        self.pids = {}
+        self.started = time.time()
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def call(self, op, *args, timeout=10.0):
+        """Run a command in the worker and return its result; raises ValueError or MatchError"""
+        with self.lock:
+            self.seq += 1
+            try:
+                self.conn.send((self.seq, op, args))
+                while True:
+                    if not self.conn.poll(timeout):
+                        raise MatchError(f"Match {self.id} didn't answer {op} within {timeout:.0f} s")
+                    seq, kind, value = self.conn.recv()
+                    # Skip the late answer to a command that timed out
+                    if seq == self.seq:
+                        break
+            except (EOFError, OSError) as e:
+                raise MatchError(f"Match {self.id} worker is gone") from e
+        if kind == "invalid":
+            raise ValueError(value)
+        if kind == "error":
+            raise MatchError(value)
+        return value
+
+    def summary(self):
+        return {"id": self.id, "status": self.status, "pid": self.process.pid, "exitcode": self.process.exitcode,
+                "started": self.started, "cameras": len(self.config["cameras"]),
+                "destinations": sorted(self.pids.get("destinations", {}))}
+
+
+class MatchServer:
+    """Hosts many independent matches on one box, each in its own worker process.
+
+    A match gets a process of its own for scoring, decoding, compositing
+    and its shared encoder, so one that stalls or crashes leaves the others
+    on air, and no two matches share a GIL. One ResourceGovernor schedules
+    the whole box: each match is admitted only if its decoders, compositor,
+    encoder and relays fit in the cores left, and its encoder is pinned to
+    the least loaded cores. A JSON control API on its own asyncio loop
+    addresses matches by id:
+
+      GET    /matches                        every match and its status
+      POST   /matches                        {"id", "cameras": [...], "destinations": {...}, ...}
+      GET    /matches/<id>                   status plus live score and encoder stats
+      DELETE /matches/<id>                   stop it (the journal stays for a restart)
+      POST   /matches/<id>/restart           start it again from its journal
+      POST   /matches/<id>/score             {"action": "runs", "value": 4}
+      POST   /matches/<id>/camera            {"index": 1}
+      POST   /matches/<id>/destinations      {"name", "url"}
+      DELETE /matches/<id>/destinations/<n>
+      GET    /stats                          CPU committed and measured across the box
+    """
+
+    def __init__(self, directory="matches", host="127.0.0.1", port=8770, governor=None):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.governor = governor or ResourceGovernor()
+        self.matches = {}
+        self.lock = threading.Lock()
+        self.context = multiprocessing.get_context("spawn")
+        self.requests = 0
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    # Matches
+
+    def handle(self, match_id):
+        with self.lock:
+            handle = self.matches.get(match_id)
+        if handle is None:
+            raise KeyError(f"No match {match_id}")
+        return handle
+
+    def create(self, config):
+        """Admit, spawn and start a match; raises ValueError, AdmissionError or MatchError"""
+        config = match_config(config, self.directory)
+        match_id = config["id"]
+        with self.lock:
+            existing = self.matches.get(match_id)
+            if existing is not None and existing.status in ("starting", "running"):
+                raise MatchError(f"Match {match_id} is already {existing.status}")
+            encoder = self.plan(config)
+            parent, child = self.context.Pipe()
+            process = self.context.Process(target=worker_main, args=(config, encoder.video_args, child),
+                                           name=f"match-{match_id}", daemon=True)
+            handle = self.matches[match_id] = MatchHandle(config, process, parent)
+        process.start()
+        child.close()
+        try:
+            handle.pids = handle.call("start", timeout=30.0)
+        except (ValueError, MatchError):
+            self.stop_match(match_id, status="failed")
+            raise
+        self.apply(handle)
+        handle.status = "running"
+        logger.info(f"Match {match_id} started in process {process.pid}")
+        return handle.summary()
+
+    def plan(self, config):
+        """Admit everything a match runs with the governor; returns its encoder plan"""
+        match_id, width, height, fps = config["id"], config["width"], config["height"], config["fps"]
+        scale = width * height * fps / PIXEL_RATE_1080P30
+        try:
+            self.governor.reserve(f"{match_id}/worker", scale * (COMPOSITE_CORES_1080P30 +
+                                                                 DECODE_CORES_1080P30 * len(config["cameras"])))
+            encoder = self.governor.plan(f"{match_id}/{FanoutEncoder.ENCODER_NAME}", config["video_args"],
+                                         width, height, fps)
+            for name in config["destinations"]:
+                self.governor.plan(f"{match_id}/{name}", COPY_VIDEO_ARGS)
+        except AdmissionError:
+            self.release(match_id)
+            raise
+        return encoder
+
+    def apply(self, handle):
+        """Pin the match's encoder and relays where the governor placed them"""
+        plans = self.governor.plans
+        pids = {FanoutEncoder.ENCODER_NAME: handle.pids["encoder"], **handle.pids["destinations"]}
+        for name, pid in pids.items():
+            plan = plans.get(f"{handle.id}/{name}")
+            if plan is not None:
+                self.governor.apply(plan, pid)
+
+    def release(self, match_id, name=None):
+        prefix = f"{match_id}/{name}" if name else f"{match_id}/"
+        for plan in list(self.governor.plans):
+            if plan == prefix or (name is None and plan.startswith(prefix)):
+                self.governor.release(plan)
+
+    def call(self, match_id, op, *args):
+        handle = self.handle(match_id)
+        if handle.status != "running":
+            raise MatchError(f"Match {match_id} is {handle.status}")
+        return handle.call(op, *args)
+
+    def status(self, match_id):
+        handle = self.handle(match_id)
+        summary = handle.summary()
+        if handle.status == "running":
+            summary.update(handle.call("stats"))
+        return summary
+
+    def add_destination(self, match_id, name, url):
+        handle = self.handle(match_id)
+        # Planning a name again would move the live relay's reservation, so turn duplicates away first
+        if name in handle.pids.get("destinations", {}):
+            raise ValueError(f"{name} is already a destination")
+        plan = self.governor.plan(f"{match_id}/{name}", COPY_VIDEO_ARGS)
+        try:
+            pid = self.call(match_id, "add_destination", name, url)
+        except (ValueError, MatchError):
+            self.release(match_id, name)
+            raise
+        handle.pids["destinations"][name] = pid
+        self.governor.apply(plan, pid)
+        return handle.summary()
+
+    def remove_destination(self, match_id, name):
+        handle = self.handle(match_id)
+        self.call(match_id, "remove_destination", name)
+        handle.pids["destinations"].pop(name, None)
+        self.release(match_id, name)
+        return handle.summary()
+
+    def stop_match(self, match_id, status="stopped"):
+        handle = self.handle(match_id)
+        if handle.process.is_alive():
+            try:
+                handle.call("stop")
+            except MatchError as e:
+                logger.warning(f"{e}; terminating it")
+            handle.process.join(5)
+            if handle.process.is_alive():
+                handle.process.terminate()
+                handle.process.join(5)
+        handle.status = status
+        self.release(match_id)
+        logger.info(f"Match {match_id} {status}")
+        return handle.summary()
+
+    def restart_match(self, match_id):
+        handle = self.handle(match_id)
+        if handle.status in ("starting", "running"):
+            raise MatchError(f"Match {match_id} is {handle.status}")
+        config = {key: value for key, value in handle.config.items() if key != "directory"}
+        return self.create(config)
+
+    def stop_all(self):
+        with self.lock:
+            running = [match_id for match_id, handle in self.matches.items() if handle.status == "running"]
+        for match_id in running:
+            self.stop_match(match_id)
+
+    def check(self):
+        """Mark matches whose worker died on its own as failed, and give their cores back"""
+        with self.lock:
+            handles = list(self.matches.values())
+        for handle in handles:
+            if handle.status == "running" and not handle.process.is_alive():
+                handle.status = "failed"
+                self.release(handle.id)
+                logger.error(f"Match {handle.id} worker exited with code {handle.process.exitcode}")
+
+    def stats(self):
+        with self.lock:
+            statuses = [handle.status for handle in self.matches.values()]
+        return {"matches": {status: statuses.count(status) for status in STATUSES}, "requests": self.requests,
+                **self.governor.stats()}
+
+    # Control API
+
+    def start_in_thread(self):
+        threading.Thread(target=self.run, name="match-server", daemon=True).start()
+        self._ready.wait(5)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error(f"Match server could not listen on {self.host}:{self.port}: {e}")
+            self.loop = None
+            self._ready.set()
+            return
+        logger.info(f"Match server control API on http://{self.host}:{self.port}/matches")
+        self._ready.set()
+        self._stopped = asyncio.Event()
+        watcher = asyncio.ensure_future(self._watch())
+        async with self._server:
+            await self._stopped.wait()
+        watcher.cancel()
+
+    async def _watch(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.governor.sample()
+            self.check()
+
+    def stop(self):
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._server.close()
+        self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode(errors="replace").split("\r\n")
+            parts = lines[0].split(" ")
+            method, path = parts[0], (parts[1] if len(parts) > 1 else "/").split("?")[0]
+            headers = {}
+            for line in lines[1:]:
+                key, sep, value = line.partition(":")
+                if sep:
+                    headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            body = await reader.readexactly(length) if length else b""
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            writer.close()
+            return
+        self.requests += 1
+        try:
+            data = json.loads(body) if body else {}
+            # Commands wait on worker processes; keep that off the event loop
+            status, result = await self.loop.run_in_executor(None, self._route, method, path, data)
+        except KeyError as e:
+            status, result = "404 Not Found", {"error": e.args[0] if e.args else "not found"}
+        except AdmissionError as e:
+            status, result = "503 Service Unavailable", {"error": str(e)}
+        except MatchError as e:
+            status, result = "409 Conflict", {"error": str(e)}
+        except (ValueError, TypeError) as e:
+            status, result = "400 Bad Request", {"error": str(e)}
+        try:
+            await self._respond(writer, status, result)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _route(self, method, path, data):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["matches"] and method == "GET":
+            with self.lock:
+                handles = list(self.matches.values())
+            return "200 OK", [handle.summary() for handle in handles]
+        if parts == ["matches"] and method == "POST":
+            return "201 Created", self.create(data)
+        if parts == ["stats"] and method == "GET":
+            return "200 OK", self.stats()
+        if len(parts) < 2 or parts[0] != "matches":
+            raise KeyError("not found")
+        match_id, action = parts[1], parts[2:]
+        if not action and method == "GET":
+            return "200 OK", self.status(match_id)
+        if not action and method == "DELETE":
+            return "200 OK", self.stop_match(match_id)
+        if action == ["restart"] and method == "POST":
+            return "200 OK", self.restart_match(match_id)
+        if action == ["score"] and method == "POST":
+            return "200 OK", self.call(match_id, "score", field(data, "action"), data.get("value"))
+        if action == ["camera"] and method == "POST":
+            return "200 OK", {"program": self.call(match_id, "camera", int(field(data, "index")))}
+        if action == ["destinations"] and method == "POST":
+            return "201 Created", self.add_destination(match_id, field(data, "name"), field(data, "url"))
+        if len(action) == 2 and action[0] == "destinations" and method == "DELETE":
+            return "200 OK", self.remove_destination(match_id, action[1])
+        raise KeyError("not found")
+
+    async def _respond(self, writer, status, result):
+        data = json.dumps(result).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+
+
+def field(data, name):
+    if not isinstance(data, dict) or name not in data:
+        raise ValueError(f"Missing {name}")
+    return data[name]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless multi-match server: one worker process per match")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--directory", default="matches", help="where each match keeps its journal")
+    parser.add_argument("--matches", help="JSON file with a list of matches to start with")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = MatchServer(args.directory, args.host, args.port)
+    if args.matches:
+        with open(args.matches) as f:
+            for config in json.load(f):
+                try:
+                    server.create(config)
+                except (ValueError, AdmissionError, MatchError) as e:
+                    logger.error(f"Could not start match {config.get('id')}: {e}")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop_all()
@@ -0,0 +1,166 @@
+import logging
+import queue
+import threading
+import time
+
+from events import DelayTracker
+
+logger = logging.getLogger(__name__)
+
+
+class MediaWorker:
+    """Runs libvlc and FFmpeg process control off the Tk thread.
+
+    The GUI posts commands (start a player, spawn or terminate an FFmpeg
+    process, ...) and carries on; one worker thread runs them in the order
+    they were submitted, so a slow RTMP handshake or a player.stop() that
+    hangs never holds up the scoring buttons. on_done/on_error callbacks
+    are queued back and run on the Tk thread from a root.after poll, never
+    on the worker. submit() and post() may be called from any thread.
+    """
+
+    def __init__(self, root, on_error=None, poll_ms=30):
+        self.root = root
+        self.on_error = on_error
+        self.poll_ms = poll_ms
+        self.commands = queue.Queue()
+        self.results = queue.Queue()
+        self.command_time = DelayTracker()
+        self.completed = 0
+        self.failed = 0
+        self.slowest = (0.0, None)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="media-worker", daemon=True)
+        self._thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        self.commands.put((fn, args, on_done, on_error))
+
+    def post(self, callback, *args):
+        """Run callback(*args) on the Tk thread (e.g. from a monitor thread)"""
+        self.results.put((callback, args))
+
+    def _run(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            fn, args, on_done, on_error = command
+            start = time.perf_counter()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Media command {getattr(fn, '__qualname__', fn)} failed: {e}")
+                handler = on_error or self.on_error
+                if handler:
+                    self.post(handler, e)
+            else:
+                self.completed += 1
+                if on_done:
+                    self.post(on_done, result)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.command_time.record(elapsed)
+            if elapsed > self.slowest[0]:
+                self.slowest = (elapsed, getattr(fn, '__qualname__', repr(fn)))
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self.results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Media result callback failed")
+        if self._thread is not None:
+            self.root.after(self.poll_ms, self._poll)
+
+    def stop(self, timeout=5.0):
+        """Finish the commands already queued (up to timeout), then stop"""
+        if self._thread is None:
+            return
+        self.commands.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Media worker still busy after {timeout:.0f} s, abandoning it")
+        self._thread = None
+
+    def stats(self):
+        return {
+            "pending": self.commands.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "command_time": self.command_time.summary(),
+            "slowest_ms": self.slowest[0],
+            "slowest": self.slowest[1]
+        }
+
+
+class StallMonitor:
+    """Measures how long the Tk thread goes without servicing its event loop.
+
+    A heartbeat is scheduled every interval_ms; how late it fires is the
+    time the GUI was unresponsive (a button press would have waited that
+    long). histogram (metrics.Histogram) also gets every lateness, in s.
+    """
+
+    def __init__(self, root, interval_ms=50, histogram=None):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.histogram = histogram
+        self.stalls = DelayTracker(window=1200)
+        self.worst_ms = 0.0
+        self._expected = None
+
+    def start(self):
+        self._expected = time.perf_counter() + self.interval_ms / 1000
+        self.root.after(self.interval_ms, self._beat)
+
+    def _beat(self):
+        now = time.perf_counter()
+        late_ms = max(0.0, (now - self._expected) * 1000)
+        self.stalls.record(late_ms)
+        if self.histogram is not None:
+            self.histogram.observe(late_ms / 1000)
+        self.worst_ms = max(self.worst_ms, late_ms)
+        self._expected = now + self.interval_ms / 1000
+        self.root.after(self.interval_ms, self._beat)
+
+    def stats(self):
+        summary = self.stalls.summary()
+        summary["worst_ms"] = self.worst_ms
+        return summary
+
+
+if __name__ == "__main__":
+    # GUI stall with a slow media operation run inline vs. on the worker
+    import tkinter as tk
+
+    def slow_media_call():
+        time.sleep(0.4)  # e.g. player.stop() on a dead RTMP source
+
+    for label, use_worker in (("inline", False), ("media worker", True)):
+        interp = tk.Tcl()
+        monitor = StallMonitor(interp, interval_ms=20)
+        monitor.start()
+        worker = MediaWorker(interp)
+        worker.start()
+        end = time.perf_counter() + 2.0
+        next_command = time.perf_counter() + 0.3
+        while time.perf_counter() < end:
+            if time.perf_counter() >= next_command:
+                if use_worker:
+                    worker.submit(slow_media_call)
+                else:
+                    slow_media_call()
+                next_command += 0.5
+            interp.update()
+            time.sleep(0.001)
+        worker.stop()
+        stats = monitor.stats()
+        print(f"{label}: GUI stall p95 {stats['p95_ms']:.1f} ms, worst {stats['worst_ms']:.1f} ms")
@@ -0,0 +1,390 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Seconds; a Tk handler past 50 ms is a visible stutter
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def process_usage(pid):
+    """(CPU seconds, RSS bytes) of a process from /proc, or None if it's gone"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, resident * PAGE_SIZE
+
+
+def child_processes(pid=None):
+    """{pid: command name} of the direct children of pid (this process by default); empty off Linux"""
+    pid = pid or os.getpid()
+    children = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        comm, rest = stat[stat.find('(') + 1:stat.rfind(')')], stat[stat.rfind(')') + 2:].split()
+        if len(rest) > 1 and int(rest[1]) == pid:
+            children[int(entry)] = comm
+    return children
+
+
+def os_thread_count():
+    """Threads in this process, native ones (libvlc, Tk) included; None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def timed(name):
+    """Method decorator: each call's duration goes into self.metrics' app_handler_seconds{handler=name}"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe("app_handler_seconds", time.perf_counter() - start, handler=name)
+        return wrapper
+    return decorate
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram of seconds, Prometheus style; observe() is thread-safe"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def lines(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for bound, n in zip((*self.buckets, "+Inf"), counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels((*labels, ('le', bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+        return lines
+
+
+class Metrics:
+    """The app's metrics, rendered in the Prometheus text format.
+
+    Histograms and counters are created on first use, keyed by name and
+    labels, and are safe to update from any thread. Collectors are called
+    at scrape time (on the metrics server's thread) and yield
+    (name, value, labels) for gauges and externally kept counters; they
+    must only read state that is safe to read from there.
+    """
+
+    def __init__(self):
+        self.help = {}  # name -> (type, help)
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = Counter()  # (name, labels) -> value
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+
+    def render(self):
+        series = {}
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        for (name, labels), histogram in histograms:
+            series.setdefault(name, []).extend(histogram.lines(name, labels))
+        for (name, labels), value in counters:
+            series.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+        for collect in self.collectors:
+            try:
+                for name, value, labels in collect():
+                    if value is not None:
+                        series.setdefault(name, []).append(
+                            f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+            except Exception:
+                logger.exception("Metrics collector failed")
+        out = []
+        for name, lines in series.items():
+            kind, text = self.help.get(name, ("untyped", ""))
+            out += [f"# HELP {name} {text}", f"# TYPE {name} {kind}", *lines]
+        return "\n".join(out) + "\n"
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for a live match, with bounded overhead.
+
+    A background thread snapshots every thread's Python stack
+    (sys._current_frames) and counts each distinct stack, prefixed with
+    the thread's name, in collapsed form (flamegraph.pl / speedscope).
+    Sampling holds the GIL, so the interval stretches whenever a sample
+    costs more than budget of the time between samples; distinct stacks
+    are capped at max_stacks and a run stops itself after max_seconds.
+    stop() writes the profile to directory and keeps it as last_profile.
+    """
+
+    def __init__(self, directory="profiles", interval_s=0.005, budget=0.01, max_seconds=120, max_stacks=10000,
+                 depth=64):
+        self.directory = directory
+        self.interval_s = interval_s
+        self.budget = budget
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self.depth = depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_s = 0.0
+        self.started = None
+        self.last_profile = ""
+        self.last_path = None
+        self.running = False
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def start(self, seconds=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.stacks = Counter()
+            self.samples = 0
+            self.sampling_s = 0.0
+            self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(seconds or self.max_seconds,), name="profiler",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Profiler started (up to {seconds or self.max_seconds:.0f} s)")
+        return True
+
+    def _run(self, seconds):
+        own = threading.get_ident()
+        end = self.started + min(seconds, self.max_seconds)
+        while self.running and time.perf_counter() < end:
+            start = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, str(ident)), *reversed(stack)])
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = f"{names.get(ident, str(ident))};(more stacks than max_stacks)"
+                self.stacks[key] += 1
+            self.samples += 1
+            cost = time.perf_counter() - start
+            self.sampling_s += cost
+            time.sleep(max(self.interval_s, cost / self.budget) - cost)
+        if self.running:
+            self.stop()
+
+    def stop(self):
+        """Finish a run; returns the profile's path (None if nothing was running)"""
+        with self.lock:
+            if not self.running:
+                return None
+            self.running = False
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.last_profile = "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+        os.makedirs(self.directory, exist_ok=True)
+        self.last_path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(self.last_path, "w") as f:
+            f.write(self.last_profile)
+        stats = self.stats()
+        logger.info(f"Profiler stopped: {stats['samples']} samples, overhead {stats['overhead']:.2%}, "
+                    f"written to {self.last_path}")
+        return self.last_path
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return {"running": self.running, "samples": self.samples, "stacks": len(self.stacks),
+                "overhead": self.sampling_s / elapsed if elapsed > 0 else 0.0}
+
+
+class MetricsServer:
+    """Local HTTP endpoint: /metrics for Prometheus, /profile/start, /profile/stop and /profile for the profiler.
+
+    Listens on localhost only by default; /profile/start takes an optional
+    ?seconds=N.
+    """
+
+    def __init__(self, metrics, profiler=None, host="127.0.0.1", port=9108):
+        self.metrics = metrics
+        self.profiler = profiler
+        self.host = host
+        self.port = port
+        self.scrapes = 0
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    def start_in_thread(self):
+        threading.Thread(target=self.run, name="metrics-server", daemon=True).start()
+        self._ready.wait(5)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error(f"Metrics server could not listen on {self.host}:{self.port}: {e}")
+            self.loop = None
+            self._ready.set()
+            return
+        logger.info(f"Metrics on http://{self.host}:{self.port}/metrics")
+        self._ready.set()
+        self._stopped = asyncio.Event()
+        async with self._server:
+            await self._stopped.wait()
+
+    def stop(self):
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._server.close()
+        self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        parts = request.decode(errors="replace").split("\r\n")[0].split(" ")
+        path, _, query = (parts[1] if len(parts) > 1 else "/").partition("?")
+        try:
+            if path == "/metrics":
+                self.scrapes += 1
+                # Collectors read /proc; keep that off the event loop
+                body = await self.loop.run_in_executor(None, self.metrics.render)
+                await self._respond(writer, "200 OK", "text/plain; version=0.0.4", body)
+            elif path.startswith("/profile") and self.profiler is None:
+                await self._respond(writer, "404 Not Found", "text/plain", "no profiler\n")
+            elif path == "/profile/start":
+                seconds = dict(p.partition("=")[::2] for p in query.split("&") if p).get("seconds")
+                started = self.profiler.start(float(seconds) if seconds else None)
+                await self._respond(writer, "200 OK", "text/plain",
+                                    "started\n" if started else "already running\n")
+            elif path == "/profile/stop":
+                path = await self.loop.run_in_executor(None, self.profiler.stop)
+                await self._respond(writer, "200 OK", "text/plain", f"{path or 'not running'}\n")
+            elif path == "/profile":
+                await self._respond(writer, "200 OK", "text/plain", self.profiler.last_profile)
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", "not found\n")
+        except ValueError:
+            await self._respond(writer, "400 Bad Request", "text/plain", "bad request\n")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        data = body.encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+
+
+if __name__ == "__main__":
+    # Profile a busy loop next to a timed "handler" for a few seconds and scrape the endpoint once
+    import urllib.request
+
+    class Demo:
+        def __init__(self):
+            self.metrics = Metrics()
+
+        @timed("busy")
+        def busy(self, n):
+            return sum(i * i for i in range(n))
+
+    logging.basicConfig(level=logging.INFO)
+    demo = Demo()
+    demo.metrics.describe("app_handler_seconds", "histogram", "Time spent in Tk handlers")
+    profiler = SamplingProfiler(directory="/tmp/profiles")
+    server = MetricsServer(demo.metrics, profiler, port=19108)
+    server.start_in_thread()
+    urllib.request.urlopen("http://127.0.0.1:19108/profile/start?seconds=3").read()
+    end = time.perf_counter() + 3.5
+    while time.perf_counter() < end:
+        demo.busy(20000)
+    print(urllib.request.urlopen("http://127.0.0.1:19108/metrics").read().decode()[-400:])
+    print(profiler.stats(), profiler.last_path)
+    print(profiler.last_profile.splitlines()[0])
+    server.stop()
@@ -0,0 +1,274 @@
+import logging
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def load_font(size, path="arial.ttf"):
+    """Load a font once per size; fall back to PIL's built-in font if it is missing"""
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        logger.warning(f"Font {path} not found, using default font")
+        return ImageFont.load_default()
+
+
+# The broadcast scoreboard: field boxes and background panels of the 560x110 overlay
+SCOREBOARD_SIZE = (560, 110)
+SCOREBOARD_FIELDS = {
+    "team": (0, 0, 190, 30, 18, (255, 255, 255, 255)),
+    "score": (190, 0, 370, 30, 18, (255, 255, 0, 255)),
+    "bat1": (0, 30, 280, 24, 14, (255, 255, 255, 255)),
+    "bat2": (280, 30, 280, 24, 14, (255, 255, 255, 255)),
+    "bowler": (0, 54, 280, 24, 14, (255, 255, 255, 255)),
+    "extras": (280, 54, 280, 24, 14, (255, 255, 0, 255)),
+    "rates": (0, 78, 560, 28, 14, (255, 255, 255, 255))
+}
+SCOREBOARD_PANELS = [((0, 0, 559, 29), (0, 102, 204, 230)), ((0, 30, 559, 109), (51, 51, 51, 210))]
+
+
+# Charts (analytics.MatchAnalytics) go under the scoreboard, on the same dark panel
+CHART_SIZE = (560, 150)
+CHART_PANEL = (51, 51, 51, 210)
+CHART_MARGIN = (34, 24, 10, 16)  # left, top, right, bottom: room for the title and axis labels
+INNINGS_COLOURS = ((255, 255, 0, 255), (0, 200, 255, 255))
+WICKET_COLOUR = (230, 60, 60, 255)
+AXIS_COLOUR = (200, 200, 200, 255)
+
+
+def scoreboard_overlay_values(values):
+    """Overlay field texts from scoreboard.scoreboard_values()"""
+    rates = "  ".join(text for text in (values["rr"], values.get("dots", ""),
+                                        values["target"] or values.get("projected", "")) if text)
+    return {
+        "team": values["team"],
+        "score": values["score"],
+        "bat1": f"{values['bat1_name']} {values['bat1_stats']}",
+        "bat2": f"{values['bat2_name']} {values['bat2_stats']}",
+        "bowler": values["bowler"],
+        "extras": values["extras"],
+        "rates": rates
+    }
+
+
+class OverlayRenderer:
+    """Incremental BGRA scoreboard renderer.
+
+    size is (width, height). fields maps a field name to its box and style,
+    {name: (x, y, width, height, font_size, rgba)}, and panels is a list of
+    ((x0, y0, x1, y1), rgba) rectangles painted once as the static
+    background. render() only re-rasterizes fields whose text changed,
+    pulling previously seen text from a tile cache, and writes into a
+    preallocated buffer. When nothing changed it returns the same buffer
+    with changed=False.
+    """
+
+    def __init__(self, size, fields, panels=(), font_path="arial.ttf", cache_size=512):
+        self.width, self.height = size
+        self.fields = dict(fields)
+        self.font_path = font_path
+        self.cache_size = cache_size
+
+        background = Image.new("RGBA", size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(background)
+        for box, fill in panels:
+            draw.rectangle(box, fill=fill)
+        self._background_image = background
+        self._background = np.array(background)[:, :, [2, 1, 0, 3]]
+        self._frame = self._background.copy()
+        self._values = {}
+        self._tiles = OrderedDict()
+
+        self.changed = False
+        self.renders = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.last_render_ms = 0.0
+
+    def _tile(self, name, text):
+        """BGRA pixels for a field box with its text drawn over the background"""
+        key = (name, text)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            self.cache_hits += 1
+            return tile
+        x, y, w, h, font_size, fill = self.fields[name]
+        image = self._background_image.crop((x, y, x + w, y + h))
+        font = load_font(font_size, self.font_path)
+        ImageDraw.Draw(image).text((4, max(0, (h - font_size) // 2 - 1)), text, font=font, fill=fill)
+        tile = np.array(image)[:, :, [2, 1, 0, 3]]
+        self._tiles[key] = tile
+        if len(self._tiles) > self.cache_size:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def render(self, values):
+        """Update the overlay from {field: text} and return the BGRA buffer"""
+        start = time.perf_counter()
+        self.changed = False
+        for name, text in values.items():
+            if self._values.get(name) == text or name not in self.fields:
+                continue
+            x, y, w, h = self.fields[name][:4]
+            self._frame[y:y + h, x:x + w] = self._tile(name, text)
+            self._values[name] = text
+            self.changed = True
+        if self.changed:
+            self.renders += 1
+        else:
+            self.skipped += 1
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        return self._frame
+
+    def stats(self):
+        return {
+            "renders": self.renders,
+            "skipped": self.skipped,
+            "cache_hits": self.cache_hits,
+            "cached_tiles": len(self._tiles),
+            "last_render_ms": self.last_render_ms
+        }
+
+
+class ChartRenderer:
+    """Broadcast charts drawn from analytics.MatchAnalytics, as BGRA overlays.
+
+    render() re-rasterizes a chart only when analytics.key(chart) says its
+    data changed since it was last drawn; otherwise it returns the cached
+    pixels with changed=False. Axes are scaled with vector ops over the
+    series, which are kept current by the analytics themselves. below()
+    stacks a chart under the scoreboard in a reused buffer, so the pair can
+    go to the compositor as one overlay.
+    """
+
+    def __init__(self, size=CHART_SIZE, font_path="arial.ttf"):
+        self.width, self.height = size
+        self.font_path = font_path
+        self._cache = {}  # chart -> (key, BGRA pixels)
+        self._stacked = None
+        self.changed = False
+        self.renders = 0
+        self.cache_hits = 0
+        self.last_render_ms = 0.0
+
+    def render(self, chart, analytics):
+        """The chart's BGRA pixels, redrawn only if its data changed"""
+        key = analytics.key(chart)
+        cached = self._cache.get(chart)
+        if cached is not None and cached[0] == key:
+            self.changed = False
+            self.cache_hits += 1
+            return cached[1]
+        start = time.perf_counter()
+        image = Image.new("RGBA", (self.width, self.height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, self.width - 1, self.height - 1), fill=CHART_PANEL)
+        getattr(self, f"_{chart.lower()}")(draw, analytics)
+        pixels = np.array(image)[:, :, [2, 1, 0, 3]]
+        self._cache[chart] = (key, pixels)
+        self.changed = True
+        self.renders += 1
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        return pixels
+
+    def below(self, overlay, chart, gap=4):
+        """overlay with chart under it, in a buffer reused while the sizes stay the same"""
+        height = overlay.shape[0] + gap + chart.shape[0]
+        width = max(overlay.shape[1], chart.shape[1])
+        if self._stacked is None or self._stacked.shape[:2] != (height, width):
+            self._stacked = np.zeros((height, width, 4), np.uint8)
+        self._stacked[:overlay.shape[0], :overlay.shape[1]] = overlay
+        self._stacked[overlay.shape[0] + gap:, :chart.shape[1]] = chart
+        return self._stacked
+
+    # Drawing
+
+    def _plot_area(self):
+        left, top, right, bottom = CHART_MARGIN
+        return left, top, self.width - right, self.height - bottom
+
+    def _axes(self, draw, title, y_max, x_max, x_label):
+        font = load_font(12, self.font_path)
+        x0, y0, x1, y1 = self._plot_area()
+        draw.text((6, 4), title, font=load_font(14, self.font_path), fill=(255, 255, 255, 255))
+        draw.line((x0, y0, x0, y1, x1, y1), fill=AXIS_COLOUR)
+        draw.text((4, y0 - 2), str(y_max), font=font, fill=AXIS_COLOUR)
+        draw.text((x1 - 40, y1 + 1), f"{x_max} {x_label}", font=font, fill=AXIS_COLOUR)
+
+    def _scale(self, xs, ys, x_max, y_max):
+        """Pixel coordinates for data points, as two int arrays"""
+        x0, y0, x1, y1 = self._plot_area()
+        px = x0 + np.asarray(xs, float) * (x1 - x0) / max(x_max, 1)
+        py = y1 - np.asarray(ys, float) * (y1 - y0) / max(y_max, 1)
+        return np.rint(px).astype(int), np.rint(py).astype(int)
+
+    def _worm(self, draw, analytics):
+        engine = analytics.engine
+        series = [columns.worm() for columns in analytics.innings]
+        y_max = int(max([engine.target - 1, *(score[-1] for _, score in series if len(score))], default=0) * 1.1) + 1
+        self._axes(draw, f"Worm: {engine.innings[0].team} v {engine.innings[1].team}", y_max, engine.max_overs,
+                   "overs")
+        for index, ((overs, score), columns) in enumerate(zip(series, analytics.innings)):
+            if not len(score):
+                continue
+            px, py = self._scale(np.concatenate(([0.0], overs)), np.concatenate(([0], score)), engine.max_overs,
+                                 y_max)
+            draw.line(list(zip(px.tolist(), py.tolist())), fill=INNINGS_COLOURS[index], width=2)
+            # A dot at the end of each over that had a wicket
+            fell = columns.manhattan()[1] > 0
+            for x, y in zip(px[1:][fell].tolist(), py[1:][fell].tolist()):
+                draw.ellipse((x - 3, y - 3, x + 3, y + 3), fill=WICKET_COLOUR)
+
+    def _manhattan(self, draw, analytics):
+        engine = analytics.engine
+        runs, wickets = analytics.batting.manhattan()
+        y_max = max(int(runs.max()) if len(runs) else 0, 12)
+        self._axes(draw, f"Runs per over: {engine.batting.team}", y_max, engine.max_overs, "overs")
+        if not len(runs):
+            return
+        x0, _, x1, _ = self._plot_area()
+        bar = (x1 - x0) / max(engine.max_overs, 1)
+        left, top = self._scale(np.arange(len(runs)), runs, engine.max_overs, y_max)
+        bottom = self._scale([0], [0], 1, 1)[1][0]
+        colour = INNINGS_COLOURS[engine.current]
+        for over, (x, y, out) in enumerate(zip(left.tolist(), top.tolist(), wickets.tolist())):
+            draw.rectangle((x + 1, min(y, bottom - 1), x + max(1, int(bar) - 2), bottom - 1), fill=colour)
+            for n in range(out):
+                draw.ellipse((x + bar / 2 - 3, y - 8 - 7 * n, x + bar / 2 + 3, y - 2 - 7 * n), fill=WICKET_COLOUR)
+
+    def _partnerships(self, draw, analytics):
+        engine = analytics.engine
+        innings = engine.batting
+        runs, balls, pairs = analytics.batting.partnerships()
+        draw.text((6, 4), f"Partnerships: {innings.team}", font=load_font(14, self.font_path),
+                  fill=(255, 255, 255, 255))
+        shown = len(runs) if len(runs) <= 5 else 5
+        if not shown:
+            return
+        runs, balls, pairs = runs[-shown:], balls[-shown:], pairs[-shown:]
+        x0, y0, x1, y1 = 170, CHART_MARGIN[1], self.width - 60, self.height - 4
+        row = (y1 - y0) / shown
+        widths = np.rint(runs * (x1 - x0) / max(int(runs.max()), 1)).astype(int)
+        font = load_font(12, self.font_path)
+        colour = INNINGS_COLOURS[engine.current]
+        for n, (width, made, faced, (a, b)) in enumerate(zip(widths.tolist(), runs.tolist(), balls.tolist(),
+                                                              pairs.tolist())):
+            y = int(y0 + n * row)
+            names = f"{innings.batters[a].name} & {innings.batters[b].name}"
+            draw.text((6, y), names[:26], font=font, fill=(255, 255, 255, 255))
+            draw.rectangle((x0, y + 2, x0 + max(width, 1), y + int(row) - 3), fill=colour)
+            draw.text((x0 + max(width, 1) + 4, y), f"{made} ({faced})", font=font, fill=AXIS_COLOUR)
+
+    def stats(self):
+        return {"renders": self.renders, "cache_hits": self.cache_hits, "last_render_ms": self.last_render_ms}
+
+
+def scoreboard_renderer(font_path="arial.ttf"):
+    return OverlayRenderer(SCOREBOARD_SIZE, SCOREBOARD_FIELDS, SCOREBOARD_PANELS, font_path)
@@ -0,0 +1,140 @@
+import json
+import logging
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# What a source carries; None where ffprobe couldn't tell (e.g. no bit_rate on a live feed)
+SourceInfo = namedtuple('SourceInfo', 'video_codec profile width height fps video_kbps '
+                                      'audio_codec audio_kbps gop_s')
+
+# What RTMP ingest (YouTube, Facebook, X) takes as-is
+PASSTHROUGH_PROFILES = {"Baseline", "Constrained Baseline", "Main", "High"}
+MAX_PASSTHROUGH_WIDTH, MAX_PASSTHROUGH_HEIGHT = 1920, 1080
+MAX_PASSTHROUGH_FPS = 60
+MAX_PASSTHROUGH_KBPS = 8000
+MAX_PASSTHROUGH_GOP_S = 4.0
+
+COPY_VIDEO_ARGS = ['-c:v', 'copy']
+COPY_AUDIO_ARGS = ['-c:a', 'copy']
+
+
+def _rate(value):
+    num, _, den = (value or "0/1").partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _kbps(value):
+    try:
+        return int(value) / 1000
+    except (TypeError, ValueError):
+        return None
+
+
+def probe_source(url, gop_window_s=6, timeout=20):
+    """Run ffprobe on a source; raises on failure"""
+    base = ['ffprobe', '-v', 'error', '-print_format', 'json']
+    result = subprocess.run(base + ['-show_streams', '-show_format', url],
+                            capture_output=True, timeout=timeout, check=True)
+    data = json.loads(result.stdout)
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    # Keyframe spacing from packet flags over the first few seconds (no decoding needed)
+    gop_s = None
+    if video:
+        result = subprocess.run(base + ['-select_streams', 'v:0', '-read_intervals', f'%+{gop_window_s}',
+                                        '-show_entries', 'packet=pts_time,flags', url],
+                                capture_output=True, timeout=timeout)
+        keyframes = [float(p["pts_time"]) for p in json.loads(result.stdout or b"{}").get("packets", [])
+                     if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")]
+        if len(keyframes) >= 2:
+            gop_s = max(b - a for a, b in zip(keyframes, keyframes[1:]))
+
+    return SourceInfo(
+        video_codec=video.get("codec_name"),
+        profile=video.get("profile"),
+        width=video.get("width"),
+        height=video.get("height"),
+        fps=_rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate")) or None,
+        video_kbps=_kbps(video.get("bit_rate")) or _kbps(data.get("format", {}).get("bit_rate")),
+        audio_codec=audio.get("codec_name"),
+        audio_kbps=_kbps(audio.get("bit_rate")),
+        gop_s=gop_s
+    )
+
+
+def passthrough_problem(info):
+    """Why the source can't be stream-copied to RTMP, or None if it can"""
+    if info.video_codec != "h264":
+        return f"video is {info.video_codec or 'missing'}, not H.264"
+    if info.profile and info.profile not in PASSTHROUGH_PROFILES:
+        return f"H.264 profile {info.profile}"
+    if (info.width or 0) > MAX_PASSTHROUGH_WIDTH or (info.height or 0) > MAX_PASSTHROUGH_HEIGHT:
+        return f"{info.width}x{info.height} is above 1080p"
+    if info.fps and info.fps > MAX_PASSTHROUGH_FPS:
+        return f"{info.fps:.0f} fps"
+    if info.video_kbps and info.video_kbps > MAX_PASSTHROUGH_KBPS:
+        return f"{info.video_kbps:.0f} kb/s is above {MAX_PASSTHROUGH_KBPS} kb/s"
+    if info.gop_s is None:
+        return "keyframe interval unknown"
+    if info.gop_s > MAX_PASSTHROUGH_GOP_S:
+        return f"keyframes every {info.gop_s:.1f} s"
+    if info.audio_codec != "aac":
+        return f"audio is {info.audio_codec or 'missing'}, not AAC"
+    return None
+
+
+class ProbeCache:
+    """Probes each source once and remembers what it carries.
+
+    prefetch() probes in the background so nothing waits on ffprobe;
+    lookups never block and return None until a probe has finished.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.results.get(url)
+        return entry[0] if entry else None
+
+    def probe(self, url):
+        start = time.perf_counter()
+        try:
+            info = probe_source(url)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            logger.warning(f"Could not probe {url}: {e}")
+            return None
+        with self.lock:
+            self.results[url] = (info, time.time())
+        problem = passthrough_problem(info)
+        logger.info(f"Probed {url} in {(time.perf_counter() - start) * 1000:.0f} ms: "
+                    f"{info.video_codec} {info.profile} {info.width}x{info.height} gop {info.gop_s} s, "
+                    f"{info.audio_codec} - {'stream copy' if problem is None else 'transcode: ' + problem}")
+        return info
+
+    def prefetch(self, urls):
+        urls = [url for url in urls if self.get(url) is None]
+        if urls:
+            threading.Thread(target=lambda: [self.probe(url) for url in urls], name="probe",
+                             daemon=True).start()
+
+    def output_args(self, url, video_args, audio_args):
+        """(video_args, audio_args, reason): copy args when url can pass through, else the given ones"""
+        info = self.get(url)
+        if info is None:
+            return video_args, audio_args, "not probed yet"
+        problem = passthrough_problem(info)
+        if problem:
+            return video_args, audio_args, problem
+        return COPY_VIDEO_ARGS, COPY_AUDIO_ARGS, None
@@ -0,0 +1,326 @@
+import argparse
+import bisect
+import csv
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import Counter, namedtuple
+
+from fanout import TS_PACKET_SIZE
+from replay import keyframe_offset
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.csv"  # one row per keyframe: t, segment, offset
+EVENTS_FILE = "events.csv"  # one row per scoring event: t, label; then t, label, "undo" withdraws it
+SEGMENT_NAME = "segment_{:05d}.ts"
+COPY_BLOCK = 1024 * 1024
+
+Keyframe = namedtuple('Keyframe', 't segment offset')
+Highlight = namedtuple('Highlight', 'labels start end')
+
+
+def _pid(packet):
+    return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def _pmt_pid(pat):
+    """PMT PID of the first program in a PAT packet, or None"""
+    payload = 4 + (1 + pat[4] if pat[3] & 0x20 else 0)
+    table = payload + 1 + pat[payload]  # skip pointer_field
+    if pat[table] != 0x00:
+        return None
+    # 8-byte section header, then (program_number, PID) entries
+    for entry in range(table + 8, len(pat) - 4, 4):
+        program = (pat[entry] << 8) | pat[entry + 1]
+        if program != 0:
+            return ((pat[entry + 2] & 0x1F) << 8) | pat[entry + 3]
+    return None
+
+
+class Recording:
+    """Records the program feed to disk in segments, with a keyframe index.
+
+    write() takes the shared encoder's MPEG-TS chunks (it is a FanoutEncoder
+    tap) and only queues them; a writer thread appends whatever has queued
+    up to the segment file in one write, starting a new segment at the
+    first keyframe after segment_s.
+    Every keyframe's time, segment and byte offset go to index.csv and
+    mark() logs scoring events to events.csv, both on the recording's own
+    clock (seconds since the first chunk), so extract_highlights() can
+    later cut keyframe-aligned clips with plain file reads. unmark()
+    withdraws an event (the scorer undid it) with an "undo" row, so the
+    log stays append-only. The latest
+    PAT/PMT are written at the top of each segment so any segment, and any
+    clip cut from one, is decodable on its own.
+    """
+
+    def __init__(self, directory, segment_s=300.0, max_queue=1024):
+        self.directory = directory
+        self.segment_s = segment_s
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped_chunks = 0
+        self.bytes = 0
+        self.segments = 0
+        self.keyframes = 0
+        self.events = 0
+        self.started = None
+        self._segment = None
+        self._segment_started = None
+        self._offset = 0
+        self._tables = {}  # PID -> latest PAT/PMT packet
+        self._pmt_pid = None
+        self._index = open(os.path.join(directory, INDEX_FILE), 'a', newline='')
+        self._events = open(os.path.join(directory, EVENTS_FILE), 'a', newline='')
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def now(self):
+        return time.perf_counter() - self.started if self.started is not None else 0.0
+
+    def write(self, chunk):
+        if self.started is None:
+            self.started = time.perf_counter()
+        try:
+            self.queue.put_nowait((self.now(), chunk))
+        except queue.Full:
+            # The disk can't keep up; never stall the encoder's distributor
+            self.dropped_chunks += 1
+
+    def mark(self, label, t=None):
+        """Log a scoring event at the current point of the recording (or at t); returns its time"""
+        t = self.now() if t is None else t
+        with self._lock:
+            csv.writer(self._events).writerow([f"{t:.3f}", label])
+            self._events.flush()
+            self.events += 1
+        return t
+
+    def unmark(self, t, label):
+        """Withdraw an event logged by mark()"""
+        with self._lock:
+            csv.writer(self._events).writerow([f"{t:.3f}", label, "undo"])
+            self._events.flush()
+            self.events -= 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Take whatever else has queued up, so the disk sees one large sequential write
+            while len(batch) < self.queue.maxsize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    self._finish()
+                    return
+                self._append(*item)
+            if self._segment is not None:
+                self._segment.flush()
+            self._flushed()
+
+    def _append(self, t, chunk):
+        offset = keyframe_offset(chunk)
+        self._remember_tables(chunk)
+        if offset is not None:
+            if self._segment is None or t - self._segment_started >= self.segment_s:
+                if self._segment is not None:
+                    self._write(chunk[:offset])
+                self._open_segment(t)
+                chunk = chunk[offset:]
+                offset = 0
+            self._index_keyframe(t, self._offset + offset)
+        if self._segment is not None:
+            self._write(chunk)
+
+    def _write(self, data):
+        self._segment.write(data)
+        self._offset += len(data)
+        self.bytes += len(data)
+
+    def _index_keyframe(self, t, offset):
+        csv.writer(self._index).writerow([f"{t:.3f}", self.segments, offset])
+        self.keyframes += 1
+
+    def _flushed(self):
+        """Called on the writer thread once a batch is on disk"""
+        self._index.flush()
+
+    def _finish(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._index.close()
+        with self._lock:
+            self._events.close()
+
+    def _remember_tables(self, chunk):
+        for offset in range(0, len(chunk), TS_PACKET_SIZE):
+            packet = chunk[offset:offset + TS_PACKET_SIZE]
+            if len(packet) < TS_PACKET_SIZE or packet[0] != 0x47:
+                continue
+            pid = _pid(packet)
+            if pid == 0 and packet[1] & 0x40:
+                self._tables[0] = packet
+                self._pmt_pid = _pmt_pid(packet) or self._pmt_pid
+            elif pid == self._pmt_pid and packet[1] & 0x40:
+                self._tables[pid] = packet
+
+    def _open_segment(self, t):
+        if self._segment is not None:
+            self._segment.close()
+        self.segments += 1
+        self._segment = open(os.path.join(self.directory, SEGMENT_NAME.format(self.segments)), 'wb',
+                             buffering=COPY_BLOCK)
+        self._segment_started = t
+        header = b''.join(self._tables.values())
+        self._segment.write(header)
+        self._offset = len(header)
+        self.bytes += len(header)
+
+    def close(self, timeout=10.0):
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "seconds": self.now(),
+            "bytes": self.bytes,
+            "segments": self.segments,
+            "keyframes": self.keyframes,
+            "events": self.events,
+            "queued": self.queue.qsize(),
+            "dropped_chunks": self.dropped_chunks
+        }
+
+
+def load_index(directory):
+    with open(os.path.join(directory, INDEX_FILE), newline='') as f:
+        return [Keyframe(float(t), int(segment), int(offset)) for t, segment, offset in csv.reader(f)]
+
+
+def load_events(directory):
+    path = os.path.join(directory, EVENTS_FILE)
+    if not os.path.exists(path):
+        return []
+    # Rows and their "undo" rows cancel out, so an undone then redone event is back in once
+    counts = Counter()
+    with open(path, newline='') as f:
+        for t, label, *undo in csv.reader(f):
+            counts[(float(t), label)] += -1 if undo else 1
+    return [event for event, count in counts.items() for _ in range(count)]
+
+
+def plan_highlights(index, events, preroll_s=8.0, postroll_s=5.0):
+    """Keyframe-aligned (start, end) index positions around each event, overlaps merged"""
+    times = [k.t for k in index]
+    highlights = []
+    for t, label in sorted(events):
+        # From the last keyframe before the preroll to the first one after the postroll
+        start = max(0, bisect.bisect_right(times, t - preroll_s) - 1)
+        end = min(len(index), bisect.bisect_left(times, t + postroll_s) + 1)
+        if end - start < 2:
+            continue
+        if highlights and start <= highlights[-1].end - 1:
+            previous = highlights.pop()
+            highlights.append(Highlight(previous.labels + [label], previous.start, max(previous.end, end)))
+        else:
+            highlights.append(Highlight([label], start, end))
+    return highlights
+
+
+def _copy_range(src, dst, start, end):
+    src.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        block = src.read(COPY_BLOCK if remaining is None else min(COPY_BLOCK, remaining))
+        if not block:
+            break
+        dst.write(block)
+        if remaining is not None:
+            remaining -= len(block)
+
+
+def segment_headers(index):
+    """Size of each segment's PAT/PMT header: everything before its first keyframe"""
+    headers = {}
+    for keyframe in index:
+        headers.setdefault(keyframe.segment, keyframe.offset)
+    return headers
+
+
+def cut_clip(directory, index, highlight, path, headers):
+    """Copy the bytes between two keyframes (possibly across segments) into a standalone .ts"""
+    first, last = index[highlight.start], index[highlight.end - 1]
+    with open(path, 'wb') as out:
+        for segment in range(first.segment, last.segment + 1):
+            with open(os.path.join(directory, SEGMENT_NAME.format(segment)), 'rb') as src:
+                start = 0
+                if segment == first.segment:
+                    # The PAT/PMT first, so the clip decodes on its own, even from the segment's first keyframe
+                    _copy_range(src, out, 0, headers[segment])
+                    start = max(first.offset, headers[segment])
+                end = last.offset if segment == last.segment else None
+                _copy_range(src, out, start, end)
+    return path
+
+
+def extract_highlights(directory, output=None, preroll_s=8.0, postroll_s=5.0, labels=None):
+    """Cut a clip around every logged event and join them into a reel, all with stream copy.
+
+    Returns (reel path or None, clip paths). Segments are read in blocks,
+    so this works the same on a full day's recording.
+    """
+    start = time.perf_counter()
+    # Segments a capped spool has evicted can't be cut from
+    present = set(os.listdir(directory))
+    index = [k for k in load_index(directory) if SEGMENT_NAME.format(k.segment) in present]
+    events = [(t, label) for t, label in load_events(directory) if labels is None or label in labels]
+    highlights = plan_highlights(index, events, preroll_s, postroll_s)
+    headers = segment_headers(index)
+    clip_dir = os.path.join(directory, "highlights")
+    os.makedirs(clip_dir, exist_ok=True)
+    clips = []
+    for n, highlight in enumerate(highlights, 1):
+        name = re.sub(r'[^A-Za-z0-9]+', '-', "_".join(highlight.labels))[:60]
+        clips.append(cut_clip(directory, index, highlight, os.path.join(clip_dir, f"clip_{n:03d}_{name}.ts"),
+                              headers))
+    logger.info(f"Cut {len(clips)} clips from {len(events)} events in {time.perf_counter() - start:.1f} s")
+    if not clips:
+        return None, clips
+
+    output = output or os.path.join(directory, "highlights.mp4")
+    if shutil.which('ffmpeg') is None:
+        logger.warning("ffmpeg not found; clips were cut but not joined")
+        return None, clips
+    playlist = os.path.join(clip_dir, "concat.txt")
+    with open(playlist, 'w') as f:
+        for clip in clips:
+            f.write(f"file '{os.path.abspath(clip)}'\n")
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'concat', '-safe', '0', '-i', playlist,
+                    '-c', 'copy', '-movflags', '+faststart', output],
+                   check=True, capture_output=True)
+    logger.info(f"Highlights reel {output} ready {time.perf_counter() - start:.1f} s after starting")
+    return output, clips
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cut a highlights reel from a recorded match")
+    parser.add_argument("recording", help="recording directory (holds index.csv, events.csv and segments)")
+    parser.add_argument("--output", help="reel path (default: <recording>/highlights.mp4)")
+    parser.add_argument("--preroll", type=float, default=8.0)
+    parser.add_argument("--postroll", type=float, default=5.0)
+    parser.add_argument("--only", nargs="*", help="event labels to include (default: all)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    reel, clips = extract_highlights(args.recording, args.output, args.preroll, args.postroll, args.only)
+    print(reel or f"{len(clips)} clips in {os.path.join(args.recording, 'highlights')}")
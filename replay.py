@@ -0,0 +1,229 @@
+import bisect
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+
+from compositor import FrameReader, FRAME_WIDTH, FRAME_HEIGHT, FRAME_RATE
+from events import DelayTracker
+from fanout import TS_PACKET_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def keyframe_offset(chunk):
+    """Offset of the first TS packet in chunk that starts a video keyframe, or None.
+
+    FFmpeg's MPEG-TS muxer sets the random access indicator on the packet
+    that starts each keyframe's PES packet; audio frames get it too, so the
+    PES stream id (0xE0-0xEF is video) tells them apart.
+    """
+    for offset in range(0, len(chunk) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        b1, b3 = chunk[offset + 1], chunk[offset + 3]
+        # payload_unit_start, and an adaptation field with random_access_indicator set
+        if not (b1 & 0x40 and b3 & 0x20 and chunk[offset + 4] and chunk[offset + 5] & 0x40):
+            continue
+        pes = offset + 5 + chunk[offset + 4]
+        if chunk[pes:pes + 3] == b'\0\0\1' and 0xE0 <= chunk[pes + 3] <= 0xEF:
+            return offset
+    return None
+
+
+class ReplayBuffer:
+    """Rolling window of the encoded program feed, for instant replays.
+
+    append() is fed the shared encoder's MPEG-TS output chunk by chunk (see
+    FanoutEncoder's tap); the compressed chunks are kept in a ring bounded
+    by both seconds and max_bytes, with the keyframes in each chunk indexed
+    as they arrive. mark() drops a labelled marker at the current time
+    (unmark() takes it back when the scoring action is undone), and
+    clip() cuts the stretch around one, starting on a keyframe so it
+    decodes cleanly. Timestamps are perf_counter arrival times.
+    """
+
+    def __init__(self, seconds=60.0, max_bytes=128 * 1024 * 1024):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.chunks = deque()  # (arrival time, keyframe offset or None, data)
+        self.keyframes = deque()  # arrival times of chunks holding a keyframe
+        self.markers = deque()  # (time, label)
+        self.bytes = 0
+        self.evicted_bytes = 0
+        self.append_time = DelayTracker()
+        self.lock = threading.Lock()
+
+    def append(self, chunk, now=None):
+        start = time.perf_counter()
+        now = start if now is None else now
+        offset = keyframe_offset(chunk)
+        with self.lock:
+            self.chunks.append((now, offset, chunk))
+            if offset is not None:
+                self.keyframes.append(now)
+            self.bytes += len(chunk)
+            self._evict(now)
+        self.append_time.record((time.perf_counter() - start) * 1000)
+
+    def _evict(self, now):
+        chunks = self.chunks
+        while chunks and (self.bytes > self.max_bytes or now - chunks[0][0] > self.seconds):
+            t, offset, data = chunks.popleft()
+            self.bytes -= len(data)
+            self.evicted_bytes += len(data)
+            if offset is not None:
+                self.keyframes.popleft()
+        oldest = chunks[0][0] if chunks else now
+        while self.markers and self.markers[0][0] < oldest:
+            self.markers.popleft()
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.keyframes.clear()
+            self.markers.clear()
+            self.bytes = 0
+
+    def mark(self, label, now=None):
+        """Drop a marker (e.g. "WICKET") at the current point of the feed; returns its time"""
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            self.markers.append((now, label))
+        logger.info(f"Replay marker: {label}")
+        return now
+
+    def unmark(self, t, label):
+        """Remove a marker dropped by mark(), if it is still in the window"""
+        with self.lock:
+            try:
+                self.markers.remove((t, label))
+            except ValueError:
+                pass
+
+    def last_marker(self):
+        with self.lock:
+            return self.markers[-1] if self.markers else None
+
+    def clip(self, start, end=None):
+        """MPEG-TS bytes from the last keyframe at or before start up to end (default: now)"""
+        with self.lock:
+            if not self.keyframes:
+                return b''
+            # Fall back to the oldest keyframe if start is before the window
+            index = max(0, bisect.bisect_right(self.keyframes, start) - 1)
+            first = self.keyframes[index]
+            parts = []
+            for t, offset, data in self.chunks:
+                if t < first:
+                    continue
+                if end is not None and t > end:
+                    break
+                parts.append(data[offset:] if t == first and offset else data)
+        return b''.join(parts)
+
+    def clip_around(self, marker_time, preroll_s=6.0, postroll_s=4.0):
+        return self.clip(marker_time - preroll_s, marker_time + postroll_s)
+
+    def held_seconds(self):
+        with self.lock:
+            return self.chunks[-1][0] - self.chunks[0][0] if self.chunks else 0.0
+
+    def stats(self):
+        return {
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "seconds": self.held_seconds(),
+            "max_seconds": self.seconds,
+            "keyframes": len(self.keyframes),
+            "markers": len(self.markers),
+            "evicted_bytes": self.evicted_bytes,
+            "append_time": self.append_time.summary()
+        }
+
+
+class ReplayReader(FrameReader):
+    """Decodes a replay clip into program frames at normal or slow speed.
+
+    Drop-in for a camera's FrameReader in CompositingPipeline.set_reader.
+    The clip is fed to FFmpeg on stdin and decoded as fast as the pipe
+    allows; frames are paced out at fps, so with speed=0.5 every source
+    frame is shown twice as long. The frames already carry the scoreboard
+    from the moment they were encoded, so they aren't composited again.
+    on_end(reader) is called once the last frame has been read.
+    """
+
+    composited = True
+
+    def __init__(self, clip, speed=1.0, on_end=None, width=FRAME_WIDTH, height=FRAME_HEIGHT, fps=FRAME_RATE):
+        super().__init__("replay", width, height, fps, realtime=False, paced=True)
+        self.clip = clip
+        self.speed = speed
+        self.on_end = on_end
+
+    def command(self):
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'mpegts', '-i', 'pipe:0',
+            '-map', '0:v:0',
+            '-vf', f'setpts=PTS/{self.speed},scale={self.width}:{self.height},fps={self.fps}',
+            '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1'
+        ]
+
+    def start(self):
+        if self.process is not None:
+            return
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._read_loop, name="replay-reader", daemon=True).start()
+        threading.Thread(target=self._feed, name="replay-feed", daemon=True).start()
+
+    def _feed(self):
+        try:
+            self.process.stdin.write(self.clip)
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        self.process.wait()
+        with self._cond:
+            self._cond.wait_for(lambda: self.ended)
+        logger.info(f"Replay finished: {self.seq} frames at {self.speed}x")
+        if self.on_end:
+            self.on_end(self)
+
+
+if __name__ == "__main__":
+    # Append/index cost and memory bound for a 6 Mb/s program feed
+    import os
+
+    chunk_packets = 348
+    rate_bps = 6_000_000
+    chunks_per_s = rate_bps / 8 / (TS_PACKET_SIZE * chunk_packets)
+
+    def packet(keyframe=False):
+        if keyframe:
+            header = bytes([0x47, 0x41, 0x00, 0x30, 0x07, 0x50]) + b'\0' * 6 + b'\0\0\1\xe0'
+        else:
+            header = bytes([0x47, 0x01, 0x00, 0x10])
+        return header + os.urandom(TS_PACKET_SIZE - len(header))
+
+    plain = b''.join(packet() for _ in range(chunk_packets))
+    with_keyframe = packet(True) + plain[TS_PACKET_SIZE:]
+    buffer = ReplayBuffer(seconds=60, max_bytes=32 * 1024 * 1024)
+    simulated_s = 300
+    count = int(simulated_s * chunks_per_s)
+    gop = int(2 * chunks_per_s)
+    start = time.perf_counter()
+    for i in range(count):
+        now = i / chunks_per_s
+        buffer.append(with_keyframe if i % gop == 0 else plain, now=now)
+        if i % int(30 * chunks_per_s) == 0:
+            buffer.mark("FOUR", now=now)
+    elapsed = time.perf_counter() - start
+    stats = buffer.stats()
+    clip = buffer.clip_around(buffer.last_marker()[0])
+    print(f"{count} chunks ({simulated_s} s of feed) appended in {elapsed * 1000:.0f} ms, "
+          f"p95 {stats['append_time']['p95_ms']:.3f} ms, max {stats['append_time']['max_ms']:.3f} ms per chunk")
+    print(f"held {stats['bytes'] / 1e6:.1f} MB (cap {stats['max_bytes'] / 1e6:.1f} MB) = {stats['seconds']:.1f} s, "
+          f"{stats['keyframes']} keyframes, {stats['markers']} markers, {stats['evicted_bytes'] / 1e6:.0f} MB evicted")
+    print(f"10 s clip around the last marker: {len(clip) / 1e6:.1f} MB, starts on a keyframe: "
+          f"{keyframe_offset(clip[:TS_PACKET_SIZE]) == 0}")
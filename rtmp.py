@@ -1,9 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import vlc
-import time
-import os
 import logging
+from camera import CameraEngine
+from match_engine import MatchEngine, overs_str
 
 class CricketScoreboardApp:
     def __init__(self, root):
@@ -17,18 +17,7 @@ class CricketScoreboardApp:
         self.logger = logging.getLogger(__name__)
         
         # Match state
-        self.match = {
-            'team1': {"name": "Team A", "runs": 0, "wickets": 0, "overs": 0.0, "extras": {"wides": 0, "noballs": 0}},
-            'team2': {"name": "Team B", "runs": 0, "wickets": 0, "overs": 0.0, "extras": {"wides": 0, "noballs": 0}},
-            'current_batting': 1,
-            'max_overs': 20
-        }
-        
-        self.batsmen = [
-            {"name": "Batsman 1", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False},
-            {"name": "Batsman 2", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False}
-        ]
-        self.bowler = {"name": "Bowler 1", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
+        self.engine = MatchEngine("Team A", "Team B", max_overs=20)
         
         # Stream configuration
         self.streams = {
@@ -37,11 +26,11 @@ class CricketScoreboardApp:
             "Wide Angle": "rtmp://your.stream3.url/live"
         }
         self.stream_var = tk.StringVar(value=list(self.streams.keys())[0])  # Moved here
+        self.max_warm_cameras = 3
         
         # VLC setup
         try:
             self.vlc_instance = vlc.Instance('--no-xlib')
-            self.player = self.vlc_instance.media_player_new()
         except Exception as e:
             self.logger.error(f"VLC initialization failed: {e}")
             messagebox.showerror("Error", "Failed to initialize VLC player")
@@ -62,13 +51,19 @@ class CricketScoreboardApp:
         self.video_canvas = tk.Canvas(self.video_frame, bg='black', highlightthickness=0)
         self.video_canvas.pack(fill=tk.BOTH, expand=True)
         
+        # Cameras stay connected in standby so switching is instant
+        self.cameras = CameraEngine(self.vlc_instance, self.video_canvas, self.streams,
+                                    max_warm=self.max_warm_cameras)
+        
         # Scoreboard overlay
         self.setup_scoreboard_overlay()
+        self.cameras.keep_on_top.append(self.score_frame)
         
         # Control panel
         self.setup_controls()
         
         # Initialize stream
+        self.cameras.warm_all()
         self.change_stream()
 
     def setup_scoreboard_overlay(self):
@@ -135,79 +130,46 @@ class CricketScoreboardApp:
             self.video_canvas.itemconfigure(self.score_window, state='hidden')
 
     def update_scoreboard(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        overs_str = f"{int(team['overs'])}.{int((team['overs'] % 1) * 6)}"
-        self.score_var.set(f"{team['name']} {team['runs']}/{team['wickets']} ({overs_str}/{self.match['max_overs']})")
-        
-        self.bat1_var.set(f"{self.batsmen[0]['name']}{' *' if not self.batsmen[0]['out'] else ''}: "
-                         f"{self.batsmen[0]['runs']} ({self.batsmen[0]['balls']})")
-        self.bat2_var.set(f"{self.batsmen[1]['name']}{' *' if not self.batsmen[1]['out'] else ''}: "
-                         f"{self.batsmen[1]['runs']} ({self.batsmen[1]['balls']})")
-        
-        overs_str = f"{int(self.bowler['overs'])}.{int((self.bowler['overs'] % 1) * 6)}"
-        self.bowler_var.set(f"{self.bowler['name']}: {overs_str} - {self.bowler['maidens']} - "
-                          f"{self.bowler['runs']} - {self.bowler['wickets']}")
-        
-        extras = team['extras']
-        self.extras_var.set(f"Extras: {extras['wides'] + extras['noballs']} "
-                          f"(W:{extras['wides']} NB:{extras['noballs']})")
-
-    def add_runs(self, runs):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['runs'] += runs
+        innings = self.engine.batting
+        self.score_var.set(f"{innings.team} {innings.runs}/{innings.wickets} "
+                           f"({overs_str(innings.balls)}/{self.engine.max_overs})")
         
-        striker = next((b for b in self.batsmen if not b['out']), self.batsmen[0])
-        striker['runs'] += runs
-        striker['balls'] += 1
-        if runs == 4: striker['4s'] += 1
-        elif runs == 6: striker['6s'] += 1
+        striker = innings.batters[innings.striker]
+        non_striker = innings.batters[innings.non_striker]
+        self.bat1_var.set(f"{striker.name} *: {striker.runs} ({striker.balls})")
+        self.bat2_var.set(f"{non_striker.name}: {non_striker.runs} ({non_striker.balls})")
         
-        self.bowler['runs'] += runs
-        self.increment_ball()
-        self.update_scoreboard()
+        bowler = innings.current_bowler()
+        self.bowler_var.set(f"{bowler.name}: {overs_str(bowler.balls)} - {bowler.maidens} - "
+                          f"{bowler.runs} - {bowler.wickets}")
+        
+        _, wides, noballs, _, _ = innings.extras
+        self.extras_var.set(f"Extras: {wides + noballs} (W:{wides} NB:{noballs})")
+
+    def add_runs(self, runs):
+        self.engine.add_runs(runs)
+        self.after_ball()
 
     def add_wicket(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['wickets'] += 1
-        
-        striker = next((b for b in self.batsmen if not b['out']), self.batsmen[0])
-        striker['out'] = True
-        striker['balls'] += 1
-        
-        self.bowler['wickets'] += 1
-        self.increment_ball()
-        self.update_scoreboard()
-        
-        if team['wickets'] == 10:
-            self.switch_innings()
+        self.engine.add_wicket()
+        self.after_ball()
 
     def add_extra(self, extra_type):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['runs'] += 1
-        team['extras'][extra_type] += 1
-        self.bowler['runs'] += 1
-        self.update_scoreboard()
+        self.engine.add_extra(extra_type)
+        self.after_ball()
 
-    def increment_ball(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['overs'] += 0.1
-        self.bowler['overs'] += 0.1
-        if team['overs'] >= self.match['max_overs']:
+    def after_ball(self):
+        if self.engine.innings_complete() and self.engine.current == 0:
             self.switch_innings()
+        else:
+            self.update_scoreboard()
 
     def next_over(self):
-        if self.bowler['runs'] == 0:
-            self.bowler['maidens'] += 1
-        self.bowler = {"name": f"Bowler {int(time.time())}", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
+        self.engine.new_bowler(f"Bowler {len(self.engine.batting.bowlers) + 1}")
         self.update_scoreboard()
 
     def switch_innings(self):
-        self.match['current_batting'] = 2 if self.match['current_batting'] == 1 else 1
-        self.batsmen = [
-            {"name": f"Batsman {i}", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False}
-            for i in range(2)
-        ]
-        self.bowler = {"name": "Bowler 1", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
+        self.engine.switch_innings()
         self.update_scoreboard()
 
     def change_stream(self, event=None):
@@ -216,24 +178,14 @@ class CricketScoreboardApp:
             if not selected or selected not in self.streams:
                 return
                 
-            self.player.stop()
-            media = self.vlc_instance.media_new(self.streams[selected])
-            self.player.set_media(media)
-            
-            if os.name == 'nt':
-                self.player.set_hwnd(self.video_canvas.winfo_id())
-            else:
-                self.player.set_xwindow(self.video_canvas.winfo_id())
-                
-            if self.player.play() == -1:
-                raise Exception("Failed to play stream")
+            self.cameras.switch(selected)
                 
         except Exception as e:
             self.logger.error(f"Stream error: {e}")
             messagebox.showerror("Stream Error", f"Failed to load stream: {e}")
 
     def on_closing(self):
-        self.player.stop()
+        self.cameras.stop_all()
         self.root.destroy()
 
 if __name__ == "__main__":
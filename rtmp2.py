@@ -2,11 +2,12 @@ import os
 import tkinter as tk
 from tkinter import ttk, messagebox
 import vlc
-import time
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-import cv2
-import numpy as np
 import threading
+from overlay import OverlayRenderer
+from events import ScoreEvents
+from compositor import OverlayCompositor, FrameReader, CompositingPipeline, raw_video_input_args
+from fanout import FanoutEncoder
+from match_engine import MatchEngine, overs_str
 
 class CricketBroadcastSoftware:
     def __init__(self, root):
@@ -15,14 +16,8 @@ class CricketBroadcastSoftware:
         self.root.geometry("1200x800")
 
         # Match variables
-        self.team1 = {"name": "INDIA", "runs": 0, "wickets": 0, "overs": 0.0, "extras": 0}
-        self.team2 = {"name": "AUSTRALIA", "runs": 0, "wickets": 0, "overs": 0.0, "extras": 0}
-        self.current_batting = 1
-        self.batsmen = [
-            {"name": "Rohit Sharma", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False},
-            {"name": "Virat Kohli", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False}
-        ]
-        self.bowler = {"name": "Mitchell Starc", "overs": 0, "maidens": 0, "runs": 0, "wickets": 0}
+        self.engine = MatchEngine("INDIA", "AUSTRALIA", batters1=["Rohit Sharma", "Virat Kohli"],
+                                  bowler1="Mitchell Starc")
 
         # RTMP Sources
         self.rtmp_sources = {
@@ -37,6 +32,20 @@ class CricketBroadcastSoftware:
         self.vlc_instance = vlc.Instance(["--no-xlib", "--quiet"])
         self.player = self.vlc_instance.media_player_new()
         self.overlay_image = None
+        self.overlay_renderer = OverlayRenderer(
+            (400, 100),
+            fields={
+                "score": (0, 0, 400, 34, 20, (255, 255, 255, 255)),
+                "batsmen": (0, 34, 400, 22, 14, (255, 255, 255, 255)),
+                "bowler": (0, 56, 400, 22, 14, (255, 255, 255, 255)),
+                "extras": (0, 78, 400, 22, 14, (255, 255, 0, 255))
+            },
+            panels=[((0, 0, 399, 33), (0, 0, 0, 170)), ((0, 34, 399, 99), (0, 0, 0, 120))]
+        )
+        self.compositor = OverlayCompositor()
+        self.score_events = ScoreEvents()
+        self.pipeline = None
+        self.encoder = None
 
         # GUI Setup
         self.create_widgets()
@@ -96,6 +105,9 @@ class CricketBroadcastSoftware:
         tk.Button(stream_frame, text="Start Broadcast", command=self.start_broadcast).pack(fill=tk.X, pady=2)
         tk.Button(stream_frame, text="Stop Broadcast", command=self.stop_broadcast).pack(fill=tk.X, pady=2)
 
+        self.delay_label = tk.Label(stream_frame, text="Score-to-screen: -")
+        self.delay_label.pack(pady=2)
+
         # Initialize first stream
         if self.rtmp_sources:
             self.source_var.set(list(self.rtmp_sources.keys())[0])
@@ -116,28 +128,34 @@ class CricketBroadcastSoftware:
                 
             self.player.play()
 
-    def update_scoreboard(self):
+    def update_scoreboard(self, kind="update"):
         """Update the scoreboard display"""
-        team = self.team1 if self.current_batting == 1 else self.team2
-        score_text = f"{team['name']}: {team['runs']}/{team['wickets']} ({team['overs']} ov)"
+        innings = self.engine.batting
+        score_text = f"{innings.team}: {innings.runs}/{innings.wickets} ({overs_str(innings.balls)} ov)"
         self.score_label.config(text=score_text)
 
-        # Generate overlay image (for broadcasting)
-        self.generate_overlay()
-
-    def generate_overlay(self):
-        """Create a transparent scoreboard overlay"""
-        width, height = 400, 100
-        overlay = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
-        font = ImageFont.truetype("arial.ttf", 20)
-
-        team = self.team1 if self.current_batting == 1 else self.team2
-        score_text = f"{team['name']} {team['runs']}/{team['wickets']} ({team['overs']} ov)"
-        draw.text((10, 10), score_text, font=font, fill=(255, 255, 255, 255))
+        # Hand the change to the broadcast thread (for the burned-in overlay)
+        if self.streaming:
+            self.score_events.publish(kind, self.overlay_fields())
+
+    def overlay_fields(self):
+        """Snapshot of the overlay text, taken on the Tk thread"""
+        innings = self.engine.batting
+        bat1 = innings.batters[innings.striker]
+        bat2 = innings.batters[innings.non_striker]
+        bowler = innings.current_bowler()
+        return {
+            "score": f"{innings.team} {innings.runs}/{innings.wickets} ({overs_str(innings.balls)} ov)",
+            "batsmen": f"{bat1.name} {bat1.runs} ({bat1.balls})   {bat2.name} {bat2.runs} ({bat2.balls})",
+            "bowler": f"{bowler.name} {bowler.figures()}",
+            "extras": f"Extras {innings.extras_total()}"
+        }
 
-        # Convert to OpenCV format (for streaming)
-        self.overlay_image = cv2.cvtColor(np.array(overlay), cv2.COLOR_RGBA2BGRA)
+    def generate_overlay(self, fields):
+        """Update the transparent scoreboard overlay, redrawing only changed fields"""
+        self.overlay_image = self.overlay_renderer.render(fields)
+        if self.overlay_renderer.changed:
+            self.compositor.set_overlay(self.overlay_image)
 
     def start_broadcast(self):
         """Start streaming with overlay"""
@@ -152,61 +170,66 @@ class CricketBroadcastSoftware:
 
         # Start streaming thread
         self.streaming = True
-        threading.Thread(target=self.stream_with_overlay, args=(rtmp_url,)).start()
-
-    def stream_with_overlay(self, rtmp_url):
-        """Broadcast with scoreboard overlay"""
-        stream_options = f":sout=#transcode{{vcodec=h264,vb=2500}}:duplicate{{dst=rtp{{dst={rtmp_url}}}}}"
-        media = self.vlc_instance.media_new(self.current_stream, stream_options)
-        self.player.set_media(media)
-        self.player.play()
-
+        threading.Thread(target=self.stream_with_overlay, args=(rtmp_url, self.overlay_fields())).start()
+        self.refresh_delay_label()
+
+    def refresh_delay_label(self):
+        """Show score-to-screen delay while broadcasting"""
+        delay = self.score_events.delay.summary()
+        if delay["count"]:
+            self.delay_label.config(text=f"Score-to-screen: {delay['last_ms']:.1f} ms (p95 {delay['p95_ms']:.1f} ms)")
+        if self.streaming:
+            self.root.after(1000, self.refresh_delay_label)
+
+    def stream_with_overlay(self, rtmp_url, fields):
+        """Broadcast with scoreboard overlay burned into every frame"""
+        self.generate_overlay(fields)
+        reader = FrameReader(self.current_stream)
+        self.encoder = FanoutEncoder(raw_video_input_args(audio_source=self.current_stream),
+                                     video_args=['-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '2500k'],
+                                     frame_input=True)
+        self.pipeline = CompositingPipeline(reader, self.compositor, self.encoder)
+        self.pipeline.start()
+        self.encoder.add_destination("Broadcast", rtmp_url)
+
+        # Re-render once per burst of score changes, as soon as it arrives
         while self.streaming:
-            self.generate_overlay()
-            time.sleep(1)
+            burst = self.score_events.wait_burst(timeout=1.0)
+            if burst is None:
+                continue
+            first_ts, kinds, fields = burst
+            self.generate_overlay(fields)
+            self.score_events.mark_on_screen(first_ts)
 
     def stop_broadcast(self):
         """Stop streaming"""
         self.streaming = False
-        self.player.stop()
+        self.score_events.close()
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.encoder:
+            self.encoder.stop()
 
     # Scoreboard Functions
     def add_runs(self, runs):
-        team = self.team1 if self.current_batting == 1 else self.team2
-        team['runs'] += runs
-        self.batsmen[0]['runs'] += runs
-        self.batsmen[0]['balls'] += 1
-        if runs == 4:
-            self.batsmen[0]['4s'] += 1
-        elif runs == 6:
-            self.batsmen[0]['6s'] += 1
-        self.bowler['runs'] += runs
-        self.update_scoreboard()
+        self.engine.add_runs(runs)
+        self.update_scoreboard("runs")
 
     def add_wicket(self):
-        team = self.team1 if self.current_batting == 1 else self.team2
-        team['wickets'] += 1
-        self.bowler['wickets'] += 1
-        self.batsmen[0]['out'] = True
-        self.update_scoreboard()
+        self.engine.add_wicket()
+        self.update_scoreboard("wicket")
 
     def next_over(self):
-        team = self.team1 if self.current_batting == 1 else self.team2
-        team['overs'] += 1
-        if self.bowler['runs'] == 0:
-            self.bowler['maidens'] += 1
-        self.update_scoreboard()
+        self.engine.new_bowler(f"Bowler {len(self.engine.batting.bowlers) + 1}")
+        self.update_scoreboard("over")
 
     def switch_innings(self):
-        self.current_batting = 2 if self.current_batting == 1 else 1
-        self.update_scoreboard()
+        self.engine.switch_innings()
+        self.update_scoreboard("innings")
 
     def add_extra(self):
-        team = self.team1 if self.current_batting == 1 else self.team2
-        team['runs'] += 1
-        team['extras'] += 1
-        self.bowler['runs'] += 1
-        self.update_scoreboard()
+        self.engine.add_extra("wides")
+        self.update_scoreboard("extra")
 
 if __name__ == "__main__":
     root = tk.Tk()
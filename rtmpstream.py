@@ -5,9 +5,34 @@ import time
 import os
 import logging
 import subprocess
-from threading import Thread
+import threading
+from fanout import FanoutEncoder, Relay, DEFAULT_VIDEO_ARGS, DEFAULT_AUDIO_ARGS
+from compositor import OverlayCompositor, CompositingPipeline, raw_video_input_args, FRAME_WIDTH, FRAME_HEIGHT, FRAME_RATE
+from overlay import ChartRenderer, scoreboard_renderer, scoreboard_overlay_values
+from telemetry import EncoderTelemetry, PROGRESS_ARGS
+from camera import CameraEngine
+from failover import FailoverMonitor
+from match_engine import MatchEngine
+from analytics import MatchAnalytics
+from journal import MatchJournal
+from score_server import ScoreServer, score_state
+from scoreboard import ScoreboardView, scoreboard_values
+from media_control import MediaWorker, StallMonitor
+from probe import ProbeCache, COPY_VIDEO_ARGS
+from governor import ResourceGovernor, AdmissionError
+from replay import ReplayBuffer, ReplayReader
+from recording import Recording, extract_highlights
+from spool import Spool, SpoolRelay
+from latency import LatencyProbe
+from metrics import (Metrics, MetricsServer, SamplingProfiler, timed, child_processes, process_usage,
+                     os_thread_count)
+from hls import HlsOrigin, ladder_output_args, ladder_pixel_rate, prepare_directory, local_address
+from bandwidth import BandwidthController, OutputSampler, RUNGS, rung_video_args, adaptable, sample_outputs
+from supervisor import StreamSupervisor, RUNNING, BACKOFF, ENDED, GAVE_UP
 
 class CricketScoreboardApp:
+    LOCAL_HLS = "Local HLS"
+
     def __init__(self, root):
         self.root = root
         self.root.title("Professional Cricket Broadcast Software")
@@ -17,22 +42,23 @@ class CricketScoreboardApp:
         # Setup logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        # Hot-path timings, loop lag and process usage for Prometheus on http://127.0.0.1:9108/metrics
+        self.metrics = Metrics()
+        self.metrics_port = 9108
+        self.profiler = SamplingProfiler()
         
-        # Match state
-        self.match = {
-            'team1': {"name": "Team A", "runs": 0, "wickets": 0, "overs": 0.0, "extras": {"wides": 0, "noballs": 0, "byes": 0, "legbyes": 0}},
-            'team2': {"name": "Team B", "runs": 0, "wickets": 0, "overs": 0.0, "extras": {"wides": 0, "noballs": 0, "byes": 0, "legbyes": 0}},
-            'current_batting': 1,
-            'max_overs': 20,
-            'target': 0,
-            'current_ball': 0
-        }
+        # Match state, recovered from the journal if the app went down mid-match
+        self.journal_path = "match_journal"
+        self.journal = MatchJournal(self.journal_path)
+        self.engine = self.journal.recover(self.new_engine)
+        # Worm, Manhattan and partnership series, kept current ball by ball
+        self.analytics = MatchAnalytics()
+        self.analytics.attach(self.engine)
         
-        self.batsmen = [
-            {"name": "Batsman 1", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False, "dismissal": ""},
-            {"name": "Batsman 2", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False, "dismissal": ""}
-        ]
-        self.bowler = {"name": "Bowler 1", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
+        # Live score push for browser/OBS overlays (http://localhost:8765/)
+        self.score_server_port = 8765
+        self.score_server = ScoreServer(port=self.score_server_port)
+        self.score_server.start_in_thread()
         
         # Stream configuration with fallback
         self.streams = {
@@ -42,7 +68,21 @@ class CricketScoreboardApp:
             "Wide Angle": "rtmp://your.stream3.url/live"
         }
         self.stream_var = tk.StringVar(value=list(self.streams.keys())[0])
+        self.max_warm_cameras = 3
+        # Instant replay: how much of the program feed is kept, and what a replay shows
+        self.replay_seconds = 90
+        self.replay_max_mb = 160
+        self.replay_preroll_s = 8.0
+        self.replay_postroll_s = 4.0
+        self.slow_motion_speed = 0.5
+        self.recordings_dir = "recordings"
+        # Store-and-forward: uploaders read the program back from a disk spool capped at this size
+        self.spool_max_gb = 50
+        # Adaptive-bitrate ladder for viewers on the ground's Wi-Fi
+        self.hls_dir = "hls"
+        self.hls_port = 8080
         self.stream_status_var = tk.StringVar(value="Not Connected")
+        self.player_playing = None
         
         # Streaming platforms
         self.streaming_platforms = {
@@ -51,18 +91,65 @@ class CricketScoreboardApp:
             "Twitter": {"rtmp": "", "key": "", "active": False}
         }
         self.ffmpeg_processes = {}
+        self.telemetry = EncoderTelemetry()
+        self.telemetry.start()
+        self.platform_stats = {}
+        self.fanout_mode = tk.BooleanVar(value=True)
+        self.fanout = None
+        self.fanout_starting = 0
+        self.burn_in = tk.BooleanVar(value=True)
+        self.passthrough = tk.BooleanVar(value=True)
+        self.adaptive_bitrate = tk.BooleanVar(value=True)
+        # The shared encoder feeds every platform, so following one weak uplink lowers them all
+        self.fanout_follow_weakest = tk.BooleanVar(value=True)
+        self.store_forward = tk.BooleanVar(value=True)
+        # Instrumentation: stamps the burned-in broadcast and traces it to a local verifier sink
+        self.measure_latency = tk.BooleanVar(value=False)
+        self.latency_port = 19350
+        self.latency = None
+        self.last_score_action = None
+        self.bandwidth = {}  # output -> (BandwidthController, respawn(rung) or None for fan-out relays)
+        self.samplers = {}  # output -> (process, OutputSampler)
+        self.resources_sampling = False
+        self.fanout_adapt = None  # (video_args, source height) the shared encoder's rungs derive from
+        self.fanout_applied_rung = 0
+        self.probes = ProbeCache()
+        self.probes.prefetch(self.streams.values())
+        self.governor = ResourceGovernor()
+        self.compositor = OverlayCompositor()
+        self.overlay_renderer = scoreboard_renderer()
+        self.charts = ChartRenderer()
+        self.chart_var = tk.StringVar(value="None")
+        self.chart_shown = None
+        self.pipeline = None
+        self.replay = ReplayBuffer(seconds=self.replay_seconds, max_bytes=self.replay_max_mb * 1024 * 1024)
+        self.replay_reader = None
+        self.record_program = tk.BooleanVar(value=True)
+        self.recording = None
+        self.last_recording_dir = None
+        # Markers each scoring action dropped, keyed by its position in the engine's log, so undo can take them back
+        self.event_markers = {}
+        self.undone_markers = {}
+        self.hls_origin = None
+        self.hls_process = None
         
         # VLC setup with improved parameters
         try:
             self.vlc_instance = vlc.Instance('--no-xlib', '--network-caching=1000', '--file-caching=1000', '--live-caching=1000')
-            self.player = self.vlc_instance.media_player_new()
-            self.player.event_manager().event_attach(vlc.EventType.MediaPlayerEncounteredError, self.stream_error_handler)
         except Exception as e:
             self.logger.error(f"VLC initialization failed: {e}")
             messagebox.showerror("Error", "Failed to initialize VLC player")
             return
+        
+        # libvlc and FFmpeg process control run here, never on the Tk thread
+        self.media = MediaWorker(self.root, on_error=self.media_error)
+        self.media.start()
+        self.supervisor = StreamSupervisor(notify=lambda *args: self.media.post(self.output_changed, *args))
+        self.stall_monitor = StallMonitor(self.root, histogram=self.metrics.histogram("tk_loop_lag_seconds"))
+        self.stall_monitor.start()
             
         self.setup_ui()
+        self.setup_metrics()
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def setup_ui(self):
@@ -75,11 +162,20 @@ class CricketScoreboardApp:
         self.video_canvas = tk.Canvas(self.video_frame, bg='black', highlightthickness=0)
         self.video_canvas.pack(fill=tk.BOTH, expand=True)
         
+        self.cameras = CameraEngine(self.vlc_instance, self.video_canvas, self.streams,
+                                    max_warm=self.max_warm_cameras, on_error=self.stream_error_handler,
+                                    media=self.media, on_state=self.player_state_changed)
+        self.failover = FailoverMonitor(self.root, self.cameras, "Fallback", on_change=self.failover_changed,
+                                        media=self.media)
+        
         self.setup_professional_scoreboard()
+        self.cameras.keep_on_top.append(self.score_frame)
         self.setup_controls()
         self.setup_streaming_controls()
         
+        self.cameras.warm_all()
         self.change_stream()
+        self.failover.start()
 
     def setup_professional_scoreboard(self):
         self.score_frame = tk.Frame(self.video_canvas, bg='#333333', bd=2, relief=tk.SUNKEN)
@@ -135,11 +231,31 @@ class CricketScoreboardApp:
         tk.Label(info_frame, textvariable=self.target_var, font=('Arial', 10), 
                 bg='#333333', fg='white').pack(side=tk.RIGHT, padx=5)
         
+        analytics_frame = tk.Frame(self.score_frame, bg='#333333')
+        analytics_frame.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.dots_var = tk.StringVar()
+        tk.Label(analytics_frame, textvariable=self.dots_var, font=('Arial', 10),
+                bg='#333333', fg='white').pack(side=tk.LEFT)
+        
+        self.projected_var = tk.StringVar()
+        tk.Label(analytics_frame, textvariable=self.projected_var, font=('Arial', 10),
+                bg='#333333', fg='white').pack(side=tk.RIGHT, padx=5)
+        
         self.show_score = tk.BooleanVar(value=True)
         tk.Checkbutton(self.score_frame, text="Show", variable=self.show_score, 
                       command=self.toggle_scoreboard, bg='#333333', fg='white',
                       selectcolor='#333333', activebackground='#333333').pack(pady=2)
         
+        self.scoreboard = ScoreboardView(self.root, {
+            "team": self.team_var, "score": self.score_var,
+            "bat1_name": self.bat1_name, "bat1_stats": self.bat1_stats,
+            "bat2_name": self.bat2_name, "bat2_stats": self.bat2_stats,
+            "bowler": self.bowler_var, "extras": self.extras_var,
+            "rr": self.rr_var, "target": self.target_var,
+            "dots": self.dots_var, "projected": self.projected_var
+        }, lambda: scoreboard_values(self.engine, self.analytics))
+        self.scoreboard.listeners.append(self.scoreboard_changed)
         self.update_scoreboard()
 
     def setup_controls(self):
@@ -147,8 +263,10 @@ class CricketScoreboardApp:
         control_frame.pack(fill=tk.X, pady=5)
         
         tk.Label(control_frame, text="Input:", bg='#2c3e50', fg='white').pack(side=tk.LEFT, padx=5)
-        ttk.Combobox(control_frame, textvariable=self.stream_var, 
-                    values=list(self.streams.keys()), state="readonly").pack(side=tk.LEFT, padx=5)
+        stream_dropdown = ttk.Combobox(control_frame, textvariable=self.stream_var, 
+                                     values=list(self.streams.keys()), state="readonly")
+        stream_dropdown.pack(side=tk.LEFT, padx=5)
+        stream_dropdown.bind("<<ComboboxSelected>>", self.change_stream)
         
         tk.Label(control_frame, textvariable=self.stream_status_var, bg='#2c3e50', fg='yellow').pack(side=tk.LEFT, padx=5)
         
@@ -158,7 +276,8 @@ class CricketScoreboardApp:
             ("6", lambda: self.add_runs(6)), ("Wicket", self.add_wicket),
             ("Wide", lambda: self.add_extra("wides")), ("NB", lambda: self.add_extra("noballs")),
             ("Bye", lambda: self.add_extra("byes")), ("LB", lambda: self.add_extra("legbyes")),
-            ("Over", self.next_over), ("Switch", self.switch_innings)
+            ("Over", self.next_over), ("Switch", self.switch_innings),
+            ("Undo", self.undo), ("Redo", self.redo), ("New Match", self.new_match)
         ]
         for text, cmd in buttons:
             tk.Button(control_frame, text=text, command=cmd, bg='#3498db', fg='white',
@@ -168,6 +287,36 @@ class CricketScoreboardApp:
         stream_frame = tk.LabelFrame(self.main_frame, text="Streaming Control", bg='#2c3e50', fg='white')
         stream_frame.pack(fill=tk.X, pady=5)
         
+        tk.Checkbutton(stream_frame, text="Single encode (fan-out to all platforms)", variable=self.fanout_mode,
+                      bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Burn scoreboard into broadcast (fan-out only)", variable=self.burn_in,
+                      bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Stream copy when the source is already H.264/AAC (no burn-in)",
+                      variable=self.passthrough, bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Adapt bitrate and resolution to each uplink",
+                      variable=self.adaptive_bitrate, bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Single encode follows the weakest uplink (lowers every platform)",
+                      variable=self.fanout_follow_weakest, bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Store and forward through a disk spool (implies single encode)",
+                      variable=self.store_forward, bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        tk.Checkbutton(stream_frame, text="Measure glass-to-glass latency (stamps the burned-in broadcast)",
+                      variable=self.measure_latency, bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(anchor='w')
+        
+        chart_frame = tk.Frame(stream_frame, bg='#2c3e50')
+        chart_frame.pack(anchor='w')
+        tk.Label(chart_frame, text="Chart under the burned-in scoreboard:", bg='#2c3e50', fg='white').pack(side=tk.LEFT)
+        chart_dropdown = ttk.Combobox(chart_frame, textvariable=self.chart_var, values=["None", *MatchAnalytics.CHARTS],
+                                      state="readonly", width=14)
+        chart_dropdown.pack(side=tk.LEFT, padx=5)
+        chart_dropdown.bind("<<ComboboxSelected>>", self.change_chart)
+        
         for platform in self.streaming_platforms:
             plat_frame = tk.Frame(stream_frame, bg='#2c3e50')
             plat_frame.pack(fill=tk.X, pady=2)
@@ -186,6 +335,221 @@ class CricketScoreboardApp:
                      bg='#2ecc71', fg='white').pack(side=tk.LEFT, padx=2)
             tk.Button(plat_frame, text="Stop", command=lambda p=platform: self.stop_streaming(p),
                      bg='#e74c3c', fg='white').pack(side=tk.LEFT, padx=2)
+            
+            self.platform_stats[platform] = tk.StringVar(value="Idle")
+            tk.Label(plat_frame, textvariable=self.platform_stats[platform], bg='#2c3e50', fg='#95a5a6',
+                    font=('Helvetica', 9)).pack(side=tk.LEFT, padx=5)
+        
+        self.encoder_stats = tk.StringVar(value="")
+        tk.Label(stream_frame, textvariable=self.encoder_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(anchor='w')
+        gui_frame = tk.Frame(stream_frame, bg='#2c3e50')
+        gui_frame.pack(fill=tk.X)
+        self.gui_stats = tk.StringVar(value="")
+        tk.Label(gui_frame, textvariable=self.gui_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(side=tk.LEFT)
+        tk.Button(gui_frame, text="Profile", command=self.toggle_profiler,
+                 bg='#7f8c8d', fg='white', font=('Helvetica', 8)).pack(side=tk.LEFT, padx=5)
+        self.profile_status = tk.StringVar(value="")
+        tk.Label(gui_frame, textvariable=self.profile_status, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(side=tk.LEFT)
+        self.cpu_stats = tk.StringVar(value="")
+        tk.Label(stream_frame, textvariable=self.cpu_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(anchor='w')
+        self.latency_stats = tk.StringVar(value="")
+        tk.Label(stream_frame, textvariable=self.latency_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(anchor='w')
+        
+        replay_frame = tk.Frame(stream_frame, bg='#2c3e50')
+        replay_frame.pack(fill=tk.X, pady=2)
+        tk.Button(replay_frame, text="Replay", command=lambda: self.play_replay(1.0),
+                 bg='#8e44ad', fg='white').pack(side=tk.LEFT, padx=2)
+        tk.Button(replay_frame, text="Slow-mo replay", command=lambda: self.play_replay(self.slow_motion_speed),
+                 bg='#8e44ad', fg='white').pack(side=tk.LEFT, padx=2)
+        tk.Button(replay_frame, text="Back to live", command=self.end_replay,
+                 bg='#8e44ad', fg='white').pack(side=tk.LEFT, padx=2)
+        tk.Checkbutton(replay_frame, text="Record", variable=self.record_program,
+                      bg='#2c3e50', fg='white', selectcolor='#2c3e50',
+                      activebackground='#2c3e50').pack(side=tk.LEFT, padx=2)
+        tk.Button(replay_frame, text="Highlights", command=self.make_highlights,
+                 bg='#8e44ad', fg='white').pack(side=tk.LEFT, padx=2)
+        self.highlight_status = tk.StringVar(value="")
+        tk.Label(replay_frame, textvariable=self.highlight_status, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(side=tk.LEFT, padx=5)
+        
+        hls_frame = tk.Frame(stream_frame, bg='#2c3e50')
+        hls_frame.pack(fill=tk.X, pady=2)
+        tk.Label(hls_frame, text="Ground Wi-Fi:", bg='#2c3e50', fg='white').pack(side=tk.LEFT)
+        tk.Button(hls_frame, text="Start", command=self.start_local_hls,
+                 bg='#2ecc71', fg='white').pack(side=tk.LEFT, padx=2)
+        tk.Button(hls_frame, text="Stop", command=self.stop_local_hls,
+                 bg='#e74c3c', fg='white').pack(side=tk.LEFT, padx=2)
+        self.hls_stats = tk.StringVar(value="Idle")
+        tk.Label(hls_frame, textvariable=self.hls_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(side=tk.LEFT, padx=5)
+        self.replay_stats = tk.StringVar(value="")
+        tk.Label(replay_frame, textvariable=self.replay_stats, bg='#2c3e50', fg='#95a5a6',
+                font=('Helvetica', 9)).pack(side=tk.LEFT, padx=5)
+        self.refresh_telemetry()
+
+    def format_telemetry(self, stats):
+        text = (f"{stats['fps']:.0f} fps  {stats['bitrate_kbps']:.0f} kb/s  {stats['speed']:.2f}x  "
+                f"drop {stats['drop_frames']}  dup {stats['dup_frames']}")
+        if stats['queue_depth']:
+            text += f"  queue {stats['queue_depth']}"
+        return text
+
+    def refresh_telemetry(self):
+        snapshot = self.telemetry.snapshot()
+        encoder = self.supervisor.stats(FanoutEncoder.ENCODER_NAME) if self.fanout else None
+        for platform, var in self.platform_stats.items():
+            stats = snapshot.get(platform)
+            supervised = self.supervisor.stats(platform)
+            if not self.streaming_platforms[platform]["active"]:
+                var.set(f"Gave up after {supervised['restarts']} restarts"
+                        if supervised and supervised['state'] == GAVE_UP else "Idle")
+            elif supervised and supervised['state'] == BACKOFF:
+                var.set(f"Dropped, reconnecting in {supervised['retry_in_s']:.0f} s "
+                        f"({supervised['restarts']} restarts)")
+            elif encoder and encoder['state'] == BACKOFF and isinstance(self.ffmpeg_processes.get(platform), Relay):
+                var.set(f"Shared encoder down, restarting in {encoder['retry_in_s']:.0f} s "
+                        f"({encoder['restarts']} restarts)")
+            elif stats and stats['running']:
+                text = self.format_telemetry(stats)
+                if platform in self.bandwidth:
+                    uplink = self.bandwidth[platform][0].stats()
+                    text += (f"  |  {uplink['rung']} {uplink['video_kbps']}k, uplink "
+                             f"{uplink['throughput_kbps'] / 1000:.1f} Mb/s, backlog {uplink['backlog_s']:.1f} s")
+                process = self.ffmpeg_processes.get(platform)
+                if isinstance(process, SpoolRelay) and process.reader.lag_seconds() >= 2:
+                    text += f"  |  catching up, {process.reader.lag_seconds():.0f} s behind live"
+                if supervised and supervised['restarts']:
+                    text += (f"  up {supervised['uptime_s'] / 60:.0f} min, {supervised['restarts']} restarts, "
+                             f"recover p50 {supervised['recover_time']['p50_ms'] / 1000:.1f} s")
+                var.set(text)
+            else:
+                var.set("Starting...")
+        shared = snapshot.get(FanoutEncoder.ENCODER_NAME)
+        if shared and shared['running']:
+            self.encoder_stats.set(f"Shared encoder: {self.format_telemetry(shared)}")
+        else:
+            self.encoder_stats.set("")
+        stalls = self.stall_monitor.stats()
+        media = self.media.stats()
+        self.gui_stats.set(f"GUI stall p95 {stalls['p95_ms']:.0f} ms, worst {stalls['worst_ms']:.0f} ms  |  "
+                           f"media queue {media['pending']}, slowest {media['slowest_ms']:.0f} ms")
+        profiler = self.profiler.stats()
+        if profiler['running']:
+            self.profile_status.set(f"Profiling: {profiler['samples']} samples, overhead {profiler['overhead']:.1%}")
+        cpu = self.governor.stats()
+        busy = f"{cpu['busy_cores']:.1f}" if cpu['busy_cores'] is not None else "?"
+        self.cpu_stats.set(f"CPU: {busy} of {cpu['cpus']} cores busy, {cpu['committed_cores']:.1f} committed to "
+                           f"{cpu['outputs']} outputs, headroom {max(cpu['headroom_cores'], 0):.1f} cores")
+        replay = self.replay.stats()
+        self.replay_stats.set(f"{'ON AIR  ' if self.replay_reader else ''}Replay buffer {replay['seconds']:.0f} s, "
+                              f"{replay['bytes'] / 1e6:.0f} of {replay['max_bytes'] / 1e6:.0f} MB, "
+                              f"{replay['markers']} markers" + self.recording_text())
+        if self.latency:
+            self.latency_stats.set(self.latency.text())
+        self.sample_resources()
+        self.update_hls_status(snapshot.get(self.LOCAL_HLS))
+        self.update_player_status()
+        self.root.after(1000, self.refresh_telemetry)
+
+    def setup_metrics(self):
+        metrics = self.metrics
+        metrics.describe("app_handler_seconds", "histogram", 
+                          "Time spent in scoring and camera handlers on the Tk thread")
+        metrics.describe("tk_loop_lag_seconds", "histogram", "How late the Tk event loop ran a 50 ms heartbeat")
+        metrics.describe("app_threads", "gauge", "Threads in the app: python ones, and all OS threads")
+        metrics.describe("child_cpu_seconds_total", "counter", "CPU time of each FFmpeg (or other) child process")
+        metrics.describe("child_rss_bytes", "gauge", "Resident memory of each child process")
+        metrics.describe("vlc_player_transitions_total", "counter", "VLC player state changes per camera")
+        metrics.describe("vlc_player_playing", "gauge", "1 while a camera's VLC player is playing")
+        metrics.describe("media_queue_pending", "gauge", "Commands waiting for the media worker")
+        metrics.describe("profiler_running", "gauge", "1 while the sampling profiler runs")
+        metrics.describe("profiler_overhead_ratio", "gauge", "Share of wall time the profiler spent sampling")
+        metrics.collector(self.collect_metrics)
+        self.metrics_server = MetricsServer(metrics, self.profiler, port=self.metrics_port)
+        self.metrics_server.start_in_thread()
+
+    def collect_metrics(self):
+        # Runs on the metrics server's thread at scrape time: copies, no Tk calls
+        yield "app_threads", threading.active_count(), {"kind": "python"}
+        yield "app_threads", os_thread_count(), {"kind": "os"}
+        names = self.child_names()
+        for pid, command in child_processes().items():
+            usage = process_usage(pid)
+            if usage is not None:
+                labels = {"process": names.get(pid, command), "pid": pid}
+                yield "child_cpu_seconds_total", usage[0], labels
+                yield "child_rss_bytes", usage[1], labels
+        for name, camera in list(self.cameras.cameras.items()):
+            yield "vlc_player_playing", int(camera.playing), {"camera": name}
+        yield "media_queue_pending", self.media.commands.qsize(), {}
+        profiler = self.profiler.stats()
+        yield "profiler_running", int(profiler['running']), {}
+        yield "profiler_overhead_ratio", profiler['overhead'], {}
+
+    def child_names(self):
+        """{pid: what it is} for the FFmpeg processes the app knows about"""
+        names = {}
+        for platform, process in list(self.ffmpeg_processes.items()):
+            process = process.process if isinstance(process, Relay) else process
+            if process is not None:
+                names[process.pid] = platform
+        fanout = self.fanout
+        if fanout is not None:
+            if fanout.process is not None:
+                names[fanout.process.pid] = FanoutEncoder.ENCODER_NAME
+            for name, relay in list(fanout.relays.items()):
+                if relay.process is not None:
+                    names[relay.process.pid] = name
+        hls = self.hls_process
+        if hls is not None and not isinstance(hls, Relay):
+            names[hls.pid] = self.LOCAL_HLS
+        for name, camera in list(self.cameras.cameras.items()):
+            reader = camera.reader
+            if reader is not None and reader.process is not None:
+                names[reader.process.pid] = f"{name} decoder"
+        return names
+
+    def player_state_changed(self, camera, state):
+        # On libvlc's thread; counters are thread-safe
+        self.metrics.inc("vlc_player_transitions_total", camera=camera, state=state)
+
+    def toggle_profiler(self):
+        if self.profiler.running:
+            self.profile_status.set("Saving profile...")
+            self.media.submit(self.profiler.stop, on_done=lambda path: self.profile_status.set(f"Profile: {path}"))
+        else:
+            self.profiler.start()
+            self.profile_status.set("Profiling...")
+
+    def recording_text(self):
+        if self.recording is None:
+            return ""
+        stats = self.recording.stats()
+        text = (f"  |  Recording {stats['seconds'] / 60:.0f} min, {stats['bytes'] / 1e6:.0f} MB, "
+                f"{stats['events']} events")
+        if 'disk_bytes' in stats:
+            text += f", spool {stats['disk_bytes'] / 1e9:.1f} of {stats['max_bytes'] / 1e9:.0f} GB"
+            if stats['evicted_segments']:
+                text += f" ({stats['evicted_segments']} segments evicted)"
+        return text + (f", {stats['dropped_chunks']} chunks dropped" if stats['dropped_chunks'] else "")
+
+    def update_hls_status(self, stats):
+        if self.hls_process is None:
+            return
+        if self.hls_process.poll() is not None:
+            self.hls_stats.set(f"Stopped (exit {self.hls_process.poll()})")
+            return
+        origin = self.hls_origin.stats()
+        text = (f"http://{local_address()}:{self.hls_port}/  {origin['connections']} connections, "
+                f"{origin['bytes_served'] / 1e6:.0f} MB served, cache hit rate {origin['hit_rate']:.0%}")
+        if stats and stats['running']:
+            text += f"  |  {stats['fps']:.0f} fps {stats['speed']:.2f}x"
+        self.hls_stats.set(text)
 
     def start_streaming(self, platform, rtmp_entry, key_entry):
         if self.streaming_platforms[platform]["active"]:
@@ -205,173 +569,599 @@ class CricketScoreboardApp:
         input_stream = self.streams[self.stream_var.get()]
         output_url = f"{rtmp_url}/{stream_key}"
         
-        ffmpeg_cmd = [
-            'ffmpeg',
+        # Mark it active now so a second click can't start it twice while it spins up
+        self.streaming_platforms[platform]["active"] = True
+        if self.fanout_mode.get() or self.store_forward.get():
+            self.start_fanout_streaming(platform, input_stream, output_url)
+            return
+        
+        video_args, audio_args = self.output_codec_args(platform, input_stream)
+        try:
+            plan = self.governor.plan(platform, video_args, *self.source_geometry(input_stream))
+        except AdmissionError as e:
+            self.streaming_platforms[platform]["active"] = False
+            messagebox.showerror("Not enough CPU", f"Can't start {platform}: {e}")
+            return
+        video_args = plan.video_args
+        command = lambda video_args: [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', *PROGRESS_ARGS,
             '-re', '-i', input_stream,
-            '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '3000k',
-            '-c:a', 'aac', '-b:a', '128k',
+            *video_args,
+            *audio_args,
             '-f', 'flv', output_url
         ]
-        
+        ffmpeg_cmd = command(video_args)
+        if adaptable(video_args):
+            source_height = self.source_geometry(input_stream)[1]
+            self.bandwidth[platform] = (BandwidthController(platform), lambda rung: (
+                lambda: self.spawn_stream(command(rung_video_args(video_args, rung, source_height)), plan)))
+        respawn = lambda: self.spawn_stream(ffmpeg_cmd, plan)
+        self.media.submit(respawn,
+                          on_done=lambda process: self.platform_started(platform, process, respawn),
+                          on_error=lambda e: self.platform_failed(platform, e))
+
+    def output_codec_args(self, name, input_stream):
+        """Stream copy when the source is already fit for RTMP ingest, else a full encode"""
+        if not self.passthrough.get():
+            return DEFAULT_VIDEO_ARGS, DEFAULT_AUDIO_ARGS
+        video_args, audio_args, reason = self.probes.output_args(input_stream, DEFAULT_VIDEO_ARGS,
+                                                                 DEFAULT_AUDIO_ARGS)
+        if reason:
+            self.logger.info(f"{name}: transcoding ({reason})")
+        else:
+            self.logger.info(f"{name}: stream copy, source is already H.264/AAC")
+        return video_args, audio_args
+
+    def source_geometry(self, input_stream):
+        info = self.probes.get(input_stream)
+        if info and info.width and info.height:
+            return info.width, info.height, info.fps or FRAME_RATE
+        return FRAME_WIDTH, FRAME_HEIGHT, FRAME_RATE
+
+    def spawn_stream(self, cmd, plan):
+        # Runs on the media worker
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.governor.apply(plan, process.pid)
+        return process
+
+    def add_fanout_destination(self, fanout, platform, output_url, encoder_plan, relay_plan, output_args=None):
+        # Runs on the media worker; the encoder may have just been (re)started by this call
+        relay = fanout.add_destination(platform, output_url, output_args)
+        self.governor.apply(encoder_plan, fanout.process.pid)
+        self.governor.apply(relay_plan, relay.process.pid)
+        return relay
+
+    def start_fanout_streaming(self, platform, input_stream, output_url):
+        fanout = self.fanout
+        if fanout is None or (fanout.process is not None and not fanout.is_running()):
+            # Wiring happens here; the processes are started on the media worker, in order
+            if self.burn_in.get():
+                video_args, audio_args = DEFAULT_VIDEO_ARGS, DEFAULT_AUDIO_ARGS
+                geometry = (FRAME_WIDTH, FRAME_HEIGHT, FRAME_RATE)
+            else:
+                video_args, audio_args = self.output_codec_args(FanoutEncoder.ENCODER_NAME, input_stream)
+                geometry = self.source_geometry(input_stream)
+            try:
+                plan = self.governor.plan(FanoutEncoder.ENCODER_NAME, video_args, *geometry)
+            except AdmissionError as e:
+                self.streaming_platforms[platform]["active"] = False
+                messagebox.showerror("Not enough CPU", f"Can't start the shared encoder: {e}")
+                return
+            # A new encoder's timestamps don't continue the old one's, so replays and recordings start afresh
+            self.replay.clear()
+            taps = [self.replay.append]
+            spool = None
+            if self.store_forward.get():
+                # The spool is the recording too
+                spool = self.start_recording(spool=True)
+                taps.append(spool.write)
+            elif self.record_program.get():
+                taps.append(self.start_recording().write)
+            if self.burn_in.get():
+                probe = None
+                if self.measure_latency.get():
+                    probe = self.latency = LatencyProbe(self.compositor, port=self.latency_port,
+                                                        send_backlog_s=self.uplink_backlog_s)
+                    taps.append(probe.tap)
+                fanout = FanoutEncoder(raw_video_input_args(audio_source=input_stream), plan.video_args,
+                                       audio_args, frame_input=True, telemetry=self.telemetry, taps=taps,
+                                       spool=spool, supervisor=self.supervisor)
+                # The pipeline exits on its own thread; the cameras are only touched from Tk
+                self.pipeline = CompositingPipeline(
+                    self.cameras.program_reader(), self.compositor, fanout, owns_reader=False,
+                    on_exit=lambda pipeline: self.media.post(self.cameras.detach_program, pipeline), probe=probe)
+                self.cameras.attach_program(self.pipeline)
+                self.generate_overlay()
+                self.media.submit(self.pipeline.start)
+                if probe:
+                    self.media.submit(self.start_latency_probe, probe, fanout, input_stream)
+            else:
+                if self.measure_latency.get():
+                    self.logger.warning("Latency measurement needs the burned-in scoreboard broadcast")
+                fanout = FanoutEncoder(['-re', '-i', input_stream], plan.video_args, audio_args,
+                                       telemetry=self.telemetry, taps=taps, spool=spool, supervisor=self.supervisor)
+            self.fanout = fanout
+            self.fanout_adapt = (plan.video_args, geometry[1]) if adaptable(plan.video_args) else None
+            self.fanout_applied_rung = 0
+        if self.fanout_adapt:
+            self.bandwidth[platform] = (BandwidthController(platform, start=self.fanout_rung()), None)
+        encoder_plan = self.governor.plans[FanoutEncoder.ENCODER_NAME]
+        relay_plan = self.governor.plan(platform, COPY_VIDEO_ARGS)
+        self.fanout_starting += 1
+        respawn = lambda: self.add_fanout_destination(fanout, platform, output_url, encoder_plan, relay_plan)
+        self.media.submit(respawn,
+                          on_done=lambda relay: self.platform_started(platform, relay, respawn),
+                          on_error=lambda e: self.platform_failed(platform, e, fanout=True))
+
+    def start_latency_probe(self, probe, fanout, input_stream):
+        # Runs on the media worker; the verifier takes the feed the way the platforms do
+        probe.start()
+        probe.watch_source(input_stream)
+        fanout.add_destination(probe.VERIFIER, probe.verifier.url)
+
+    def stop_latency_probe(self):
+        probe, self.latency = self.latency, None
+        if probe is None:
+            return
+        stages = probe.report()["stages_ms"]
+        self.logger.info("Latency by stage (p50/p95/max ms): " + ", ".join(
+            f"{stage} {s['p50_ms']:.0f}/{s['p95_ms']:.0f}/{s['max_ms']:.0f}" for stage, s in stages.items()
+            if s['count']))
+        self.media.submit(probe.stop)
+
+    def uplink_backlog_s(self):
+        """Seconds queued in the slowest uplink's send buffer (the latency probe's send stage)"""
+        return max((controller.stats()['backlog_s'] for controller, _ in list(self.bandwidth.values())),
+                   default=0.0)
+
+    def platform_started(self, platform, process, respawn):
+        if isinstance(process, Relay):
+            self.fanout_starting -= 1
+        if not self.streaming_platforms[platform]["active"]:
+            # Stopped while it was still starting
+            self.release_fanout_if_unused()
+            self.media.submit(process.terminate)
+            return
+        self.register_output(platform, process)
+        self.logger.info(f"Started streaming to {platform}")
+        # Restarted with the same settings if it drops; results come back via output_changed
+        self.supervisor.watch(platform, process, respawn)
+
+    def register_output(self, platform, process):
+        if not isinstance(process, Relay):
+            # Relays register their own telemetry
+            self.telemetry.register(platform, process)
+        self.ffmpeg_processes[platform] = process
+
+    def platform_failed(self, platform, error, fanout=False):
+        if fanout:
+            self.fanout_starting -= 1
+        self.streaming_platforms[platform]["active"] = False
+        self.forget_output(platform)
+        self.release_fanout_if_unused()
+        messagebox.showerror("Error", f"Failed to start streaming to {platform}: {error}")
+
+    def play_replay(self, speed):
+        """Cut the program to a replay of the latest marker (or the last few seconds), then back to live"""
+        if self.pipeline is None or not self.pipeline.running:
+            messagebox.showinfo("Replay", "Replays need the burned-in scoreboard broadcast to be on air")
+            return
+        marker = self.replay.last_marker()
+        if marker:
+            clip = self.replay.clip_around(marker[0], self.replay_preroll_s, self.replay_postroll_s)
+        else:
+            clip = self.replay.clip(time.perf_counter() - self.replay_preroll_s - self.replay_postroll_s)
+        if not clip:
+            messagebox.showinfo("Replay", "Nothing buffered yet")
+            return
+        self.logger.info(f"Replay of {marker[1] if marker else 'the last moments'} at {speed}x, "
+                         f"{len(clip) / 1e6:.1f} MB")
+        previous = self.replay_reader
+        self.replay_reader = ReplayReader(clip, speed, on_end=lambda r: self.media.post(self.end_replay, r))
+        self.media.submit(self.pipeline.set_reader, self.replay_reader)
+        if previous is not None:
+            # Replaced while on air: stop its decode once the pipeline has cut to the new one
+            self.media.submit(previous.stop)
+
+    def end_replay(self, reader=None):
+        # Back to the camera on air, unless the operator already cut away (or this replay was replaced)
+        if self.replay_reader is None or (reader is not None and reader is not self.replay_reader):
+            return
+        replay_reader, self.replay_reader = self.replay_reader, None
+        if self.pipeline is not None and self.pipeline.running:
+            self.media.submit(self.pipeline.set_reader, self.cameras.program_reader())
+        self.media.submit(replay_reader.stop)
+
+    def start_local_hls(self):
+        """Encode the program into the HLS ladder, one decode and one process, and serve it on the LAN"""
+        if self.hls_process is not None and self.hls_process.poll() is None:
+            return
         try:
-            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.ffmpeg_processes[platform] = process
-            self.streaming_platforms[platform]["active"] = True
-            self.logger.info(f"Started streaming to {platform}")
-            Thread(target=self.monitor_stream, args=(platform,)).start()
-        except Exception as e:
-            self.logger.error(f"Streaming to {platform} failed: {e}")
-            messagebox.showerror("Error", f"Failed to start streaming to {platform}: {e}")
+            # The governor scales by pixel rate, so pass the ladder's total as width with height=fps=1
+            plan = self.governor.plan(self.LOCAL_HLS, ['-preset', 'veryfast'], ladder_pixel_rate(), 1, 1)
+        except AdmissionError as e:
+            messagebox.showerror("Not enough CPU", f"Can't start the local ladder: {e}")
+            return
+        output_args = ['-threads', str(plan.threads), *ladder_output_args(self.hls_dir, preset=plan.preset)]
+        if self.hls_origin is None:
+            self.hls_origin = HlsOrigin(self.hls_dir, port=self.hls_port)
+            self.hls_origin.start_in_thread()
+        fanout = self.fanout
+        if fanout is not None:
+            # Take the program feed (with the burned-in scoreboard) from the shared encoder
+            encoder_plan = self.governor.plans.get(FanoutEncoder.ENCODER_NAME)
+
+            def start():
+                prepare_directory(self.hls_dir)
+                relay = fanout.add_destination(self.LOCAL_HLS, None, output_args, from_spool=False)
+                if encoder_plan:
+                    self.governor.apply(encoder_plan, fanout.process.pid)
+                self.governor.apply(plan, relay.process.pid)
+                return relay
+        else:
+            cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', *PROGRESS_ARGS,
+                   '-re', '-i', self.streams[self.stream_var.get()], *output_args]
+
+            def start():
+                prepare_directory(self.hls_dir)
+                process = self.spawn_stream(cmd, plan)
+                self.telemetry.register(self.LOCAL_HLS, process)
+                return process
+        self.hls_stats.set("Starting...")
+        self.media.submit(start, on_done=self.local_hls_started, on_error=self.local_hls_failed)
+
+    def local_hls_started(self, process):
+        self.hls_process = process
+        self.logger.info(f"Local HLS ladder on http://{local_address()}:{self.hls_port}/")
+
+    def local_hls_failed(self, error):
+        self.governor.release(self.LOCAL_HLS)
+        self.hls_stats.set(f"Failed: {error}")
+
+    def stop_local_hls(self):
+        process, self.hls_process = self.hls_process, None
+        if process is not None:
+            self.media.submit(process.terminate)
+        self.governor.release(self.LOCAL_HLS)
+        self.hls_stats.set("Idle")
+
+    def start_recording(self, spool=False):
+        self.stop_recording()
+        directory = os.path.join(self.recordings_dir, time.strftime("%Y%m%d-%H%M%S"))
+        self.recording = Spool(directory, self.spool_max_gb * 1024 ** 3) if spool else Recording(directory)
+        self.last_recording_dir = directory
+        self.logger.info(f"Recording program to {directory}")
+        return self.recording
+
+    def stop_recording(self):
+        recording, self.recording = self.recording, None
+        if recording:
+            # Drains its queue to disk; keep that off the Tk thread
+            threading.Thread(target=recording.close, name="recorder-close", daemon=True).start()
+
+    def make_highlights(self):
+        directory = self.last_recording_dir
+        if directory is None:
+            messagebox.showinfo("Highlights", "Nothing has been recorded yet")
+            return
+        self.highlight_status.set("Cutting highlights...")
+
+        def run():
+            try:
+                reel, clips = extract_highlights(directory, preroll_s=self.replay_preroll_s,
+                                                 postroll_s=self.replay_postroll_s)
+            except Exception as e:
+                self.media.post(self.highlight_status.set, f"Highlights failed: {e}")
+            else:
+                self.media.post(self.highlight_status.set, f"{len(clips)} clips" + (f", reel {reel}" if reel else ""))
+
+        threading.Thread(target=run, name="highlights", daemon=True).start()
+
+    @timed("generate_overlay")
+    def generate_overlay(self):
+        """Refresh the burned-in scoreboard (and the chart under it) from the scoreboard's current values"""
+        overlay = self.overlay_renderer.render(scoreboard_overlay_values(self.scoreboard.values))
+        changed = self.overlay_renderer.changed
+        chart = self.chart_var.get()
+        if chart in MatchAnalytics.CHARTS:
+            pixels = self.charts.render(chart, self.analytics)
+            changed = changed or self.charts.changed
+            overlay = self.charts.below(overlay, pixels)
+        if changed or chart != self.chart_shown:
+            self.chart_shown = chart
+            self.compositor.set_overlay(overlay)
+            if self.latency:
+                self.latency.overlay_changed(self.last_score_action)
+
+    def change_chart(self, event=None):
+        if self.pipeline and self.pipeline.running:
+            self.generate_overlay()
 
     def stop_streaming(self, platform):
-        if not self.streaming_platforms[platform]["active"] or platform not in self.ffmpeg_processes:
+        if not self.streaming_platforms[platform]["active"]:
             return
-            
-        self.ffmpeg_processes[platform].terminate()
-        del self.ffmpeg_processes[platform]
         self.streaming_platforms[platform]["active"] = False
+        self.forget_output(platform)
+        process = self.ffmpeg_processes.pop(platform, None)
+        if process is None:
+            # Still starting; platform_started terminates it
+            return
+        self.release_fanout_if_unused()
+        self.media.submit(self.supervisor.stop, platform)
         self.logger.info(f"Stopped streaming to {platform}")
 
-    def monitor_stream(self, platform):
-        process = self.ffmpeg_processes[platform]
-        process.wait()
-        if platform in self.ffmpeg_processes:
+    def forget_output(self, platform):
+        self.governor.release(platform)
+        self.bandwidth.pop(platform, None)
+        self.samplers.pop(platform, None)
+
+    def fanout_rung(self):
+        """The shared encoder's rung: its weakest destination's when following it, else the top one"""
+        if not self.fanout_follow_weakest.get():
+            return 0
+        return max((controller.rung for controller, respawn in self.bandwidth.values() if respawn is None),
+                   default=0)
+
+    def sample_resources(self):
+        """Measure CPU and every adapted output's uplink on the media worker; results come back to adapt_bitrates"""
+        if self.resources_sampling:
+            return  # the last tick's sample is still queued behind a slow media command
+        outputs = []
+        if self.adaptive_bitrate.get():
+            for platform in self.bandwidth:
+                process = self.ffmpeg_processes.get(platform)
+                if process is None:
+                    continue
+                known = self.samplers.get(platform)
+                if known is None or known[0] is not process:
+                    process_pid = process.process.pid if isinstance(process, Relay) else process.pid
+                    extra = process.backlog_bytes if isinstance(process, Relay) else None
+                    known = self.samplers[platform] = (process, OutputSampler(process_pid, extra))
+                outputs.append((platform, *known))
+        self.resources_sampling = True
+        self.media.submit(self.take_samples, outputs, on_done=self.adapt_bitrates,
+                          on_error=self.samples_failed)
+
+    def take_samples(self, outputs):
+        # Runs on the media worker: /proc/stat, /proc/<pid>/fd and one sock_diag dump for all outputs
+        self.governor.sample()
+        return outputs, sample_outputs([sampler for _, _, sampler in outputs])
+
+    def samples_failed(self, error):
+        self.resources_sampling = False
+
+    def adapt_bitrates(self, sampled):
+        """Feed each output's measured throughput/backlog to its controller and apply rung changes"""
+        self.resources_sampling = False
+        if not self.adaptive_bitrate.get():
+            return
+        for (platform, process, _), sample in zip(*sampled):
+            entry = self.bandwidth.get(platform)
+            if entry is None or self.ffmpeg_processes.get(platform) is not process:
+                continue  # stopped or replaced while it was being sampled
+            controller, respawn_at = entry
+            rung = controller.update(*sample)
+            if rung is not None and respawn_at is not None:
+                self.media.submit(self.supervisor.restart, platform, respawn_at(controller.rungs[rung]))
+        fanout_rung = self.fanout_rung()
+        if self.fanout is not None and self.fanout_adapt and fanout_rung != self.fanout_applied_rung:
+            # Bitrate only: the relays are stream-copying and keep the frame size they connected with
+            video_args, source_height = self.fanout_adapt
+            self.fanout_applied_rung = fanout_rung
+            self.media.submit(self.restart_fanout_encoder, self.fanout,
+                              rung_video_args(video_args, RUNGS[fanout_rung], source_height, rescale=False))
+
+    def restart_fanout_encoder(self, fanout, video_args):
+        # Runs on the media worker
+        fanout.restart(video_args)
+        plan = self.governor.plans.get(FanoutEncoder.ENCODER_NAME)
+        if plan and fanout.process:
+            self.governor.apply(plan, fanout.process.pid)
+
+    def release_fanout_if_unused(self):
+        # The shared encoder stops with its last destination; the next start builds a new one
+        if self.fanout is not None and not self.fanout_starting and \
+                not any(isinstance(p, Relay) and p.owner is self.fanout for p in self.ffmpeg_processes.values()):
+            self.media.submit(self.fanout.stop)
+            self.governor.release(FanoutEncoder.ENCODER_NAME)
+            self.fanout = None
+            self.stop_recording()
+            self.stop_latency_probe()
+
+    def output_changed(self, platform, state, process, detail):
+        # Supervisor updates, handed over from its watcher threads
+        if platform == FanoutEncoder.ENCODER_NAME:
+            self.fanout_encoder_changed(state, process, detail)
+            return
+        if state == RUNNING:
+            if self.streaming_platforms[platform]["active"]:
+                self.register_output(platform, process)
+        elif state in (ENDED, GAVE_UP) and self.ffmpeg_processes.get(platform) is process:
             del self.ffmpeg_processes[platform]
             self.streaming_platforms[platform]["active"] = False
-            self.logger.info(f"Stream to {platform} ended")
+            self.forget_output(platform)
+            self.release_fanout_if_unused()
+            self.logger.warning(f"Stream to {platform} {state}: {detail}")
 
-    def stream_error_handler(self, event):
-        self.stream_status_var.set("Stream Error - Switching to Fallback")
-        self.logger.warning("Stream error detected, switching to fallback")
-        self.stream_var.set("Fallback")
-        self.change_stream()
+    def fanout_encoder_changed(self, state, fanout, detail):
+        if fanout is not self.fanout:
+            return
+        if state == RUNNING:
+            # A respawned encoder is a new process: give it its cores and nice level again
+            plan = self.governor.plans.get(FanoutEncoder.ENCODER_NAME)
+            if plan:
+                self.media.submit(self.governor.apply, plan, fanout.process.pid)
+            self.logger.info(f"Shared encoder {detail}")
+        elif state == BACKOFF:
+            self.logger.warning(f"Shared encoder down, {detail}")
+        elif state == GAVE_UP:
+            self.logger.error(f"Shared encoder {state}: {detail}")
+            for platform, process in list(self.ffmpeg_processes.items()):
+                if isinstance(process, Relay) and process.owner is fanout:
+                    self.stop_streaming(platform)
+
+    def stream_error_handler(self, name, event):
+        # Called on libvlc's thread: only flag it, the failover monitor switches on the Tk thread
+        self.logger.warning(f"Stream error detected on {name}")
+        self.failover.report_error(name)
+
+    def media_error(self, error):
+        self.logger.error(f"Media error: {error}")
+        self.stream_status_var.set("Error")
+
+    def failover_changed(self, source, status):
+        self.stream_var.set(source)
+        self.stream_status_var.set(status)
 
     def toggle_scoreboard(self):
         self.video_canvas.itemconfigure(self.score_window, state='normal' if self.show_score.get() else 'hidden')
 
+    @timed("update_scoreboard")
     def update_scoreboard(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        overs_str = f"{int(team['overs'])}.{int((team['overs'] % 1) * 6)}"
-        
-        self.team_var.set(team['name'])
-        self.score_var.set(f"{team['runs']}/{team['wickets']} ({overs_str})")
-        
-        self.bat1_name.set(f"{self.batsmen[0]['name']}{' *' if not self.batsmen[0]['out'] else ''}")
-        self.bat1_stats.set(f"{self.batsmen[0]['runs']} ({self.batsmen[0]['balls']}) 4s:{self.batsmen[0]['4s']} 6s:{self.batsmen[0]['6s']}")
-        self.bat2_name.set(f"{self.batsmen[1]['name']}{' *' if not self.batsmen[1]['out'] else ''}")
-        self.bat2_stats.set(f"{self.batsmen[1]['runs']} ({self.batsmen[1]['balls']}) 4s:{self.batsmen[1]['4s']} 6s:{self.batsmen[1]['6s']}")
-        
-        overs_str = f"{int(self.bowler['overs'])}.{int((self.bowler['overs'] % 1) * 6)}"
-        self.bowler_var.set(f"{self.bowler['name']} {overs_str}-{self.bowler['maidens']}-{self.bowler['runs']}-{self.bowler['wickets']}")
-        
-        extras = team['extras']
-        total_extras = sum(extras.values())
-        self.extras_var.set(f"Extras {total_extras} (W:{extras['wides']} NB:{extras['noballs']} B:{extras['byes']} LB:{extras['legbyes']})")
-        
-        balls = int(team['overs'] * 6 + (team['overs'] % 1) * 10)
-        rr = f"{team['runs']/balls*6:.2f}" if balls > 0 else "0.00"
-        self.rr_var.set(f"RR: {rr}")
-        
-        if self.match['current_batting'] == 2 and self.match['target'] > 0:
-            remaining = self.match['target'] - team['runs']
-            balls_left = int(self.match['max_overs'] * 6 - balls)
-            rrr = f"{remaining/balls_left*6:.2f}" if balls_left > 0 else "0.00"
-            self.target_var.set(f"Need {remaining} off {balls_left} (RRR: {rrr})")
-        else:
-            self.target_var.set("")
-        
-        self.stream_status_var.set("Connected" if self.player.is_playing() else "Disconnected")
+        # Repainted once the Tk thread is idle, however many actions came in before then
+        if self.last_score_action is None:
+            self.last_score_action = time.perf_counter()
+        self.scoreboard.invalidate()
+
+    def scoreboard_changed(self, changed):
+        if self.pipeline and self.pipeline.running:
+            self.generate_overlay()
+        self.last_score_action = None
+        self.score_server.publish({**score_state(self.engine), **self.analytics.state()})
 
+    def update_player_status(self):
+        # Cached from VLC's events, so this never calls into libvlc
+        playing = self.cameras.is_playing()
+        if playing != self.player_playing:
+            self.player_playing = playing
+            self.stream_status_var.set("Connected" if playing else "Disconnected")
+
+    @timed("add_runs")
     def add_runs(self, runs):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['runs'] += runs
-        
-        striker = next((b for b in self.batsmen if not b['out']), self.batsmen[0])
-        striker['runs'] += runs
-        if runs > 0:
-            striker['balls'] += 1
-            if runs == 4: striker['4s'] += 1
-            elif runs == 6: striker['6s'] += 1
-        
-        self.bowler['runs'] += runs
-        if runs <= 6:
-            self.increment_ball()
-        self.update_scoreboard()
+        self.record_ball(lambda: self.engine.add_runs(runs), {4: "FOUR", 6: "SIX"}.get(runs))
 
+    @timed("add_wicket")
     def add_wicket(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['wickets'] += 1
-        
-        striker = next((b for b in self.batsmen if not b['out']), self.batsmen[0])
-        striker['out'] = True
-        striker['balls'] += 1
-        striker['dismissal'] = f"b {self.bowler['name']}"
-        
-        self.bowler['wickets'] += 1
-        self.increment_ball()
-        self.update_scoreboard()
-        
-        if team['wickets'] == 10:
-            self.switch_innings()
+        self.record_ball(self.engine.add_wicket, "WICKET")
+
+    def record_ball(self, record, label=None):
+        """Journal a delivery, then mark it and any milestone it brought up"""
+        innings = self.engine.batting
+        batter = innings.batters[innings.striker]
+        batter_runs, innings_runs = batter.runs, innings.runs
+        self.journal_event(record())
+        if label:
+            self.mark_event(label)
+        self.mark_milestones(batter, batter_runs, innings_runs)
+        self.after_ball()
+
+    def mark_event(self, label):
+        """Timestamp a scoring moment in the replay buffer and the recording"""
+        recording = self.recording
+        marker = (label, self.replay.mark(label), recording, recording.mark(label) if recording else None)
+        self.event_markers.setdefault(len(self.engine.log), []).append(marker)
+
+    def unmark_events(self, markers):
+        for label, replay_time, recording, recording_time in markers:
+            self.replay.unmark(replay_time, label)
+            if recording is not None and recording is self.recording:
+                recording.unmark(recording_time, label)
+
+    def remark_events(self, markers):
+        for label, replay_time, recording, recording_time in markers:
+            self.replay.mark(label, replay_time)
+            if recording is not None and recording is self.recording:
+                recording.mark(label, recording_time)
+
+    def mark_milestones(self, batter, batter_runs, innings_runs):
+        innings = self.engine.batting
+        if batter.runs // 50 > batter_runs // 50:
+            self.mark_event(f"{batter.runs // 50 * 50} for {batter.name}")
+        if innings.runs // 100 > innings_runs // 100:
+            self.mark_event(f"{innings.team} {innings.runs // 100 * 100}")
 
     def add_extra(self, extra_type):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        team['runs'] += 1
-        team['extras'][extra_type] += 1
-        self.bowler['runs'] += 1
-        if extra_type in ["wides", "noballs"]:
-            self.match['current_ball'] -= 1
-        self.update_scoreboard()
+        self.record_ball(lambda: self.engine.add_extra(extra_type))
 
-    def increment_ball(self):
-        team = self.match['team1'] if self.match['current_batting'] == 1 else self.match['team2']
-        self.match['current_ball'] += 1
-        team['overs'] = self.match['current_ball'] / 6
-        self.bowler['overs'] = self.match['current_ball'] / 6
-        if team['overs'] >= self.match['max_overs']:
+    def after_ball(self):
+        if self.engine.innings_complete() and self.engine.current == 0:
             self.switch_innings()
+        else:
+            self.update_scoreboard()
 
     def next_over(self):
-        if self.bowler['runs'] == 0 and self.match['current_ball'] % 6 == 0:
-            self.bowler['maidens'] += 1
-        self.bowler = {"name": f"Bowler {int(time.time())}", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
+        self.journal_event(self.engine.new_bowler(f"Bowler {len(self.engine.batting.bowlers) + 1}"))
         self.update_scoreboard()
 
     def switch_innings(self):
-        if self.match['current_batting'] == 1:
-            self.match['target'] = self.match['team1']['runs'] + 1
-            self.match['current_batting'] = 2
+        self.journal_event(self.engine.switch_innings())
+        self.update_scoreboard()
+
+    def undo(self):
+        position = len(self.engine.log)
+        if self.engine.undo():
+            self.journal.undo()
+            # A mis-click that was undone mustn't end up in the replays or the highlights
+            markers = self.undone_markers[position] = self.event_markers.pop(position, [])
+            self.unmark_events(markers)
+        self.update_scoreboard()
+
+    def redo(self):
+        if self.engine.redo():
+            self.journal.redo()
+            position = len(self.engine.log)
+            markers = self.event_markers[position] = self.undone_markers.pop(position, [])
+            self.remark_events(markers)
+        self.update_scoreboard()
+
+    def new_engine(self):
+        return MatchEngine("Team A", "Team B", max_overs=20)
+
+    def journal_event(self, event):
+        self.undone_markers.clear()  # recording an action drops the redo stack
+        self.journal.record(event)
+        self.journal.maybe_snapshot(self.engine)
+
+    def new_match(self):
+        if not messagebox.askyesno("New Match", "Archive the current match and start a new one?"):
+            return
+        self.journal.close()
+        stamp = f"{self.journal_path}-{time.strftime('%Y%m%d-%H%M%S')}"
+        archive, n = stamp, 1
+        while os.path.exists(archive):
+            n += 1
+            archive = f"{stamp}-{n}"
+        try:
+            os.rename(self.journal_path, archive)
+        except OSError as e:
+            archived = False
+            self.logger.error(f"Couldn't archive the match journal to {archive}: {e}")
+            messagebox.showerror("New Match", f"Couldn't archive the current match, so it carries on: {e}")
         else:
-            self.match['current_batting'] = 1
-            self.match['target'] = 0
-        
-        self.batsmen = [
-            {"name": f"Batsman {i}", "runs": 0, "balls": 0, "4s": 0, "6s": 0, "out": False, "dismissal": ""}
-            for i in range(2)
-        ]
-        self.bowler = {"name": "Bowler 1", "overs": 0.0, "maidens": 0, "runs": 0, "wickets": 0}
-        self.match['current_ball'] = 0
+            archived = True
+        # Either the fresh journal, or the current match's own again, so scoring keeps being persisted
+        self.journal = MatchJournal(self.journal_path)
+        self.engine = self.journal.recover(self.new_engine)
+        if archived:
+            self.event_markers.clear()
+            self.undone_markers.clear()
+        self.analytics.attach(self.engine)
         self.update_scoreboard()
 
+    @timed("change_stream")
     def change_stream(self, event=None):
         try:
             selected = self.stream_var.get()
             if not selected or selected not in self.streams:
                 return
                 
-            self.player.stop()
-            media = self.vlc_instance.media_new(self.streams[selected])
-            self.player.set_media(media)
-            
-            if os.name == 'nt':
-                self.player.set_hwnd(self.video_canvas.winfo_id())
-            else:
-                self.player.set_xwindow(self.video_canvas.winfo_id())
-                
-            if self.player.play() == -1:
-                raise Exception("Failed to play stream")
-            else:
-                self.stream_status_var.set("Connected")
+            self.cameras.switch(selected)
+            self.failover.watch(selected)
+            if self.latency:
+                self.media.submit(self.latency.watch_source, self.streams[selected])
+            # The player reports in via its events; refresh_telemetry picks that up
+            self.player_playing = None
+            self.stream_status_var.set("Connecting...")
                 
         except Exception as e:
             self.logger.error(f"Stream error: {e}")
@@ -379,9 +1169,25 @@ class CricketScoreboardApp:
             messagebox.showerror("Stream Error", f"Failed to load stream: {e}")
 
     def on_closing(self):
-        for platform in list(self.ffmpeg_processes.keys()):
+        for platform in self.streaming_platforms:
             self.stop_streaming(platform)
-        self.player.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.fanout:
+            self.media.submit(self.fanout.stop)
+        if self.recording:
+            self.recording.close()
+        self.stop_latency_probe()
+        self.stop_local_hls()
+        if self.hls_origin:
+            self.hls_origin.stop()
+        self.cameras.stop_all()
+        self.media.stop()
+        self.telemetry.stop()
+        self.score_server.stop()
+        self.profiler.stop()
+        self.metrics_server.stop()
+        self.journal.close()
         self.root.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+from match_engine import MatchEngine, overs_str
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+
+OVERLAY_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Score</title>
+<style>body{margin:0;font:bold 28px Arial;color:#fff;background:transparent}
+#s{display:inline-block;background:#0066cc;padding:6px 14px}#d{background:#333;padding:4px 14px;font-size:20px}</style>
+</head><body><div id="s"></div><div id="d"></div><script>
+let st = {};
+function show() {
+  document.getElementById("s").textContent = `${st.team} ${st.runs}/${st.wickets} (${st.overs})`;
+  document.getElementById("d").textContent = `${st.striker}  ${st.non_striker}  |  ${st.bowler}  ${st.required || ""}`;
+}
+const es = new EventSource("/events");
+es.addEventListener("snapshot", e => { st = JSON.parse(e.data).data; show(); });
+es.addEventListener("delta", e => { Object.assign(st, JSON.parse(e.data).data); show(); });
+</script></body></html>"""
+
+
+def score_state(engine):
+    """Flat, JSON-friendly view of the live score"""
+    innings = engine.batting
+    striker = innings.batters[innings.striker]
+    non_striker = innings.batters[innings.non_striker]
+    bowler = innings.current_bowler()
+    required = engine.required()
+    return {
+        "team": innings.team,
+        "runs": innings.runs,
+        "wickets": innings.wickets,
+        "overs": overs_str(innings.balls),
+        "striker": f"{striker.name} {striker.runs} ({striker.balls})",
+        "non_striker": f"{non_striker.name} {non_striker.runs} ({non_striker.balls})",
+        "bowler": f"{bowler.name} {bowler.figures()}",
+        "extras": innings.extras_total(),
+        "run_rate": round(innings.run_rate(), 2),
+        "required": f"Need {required[0]} off {required[1]}" if required else ""
+    }
+
+
+class Subscriber:
+    """One connected client; deltas it hasn't sent yet are merged, never queued"""
+
+    def __init__(self, writer, send):
+        self.writer = writer
+        self.send = send
+        self.pending = None
+        self.message = None
+        self.wakeup = asyncio.Event()
+        self.coalesced = 0
+
+    def offer(self, delta, message):
+        if self.pending is None:
+            # Usual case: share the message already encoded for everyone
+            self.pending, self.message = delta, message
+        else:
+            self.coalesced += 1
+            self.pending = {**self.pending, **delta}
+            self.message = None
+        self.wakeup.set()
+
+
+class ScoreServer:
+    """Pushes live score deltas to browser/OBS clients over SSE or WebSocket.
+
+    publish() can be called from any thread (e.g. after update_scoreboard);
+    it only diffs against the last state and schedules the fan-out on the
+    server's own asyncio loop. Each client gets the full state on connect,
+    then deltas. A slow client never backs anything up: while it is busy
+    writing, newer deltas are merged into a single pending update.
+    """
+
+    def __init__(self, host="0.0.0.0", port=8765):
+        self.host = host
+        self.port = port
+        self.state = {}
+        self.version = 0
+        self.published_at = 0.0
+        self.subscribers = set()
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    # Publishing
+
+    def publish(self, state):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._publish, dict(state), time.time())
+
+    def _publish(self, state, published_at):
+        delta = {k: v for k, v in state.items() if self.state.get(k) != v}
+        if not delta:
+            return
+        self.state.update(delta)
+        self.version += 1
+        self.published_at = published_at
+        message = self._message("delta", self.version, delta, published_at)
+        for subscriber in self.subscribers:
+            subscriber.offer(delta, message)
+
+    def _message(self, kind, version, data, ts):
+        # ts is when the scorer published this state, for push latency
+        return json.dumps({"type": kind, "v": version, "ts": ts, "data": data}, separators=(",", ":"))
+
+    # Serving
+
+    def start_in_thread(self):
+        """Run the server on a background thread (embedded in the app)"""
+        threading.Thread(target=self.run, name="score-server", daemon=True).start()
+        self._ready.wait(5)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error(f"Score server could not listen on {self.host}:{self.port}: {e}")
+            self.loop = None
+            self._ready.set()
+            return
+        logger.info(f"Score server listening on http://{self.host}:{self.port}/")
+        self._ready.set()
+        self._stopped = asyncio.Event()
+        async with self._server:
+            await self._stopped.wait()
+
+    def stop(self):
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._server.close()
+        for subscriber in list(self.subscribers):
+            subscriber.writer.close()
+            subscriber.wakeup.set()
+        self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode(errors="replace").split("\r\n")
+        parts = lines[0].split(" ")
+        path = parts[1] if len(parts) > 1 else "/"
+        headers = {}
+        for line in lines[1:]:
+            key, sep, value = line.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        try:
+            if headers.get("upgrade", "").lower() == "websocket":
+                await self._websocket(reader, writer, headers)
+            elif path.startswith("/events"):
+                await self._sse(reader, writer)
+            elif path.startswith("/state"):
+                snapshot = self._message("snapshot", self.version, self.state, self.published_at)
+                await self._respond(writer, "200 OK", "application/json", snapshot)
+            elif path == "/":
+                await self._respond(writer, "200 OK", "text/html; charset=utf-8", OVERLAY_PAGE)
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", "not found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        data = body.encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _push_loop(self, subscriber):
+        """Send snapshot, then merged deltas, until the client goes away"""
+        # Subscribed in the same step the snapshot is taken, so deltas published while it is
+        # being sent are merged into pending and follow it
+        snapshot = self._message("snapshot", self.version, self.state, self.published_at)
+        self.subscribers.add(subscriber)
+        try:
+            await subscriber.send("snapshot", snapshot)
+            while True:
+                await subscriber.wakeup.wait()
+                subscriber.wakeup.clear()
+                if subscriber.writer.is_closing():
+                    return
+                delta, message = subscriber.pending, subscriber.message
+                subscriber.pending = subscriber.message = None
+                if message is None:
+                    message = self._message("delta", self.version, delta, self.published_at)
+                await subscriber.send("delta", message)
+        finally:
+            self.subscribers.discard(subscriber)
+
+    async def _sse(self, reader, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+
+        async def send(kind, message):
+            writer.write(f"event: {kind}\ndata: {message}\n\n".encode())
+            await writer.drain()
+
+        push = asyncio.ensure_future(self._push_loop(Subscriber(writer, send)))
+        try:
+            # Nothing more is expected from the client; EOF means it went away
+            while not push.done() and await reader.read(4096):
+                pass
+        finally:
+            push.cancel()
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+        async def send(kind, message):
+            payload = message.encode()
+            if len(payload) < 126:
+                header = struct.pack("!BB", 0x81, len(payload))
+            elif len(payload) < 65536:
+                header = struct.pack("!BBH", 0x81, 126, len(payload))
+            else:
+                header = struct.pack("!BBQ", 0x81, 127, len(payload))
+            writer.write(header + payload)
+            await writer.drain()
+
+        push = asyncio.ensure_future(self._push_loop(Subscriber(writer, send)))
+        try:
+            # Clients don't send us anything useful; just notice when they close
+            while not push.done():
+                head = await reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", await reader.readexactly(8))[0]
+                await reader.readexactly(length + (4 if head[1] & 0x80 else 0))
+                if opcode == 0x8:
+                    break
+        finally:
+            push.cancel()
+
+
+async def follow_journal(server, path, interval=0.2):
+    """Companion mode: republish whenever the match journal changes"""
+    from journal import load_engine, JOURNAL_FILE
+    seen = None
+    while True:
+        try:
+            st = os.stat(os.path.join(path, JOURNAL_FILE))
+            marks = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            marks = None
+        if marks != seen:
+            seen = marks
+            engine = load_engine(path, MatchEngine)[0]
+            server._publish(score_state(engine), time.time())
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live score push server (companion process)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--journal", default="match_journal", help="match journal directory to follow")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def main():
+        server = ScoreServer(args.host, args.port)
+        asyncio.ensure_future(follow_journal(server, args.journal))
+        await server.serve()
+
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+import time
+
+from events import DelayTracker
+from match_engine import overs_str
+
+
+def scoreboard_values(engine, analytics=None):
+    """Display strings for the on-screen scoreboard, keyed like its Tk variables (plus analytics.values())"""
+    innings = engine.batting
+    striker = innings.batters[innings.striker]
+    non_striker = innings.batters[innings.non_striker]
+    bowler = innings.current_bowler()
+    _, wides, noballs, byes, legbyes = innings.extras
+    required = engine.required()
+    values = {
+        "team": innings.team,
+        "score": f"{innings.runs}/{innings.wickets} ({overs_str(innings.balls)})",
+        "bat1_name": f"{striker.name} *",
+        "bat1_stats": f"{striker.runs} ({striker.balls}) 4s:{striker.fours} 6s:{striker.sixes}",
+        "bat2_name": non_striker.name,
+        "bat2_stats": f"{non_striker.runs} ({non_striker.balls}) 4s:{non_striker.fours} 6s:{non_striker.sixes}",
+        "bowler": f"{bowler.name} {bowler.figures()}",
+        "extras": f"Extras {innings.extras_total()} (W:{wides} NB:{noballs} B:{byes} LB:{legbyes})",
+        "rr": f"RR: {innings.run_rate():.2f}",
+        "target": f"Need {required[0]} off {required[1]} (RRR: {required[2]:.2f})" if required else ""
+    }
+    if analytics is not None:
+        values.update(analytics.values())
+    return values
+
+
+class ScoreboardView:
+    """Diffing view model in front of the scoreboard's Tk variables.
+
+    invalidate() is all a scoring action pays: it schedules one after_idle
+    repaint, and any further invalidations before that runs are merged
+    into it. The repaint computes the values once and only sets the Tk
+    variables whose text actually changed; listeners get just the changed
+    fields (and are skipped when nothing changed).
+    """
+
+    def __init__(self, root, variables, compute):
+        self.root = root
+        self.variables = variables
+        self.compute = compute
+        self.values = {}
+        self.listeners = []
+        self._scheduled = None
+        # Registered once, so scheduling a repaint doesn't create a Tcl command each time
+        self._idle_command = root.register(self._idle)
+        self.invalidations = 0
+        self.repaints = 0
+        self.variable_sets = 0
+        self.repaint_time = DelayTracker()
+
+    def invalidate(self):
+        self.invalidations += 1
+        if self._scheduled is None:
+            self._scheduled = self.root.tk.call('after', 'idle', self._idle_command)
+
+    def _idle(self):
+        self._scheduled = None
+        self.flush()
+
+    def flush(self):
+        """Repaint now; also safe to call directly when a repaint can't wait"""
+        if self._scheduled is not None:
+            self.root.tk.call('after', 'cancel', self._scheduled)
+            self._scheduled = None
+        start = time.perf_counter()
+        changed = {}
+        for name, value in self.compute().items():
+            if self.values.get(name) != value:
+                self.values[name] = value
+                changed[name] = value
+                variable = self.variables.get(name)
+                if variable is not None:
+                    variable.set(value)
+        self.repaints += 1
+        self.variable_sets += len(changed)
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+        self.repaint_time.record((time.perf_counter() - start) * 1000)
+        return changed
+
+    def stats(self):
+        return {
+            "invalidations": self.invalidations,
+            "repaints": self.repaints,
+            "variable_sets": self.variable_sets,
+            "repaint_time": self.repaint_time.summary()
+        }
+
+
+if __name__ == "__main__":
+    # Tk-thread cost per scoring click: old eager update vs coalesced diffing view
+    import tkinter as tk
+    from match_engine import MatchEngine
+
+    interp = tk.Tcl()
+    names = list(scoreboard_values(MatchEngine()))
+    clicks, burst = 3000, 3
+
+    engine = MatchEngine()
+    variables = {name: tk.StringVar(master=interp) for name in names}
+    eager_sets = 0
+    start = time.perf_counter()
+    for i in range(clicks):
+        engine.add_runs(i % 3)
+        # Innings switches and undo/redo used to repaint twice per click
+        for _ in range(1 + (i % burst == 0)):
+            for name, value in scoreboard_values(engine).items():
+                variables[name].set(value)
+                eager_sets += 1
+    eager = (time.perf_counter() - start) * 1e6 / clicks
+
+    engine = MatchEngine()
+    view = ScoreboardView(interp, {name: tk.StringVar(master=interp) for name in names},
+                          lambda: scoreboard_values(engine))
+    start = time.perf_counter()
+    for i in range(clicks):
+        engine.add_runs(i % 3)
+        for _ in range(1 + (i % burst == 0)):
+            view.invalidate()
+        if i % burst == burst - 1:
+            interp.update()  # idle: a burst of clicks is repainted once
+    interp.update()
+    coalesced = (time.perf_counter() - start) * 1e6 / clicks
+    stats = view.stats()
+    print(f"eager: {eager:.1f} us/click ({eager_sets} variable sets), coalesced view: {coalesced:.1f} us/click "
+          f"({stats['repaints']} repaints, {stats['variable_sets']} variable sets) for {clicks} clicks")
@@ -0,0 +1,317 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fanout import CHUNK_SIZE, Relay
+from recording import Recording, SEGMENT_NAME
+
+logger = logging.getLogger(__name__)
+
+READ_BYTES = 16 * CHUNK_SIZE
+REWIND_S = 2.0
+
+
+class Spool(Recording):
+    """Store-and-forward spool: the program feed on disk, read back by each uploader.
+
+    A Recording (segments, keyframe index, scoring events) whose writer
+    also tells readers what has reached the disk. Each destination reads
+    through a SpoolReader at its own position, so a stalled uplink only
+    falls behind and then catches up faster than real time, and the venue
+    keeps the full-quality feed. Disk use is capped at max_bytes: the
+    oldest segments are deleted first, and a reader that was still on one
+    skips ahead to the oldest footage left. Positions are (segment, byte
+    offset) pairs.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 ** 3, segment_s=300.0, max_queue=4096):
+        self.max_bytes = max_bytes
+        self.sizes = OrderedDict()  # segment -> bytes on disk, oldest first
+        self.disk_bytes = 0
+        self.evicted = {}  # segment -> bytes it had when it was deleted
+        self.evicted_bytes = 0
+        self.closed = False
+        self.positions = {}  # destination name -> where its last reader got to
+        self.keyframe_positions = deque()  # (segment, offset), for the segments still on disk
+        self.keyframe_times = deque()
+        self.cond = threading.Condition()
+        super().__init__(directory, segment_s, max_queue)
+
+    def _index_keyframe(self, t, offset):
+        super()._index_keyframe(t, offset)
+        with self.cond:
+            self.keyframe_positions.append((self.segments, offset))
+            self.keyframe_times.append(t)
+
+    def _open_segment(self, t):
+        finished, size = self.segments, self._offset
+        super()._open_segment(t)
+        with self.cond:
+            if finished:
+                self._resize(finished, size)
+            self.sizes[self.segments] = 0
+        self._evict()
+
+    def _flushed(self):
+        super()._flushed()
+        with self.cond:
+            if self.segments:
+                self._resize(self.segments, self._offset)
+            self.cond.notify_all()
+        self._evict()
+
+    def _resize(self, segment, size):
+        self.disk_bytes += size - self.sizes.get(segment, 0)
+        self.sizes[segment] = size
+
+    def _evict(self):
+        """Delete the oldest segments until under max_bytes (never the one being written)"""
+        while True:
+            with self.cond:
+                if self.disk_bytes <= self.max_bytes or len(self.sizes) < 2:
+                    return
+                segment, size = self.sizes.popitem(last=False)
+                self.disk_bytes -= size
+                self.evicted[segment] = size
+                self.evicted_bytes += size
+                while self.keyframe_positions and self.keyframe_positions[0][0] <= segment:
+                    self.keyframe_positions.popleft()
+                    self.keyframe_times.popleft()
+            logger.warning(f"Spool over {self.max_bytes / 1e6:.0f} MB, evicting segment {segment}")
+            try:
+                os.remove(os.path.join(self.directory, SEGMENT_NAME.format(segment)))
+            except OSError as e:
+                logger.warning(f"Could not delete spool segment {segment}: {e}")
+
+    def _finish(self):
+        super()._finish()
+        with self.cond:
+            if self.segments:
+                self._resize(self.segments, self._offset)
+            self.closed = True
+            self.cond.notify_all()
+
+    def live_position(self):
+        """The latest keyframe, where a new destination starts"""
+        with self.cond:
+            if self.keyframe_positions:
+                return self.keyframe_positions[-1]
+            return (self.segments, self._offset) if self.segments else (1, 0)
+
+    def oldest_position(self):
+        with self.cond:
+            return self.keyframe_positions[0] if self.keyframe_positions else self.live_position()
+
+    def resume_position(self, position, rewind_s=REWIND_S):
+        """A keyframe at least rewind_s before position, covering what died in the last uploader's buffers"""
+        with self.cond:
+            if not self.keyframe_positions or position < self.keyframe_positions[0]:
+                return self.oldest_position()
+            index = bisect.bisect_right(self.keyframe_positions, position) - 1
+            t = self.keyframe_times[index] - rewind_s
+            while index > 0 and self.keyframe_times[index] > t:
+                index -= 1
+            return self.keyframe_positions[index]
+
+    def lag_bytes(self, position):
+        with self.cond:
+            segment, offset = position
+            return sum(size for s, size in self.sizes.items() if s >= segment) - (offset if segment in self.sizes
+                                                                                else 0)
+
+    def lag_seconds(self, position):
+        """How far behind live a reader at position is: 0 within the latest GOP, else since the next keyframe"""
+        with self.cond:
+            index = bisect.bisect_right(self.keyframe_positions, position)
+            if index >= len(self.keyframe_positions):
+                return 0.0
+            return max(0.0, self.now() - self.keyframe_times[index])
+
+    def reader(self, name, resume=True):
+        """A reader for destination name: where its previous reader stopped, else live"""
+        position = self.positions.get(name)
+        position = self.resume_position(position) if resume and position else self.live_position()
+        self.positions[name] = position
+        return SpoolReader(self, name, position)
+
+    def forget(self, name):
+        """The destination was stopped on purpose; its next start is live"""
+        self.positions.pop(name, None)
+
+    def relay(self, owner, name, output_url, telemetry=None, output_args=None):
+        """Relay factory for FanoutEncoder: a destination that reads from the spool"""
+        return SpoolRelay(owner, name, output_url, self.reader(name), telemetry=telemetry, output_args=output_args)
+
+    def stats(self):
+        stats = super().stats()
+        with self.cond:
+            stats.update({
+                "disk_bytes": self.disk_bytes,
+                "max_bytes": self.max_bytes,
+                "evicted_segments": len(self.evicted),
+                "evicted_bytes": self.evicted_bytes
+            })
+        return stats
+
+
+class SpoolReader:
+    """Reads the spool sequentially from a position, waiting at the live edge"""
+
+    def __init__(self, spool, name, position):
+        self.spool = spool
+        self.name = name
+        self.position = position
+        self.skipped_bytes = 0
+        self._file = None
+        self._file_segment = None
+
+    def read(self, max_bytes=READ_BYTES, timeout=1.0):
+        """Up to max_bytes from the position; b'' on timeout, None once the spool is closed and read"""
+        spool = self.spool
+        with spool.cond:
+            while True:
+                segment, offset = self.position
+                if spool.sizes and segment < next(iter(spool.sizes)):
+                    # Evicted under us: carry on from the oldest footage left
+                    oldest = spool.oldest_position()
+                    self.skipped_bytes += sum(spool.evicted.get(s, 0) for s in range(segment, oldest[0])) - offset
+                    self.skipped_bytes += oldest[1]
+                    logger.warning(f"{self.name}: spool evicted segment {segment} before it was sent")
+                    self.position = oldest
+                    continue
+                available = spool.sizes.get(segment, 0) - offset
+                if available > 0:
+                    break
+                if segment < spool.segments:
+                    self.position = (segment + 1, 0)
+                    continue
+                if spool.closed:
+                    return None
+                if not spool.cond.wait(timeout):
+                    return b''
+        data = self._read_file(segment, offset, min(available, max_bytes))
+        self.position = (segment, offset + len(data))
+        spool.positions[self.name] = self.position
+        return data
+
+    def _read_file(self, segment, offset, size):
+        if self._file_segment != segment:
+            self.close()
+            try:
+                self._file = open(os.path.join(self.spool.directory, SEGMENT_NAME.format(segment)), 'rb')
+            except OSError:
+                return b''
+            self._file_segment = segment
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def lag_bytes(self):
+        return self.spool.lag_bytes(self.position)
+
+    def lag_seconds(self):
+        return self.spool.lag_seconds(self.position)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = self._file_segment = None
+
+
+class SpoolRelay(Relay):
+    """A fan-out destination fed from the spool instead of an in-memory queue.
+
+    The stream-copy FFmpeg gets the spooled feed as fast as it will take
+    it, so after a stall or a reconnect it catches up faster than real
+    time. When the supervisor brings a dropped destination back, the new
+    relay resumes a little before where the old one stopped rather than at
+    the live edge, so no footage is missed.
+    """
+
+    def __init__(self, owner, name, output_url, reader, telemetry=None, output_args=None):
+        super().__init__(owner, name, output_url, max_chunks=1, telemetry=telemetry, output_args=output_args)
+        self.reader = reader
+
+    def push(self, chunk):
+        # Pulls from the spool instead
+        pass
+
+    def queue_depth(self):
+        return self.reader.lag_bytes() // CHUNK_SIZE
+
+    def backlog_bytes(self):
+        # Catching up after an outage isn't congestion; the socket's own send queue shows that
+        return 0
+
+    def _write_loop(self):
+        stdin = self.process.stdin
+        while self.alive:
+            data = self.reader.read()
+            if data is None:
+                break
+            if not data:
+                continue
+            try:
+                stdin.write(data)
+            except (BrokenPipeError, OSError, ValueError) as e:
+                logger.warning(f"Relay {self.name} failed: {e}")
+                break
+        self.alive = False
+        self.reader.close()
+        try:
+            stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def close(self, encoder_failed=False):
+        self.encoder_failed = self.encoder_failed or encoder_failed
+        self.alive = False
+
+    def terminate(self):
+        self.reader.spool.forget(self.name)
+        super().terminate()
+
+
+if __name__ == "__main__":
+    # A 6 Mb/s feed whose uplink stalls for 10 s and then runs at twice the feed rate: the uploader
+    # falls behind, catches up from disk, and the capped spool evicts its oldest segments meanwhile
+    import shutil
+    import tempfile
+
+    keyframe = bytes([0x47, 0x41, 0x00, 0x30, 0x07, 0x50]) + b'\0' * 6 + b'\0\0\1\xe0'
+    key_chunk = keyframe + b'\0' * (CHUNK_SIZE - len(keyframe))
+    plain_chunk = bytes([0x47, 0x01, 0x00, 0x10]) + b'\0' * (CHUNK_SIZE - 4)
+    rate = 6_000_000 / 8
+    directory = tempfile.mkdtemp(prefix="spool-")
+    spool = Spool(directory, max_bytes=12 * 1024 * 1024, segment_s=4.0)
+    reader = spool.reader("uplink")
+    run_s, stall = 40, (10, 20)
+    start = time.perf_counter()
+    written = sent = 0
+    next_report = 0
+    while (t := time.perf_counter() - start) < run_s:
+        while written < t * rate:
+            keyframe_due = written % int(2 * rate) < CHUNK_SIZE
+            spool.write(key_chunk if keyframe_due else plain_chunk)
+            written += CHUNK_SIZE
+        budget = 0 if stall[0] <= t < stall[1] else int(2 * rate * 0.05)
+        while budget > 0:
+            data = reader.read(min(budget, READ_BYTES), timeout=0)
+            if not data:
+                break
+            sent += len(data)
+            budget -= len(data)
+        if t >= next_report:
+            stats = spool.stats()
+            print(f"t={t:4.1f} s  uploader {reader.lag_seconds():4.1f} s behind live, "
+                  f"spool {stats['disk_bytes'] / 1e6:4.1f} MB on disk, {stats['evicted_segments']} segments evicted")
+            next_report += 4
+        time.sleep(0.05)
+    spool.close()
+    stats = spool.stats()
+    print(f"{stats['bytes'] / 1e6:.0f} MB spooled in {stats['segments']} segments, cap {spool.max_bytes / 1e6:.0f} MB; "
+          f"uploader sent {sent / 1e6:.0f} MB and skipped {reader.skipped_bytes / 1e6:.1f} MB of evicted footage")
+    reader.close()
+    shutil.rmtree(directory)
@@ -0,0 +1,205 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from events import DelayTracker
+
+logger = logging.getLogger(__name__)
+
+# Output states reported to notify(name, state, process, detail)
+RUNNING, BACKOFF, STOPPED, ENDED, GAVE_UP = "running", "backoff", "stopped", "ended", "gave up"
+
+
+class SupervisedOutput:
+    """Bookkeeping for one supervised FFmpeg output"""
+
+    def __init__(self, name, process, respawn):
+        self.name = name
+        self.process = process
+        self.respawn = respawn
+        self.state = RUNNING
+        self.stop_requested = False
+        self.restart_requested = False
+        self.stop_event = threading.Event()
+        self.attempt = 0
+        self.started_at = time.perf_counter()
+        self.failed_at = None
+        self.retry_at = None
+        self.uptime = 0.0
+        self.restarts = 0
+        self.crashes = 0
+        self.last_exit = None
+        self.recent_restarts = deque()
+        self.recover_time = DelayTracker()
+
+
+class StreamSupervisor:
+    """Keeps FFmpeg outputs up through ingest hiccups.
+
+    watch() takes a running process (anything with wait/terminate, such as
+    a Popen, a fan-out Relay or a FanoutEncoder) and a respawn() callable
+    that starts a fresh one with the same settings. When the process exits
+    on its own with an error it is respawned after a jittered exponential
+    backoff (base_delay doubling up to max_delay, reset once an attempt has
+    stayed up for healthy_after_s). An output that needs more than
+    storm_limit restarts within storm_window_s is given up on rather than
+    hammering the ingest server. stop() is a clean stop and is never
+    restarted; an exit code of 0 means the input ended and isn't restarted
+    either (a relay cut off by a failed shared encoder reports an error).
+    restart() is a deliberate restart (e.g. with new encoder settings):
+    immediate, and not counted as a crash.
+
+    Each output has a watcher thread; notify is called from it, so the
+    app should hand it over to its own thread.
+    """
+
+    def __init__(self, notify=None, base_delay=1.0, max_delay=30.0, storm_limit=8, storm_window_s=300.0,
+                 healthy_after_s=30.0):
+        self.notify = notify
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.storm_limit = storm_limit
+        self.storm_window_s = storm_window_s
+        self.healthy_after_s = healthy_after_s
+        self.outputs = {}
+        self.lock = threading.Lock()
+
+    def watch(self, name, process, respawn):
+        output = SupervisedOutput(name, process, respawn)
+        with self.lock:
+            self.outputs[name] = output
+        threading.Thread(target=self._watch, args=(output,), name=f"supervise-{name}", daemon=True).start()
+        return output
+
+    def stop(self, name):
+        """Clean stop: terminate the output and don't bring it back"""
+        with self.lock:
+            output = self.outputs.get(name)
+        if output is None or output.stop_requested:
+            return
+        output.stop_requested = True
+        output.stop_event.set()
+        if output.process is not None:
+            output.process.terminate()
+
+    def restart(self, name, respawn=None):
+        """Terminate the output and start it again right away, with respawn if given"""
+        with self.lock:
+            output = self.outputs.get(name)
+        if output is None or output.stop_requested:
+            return
+        if respawn is not None:
+            output.respawn = respawn
+        output.restart_requested = True
+        if output.process is not None:
+            output.process.terminate()
+
+    def backoff_delay(self, attempt):
+        # "Equal jitter": at least half the exponential delay, so retries spread out but never bunch up early
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _set_state(self, output, state, detail=""):
+        output.state = state
+        if self.notify:
+            self.notify(output.name, state, output.process, detail)
+
+    def _watch(self, output):
+        while True:
+            returncode = output.process.wait()
+            now = time.perf_counter()
+            ran_for = now - output.started_at
+            output.uptime += ran_for
+            output.last_exit = returncode
+            if output.stop_requested:
+                self._set_state(output, STOPPED)
+                return
+            if output.restart_requested:
+                output.restart_requested = False
+                if self._restart(output):
+                    continue
+                returncode = returncode or -1  # couldn't come back: treat it as a crash
+            elif returncode == 0:
+                logger.info(f"{output.name} finished (input ended)")
+                self._set_state(output, ENDED, "input ended")
+                return
+
+            output.crashes += 1
+            output.failed_at = now
+            if ran_for >= self.healthy_after_s:
+                output.attempt = 0
+            logger.warning(f"{output.name} exited with {returncode} after {ran_for:.1f} s")
+            if not self._respawn(output):
+                return
+
+    def _restart(self, output):
+        try:
+            process = output.respawn()
+        except Exception as e:
+            logger.warning(f"{output.name}: restart failed: {e}")
+            return False
+        output.process = process
+        if output.stop_requested:
+            process.terminate()
+        output.started_at = time.perf_counter()
+        logger.info(f"{output.name} restarted on request")
+        self._set_state(output, RUNNING, "restarted")
+        return True
+
+    def _respawn(self, output):
+        """Back off and restart until it works; False when stopped or given up"""
+        while True:
+            now = time.perf_counter()
+            recent = output.recent_restarts
+            while recent and now - recent[0] > self.storm_window_s:
+                recent.popleft()
+            if len(recent) >= self.storm_limit:
+                logger.error(f"{output.name}: {len(recent)} restarts in {self.storm_window_s:.0f} s, giving up")
+                self._set_state(output, GAVE_UP, f"{len(recent)} restarts in {self.storm_window_s:.0f} s")
+                return False
+
+            delay = self.backoff_delay(output.attempt)
+            output.attempt += 1
+            output.retry_at = now + delay
+            self._set_state(output, BACKOFF, f"reconnecting in {delay:.1f} s")
+            if output.stop_event.wait(delay):
+                self._set_state(output, STOPPED)
+                return False
+
+            recent.append(time.perf_counter())
+            try:
+                process = output.respawn()
+            except Exception as e:
+                logger.warning(f"{output.name}: restart failed: {e}")
+                continue
+            output.process = process
+            if output.stop_requested:
+                # stop() raced with the respawn
+                process.terminate()
+            output.restarts += 1
+            output.started_at = time.perf_counter()
+            output.retry_at = None
+            recover_ms = (output.started_at - output.failed_at) * 1000
+            output.recover_time.record(recover_ms)
+            logger.info(f"{output.name} restarted (attempt {output.attempt}) {recover_ms:.0f} ms after the failure")
+            self._set_state(output, RUNNING, "reconnected")
+            return True
+
+    def stats(self, name):
+        with self.lock:
+            output = self.outputs.get(name)
+        if output is None:
+            return None
+        now = time.perf_counter()
+        up = output.uptime + (now - output.started_at if output.state == RUNNING else 0.0)
+        return {
+            "state": output.state,
+            "uptime_s": up,
+            "restarts": output.restarts,
+            "crashes": output.crashes,
+            "last_exit": output.last_exit,
+            "retry_in_s": max(0.0, output.retry_at - now) if output.retry_at else 0.0,
+            "recover_time": output.recover_time.summary()
+        }
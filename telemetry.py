@@ -0,0 +1,155 @@
+import logging
+import os
+import selectors
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Makes FFmpeg write machine-readable key=value progress blocks to stderr
+PROGRESS_ARGS = ['-progress', 'pipe:2', '-nostats']
+
+
+def _parse_number(value, suffix=""):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+class EncoderTelemetry:
+    """Drains every FFmpeg process's stderr and keeps live encoder stats.
+
+    One selector thread services all registered processes so no pipe can
+    fill up and stall an encoder. Progress blocks (from PROGRESS_ARGS) are
+    parsed into per-name stats; other lines are kept as recent log output.
+    Registering a name again (a restarted encoder) starts a fresh entry;
+    the replaced process is still drained, but no longer counts.
+    """
+
+    def __init__(self, log_lines=20):
+        self.log_lines = log_lines
+        self.stats = {}
+        self.lock = threading.Lock()
+        self._pending = []
+        self._streams = {}
+        self._selector = None
+        self._wakeup_r = self._wakeup_w = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        if os.name == 'nt':
+            # Windows selectors can't wait on pipes; register() drains with a thread per process there
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        threading.Thread(target=self._run, name="encoder-telemetry", daemon=True).start()
+
+    def register(self, name, process, queue_depth=None):
+        """Start draining process.stderr under name; queue_depth is an optional callable"""
+        # Each drain feeds the entry it was registered with, so a replaced process can't touch its successor's
+        entry = {
+            "fps": 0.0, "bitrate_kbps": 0.0, "speed": 0.0, "frame": 0,
+            "drop_frames": 0, "dup_frames": 0, "queue_depth": 0,
+            "updated": 0.0, "running": True, "log": deque(maxlen=self.log_lines),
+            "_queue_depth": queue_depth, "_block": {}, "_partial": b""
+        }
+        with self.lock:
+            self.stats[name] = entry
+        if os.name == 'nt':
+            threading.Thread(target=self._drain_blocking, args=(entry, process.stderr), daemon=True).start()
+            return
+        with self.lock:
+            self._pending.append((entry, process.stderr))
+        os.write(self._wakeup_w, b"x")
+
+    def _run(self):
+        while self.running:
+            for key, _ in self._selector.select(timeout=1.0):
+                if key.data is None:
+                    try:
+                        os.read(self._wakeup_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                entry, stream = key.data
+                try:
+                    data = os.read(stream.fileno(), 65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if data:
+                    self._feed(entry, data)
+                else:
+                    self._selector.unregister(stream)
+                    stream.close()
+                    self._finish(entry)
+            with self.lock:
+                pending, self._pending = self._pending, []
+            for entry, stream in pending:
+                os.set_blocking(stream.fileno(), False)
+                self._selector.register(stream, selectors.EVENT_READ, (entry, stream))
+
+    def _drain_blocking(self, entry, stream):
+        for line in iter(stream.readline, b""):
+            self._feed(entry, line)
+        self._finish(entry)
+
+    def _feed(self, entry, data):
+        with self.lock:
+            lines = (entry["_partial"] + data).split(b"\n")
+            entry["_partial"] = lines.pop()
+            for raw in lines:
+                line = raw.decode(errors="replace").strip()
+                key, sep, value = line.partition("=")
+                if sep and key.isidentifier():
+                    entry["_block"][key] = value
+                    if key == "progress":
+                        self._apply_block(entry)
+                elif line:
+                    entry["log"].append(line)
+
+    def _apply_block(self, entry):
+        block, entry["_block"] = entry["_block"], {}
+        entry["fps"] = _parse_number(block.get("fps", "0"))
+        entry["bitrate_kbps"] = _parse_number(block.get("bitrate", "0"), "kbits/s")
+        entry["speed"] = _parse_number(block.get("speed", "0"), "x")
+        entry["frame"] = int(_parse_number(block.get("frame", "0")))
+        entry["drop_frames"] = int(_parse_number(block.get("drop_frames", "0")))
+        entry["dup_frames"] = int(_parse_number(block.get("dup_frames", "0")))
+        entry["updated"] = time.time()
+
+    def _finish(self, entry):
+        with self.lock:
+            entry["running"] = False
+            entry["fps"] = entry["bitrate_kbps"] = entry["speed"] = 0.0
+
+    def snapshot(self, name=None):
+        """Current stats for one name, or all of them"""
+        with self.lock:
+            names = [name] if name is not None else list(self.stats)
+            result = {}
+            for key in names:
+                entry = self.stats.get(key)
+                if entry is None:
+                    continue
+                queue_depth = entry["_queue_depth"]
+                entry["queue_depth"] = queue_depth() if queue_depth and entry["running"] else 0
+                result[key] = {k: (list(v) if k == "log" else v)
+                               for k, v in entry.items() if not k.startswith("_")}
+        return result.get(name) if name is not None else result
+
+    def stop(self):
+        self.running = False
+        if self._wakeup_w is not None:
+            os.write(self._wakeup_w, b"x")